@@ -409,6 +409,83 @@ class BGLBufferedRender:
             self.count = len(pos)
             self.render_indices = False
 
+    @profiler.profile
+    def buffer_subdata(self, offset, pos, norm):
+        '''
+        overwrites a range of the position and normal VBOs, starting at
+        element offset.  range must lie within what was last buffered
+        '''
+        sizeOfFloat = 4
+        count = len(pos)
+        if count == 0: return
+        assert len(norm) == count, ('All arrays must contain '
+                                    'the same number of elements')
+        assert not self.render_indices and offset + count <= self.count, (
+            'Range must be within buffered elements '
+            '(%d + %d > %d)' % (offset, count, self.count))
+
+        try:
+            buf_pos = bgl.Buffer(bgl.GL_FLOAT, [count, 3], pos)
+            buf_norm = bgl.Buffer(bgl.GL_FLOAT, [count, 3], norm)
+        except Exception as e:
+            print(
+                'ERROR (buffer_subdata): caught exception while '
+                'buffering to Buffer ' + str(e))
+            raise e
+        try:
+            bgl.glBindBuffer(bgl.GL_ARRAY_BUFFER, self.vbo_pos)
+            bgl.glBufferSubData(bgl.GL_ARRAY_BUFFER,
+                                offset * 3 * sizeOfFloat,
+                                count * 3 * sizeOfFloat, buf_pos)
+            self._check_error('buffer_subdata: vbo_pos')
+            bgl.glBindBuffer(bgl.GL_ARRAY_BUFFER, self.vbo_norm)
+            bgl.glBufferSubData(bgl.GL_ARRAY_BUFFER,
+                                offset * 3 * sizeOfFloat,
+                                count * 3 * sizeOfFloat, buf_norm)
+            self._check_error('buffer_subdata: vbo_norm')
+        except Exception as e:
+            print(
+                'ERROR (buffer_subdata): caught exception while '
+                'buffering from Buffer ' + str(e))
+            raise e
+        finally:
+            bgl.glBindBuffer(bgl.GL_ARRAY_BUFFER, 0)
+        del buf_pos, buf_norm
+
+    @profiler.profile
+    def buffer_selection(self, sel):
+        '''
+        re-uploads only the selection VBO.  pos and norm are left untouched,
+        so sel must have same number of elements as last call to buffer()
+        '''
+        sizeOfFloat = 4
+        count = len(sel)
+        if count == 0: return
+        assert not self.render_indices and count == self.count, (
+            'Selection must contain same number of elements as buffered '
+            '(%d != %d)' % (count, self.count))
+
+        try:
+            buf_sel = bgl.Buffer(bgl.GL_FLOAT, count, sel)
+        except Exception as e:
+            print(
+                'ERROR (buffer_selection): caught exception while '
+                'buffering to Buffer ' + str(e))
+            raise e
+        try:
+            bgl.glBindBuffer(bgl.GL_ARRAY_BUFFER, self.vbo_sel)
+            bgl.glBufferSubData(bgl.GL_ARRAY_BUFFER, 0, count * 1 *
+                                sizeOfFloat, buf_sel)
+            self._check_error('buffer_selection: vbo_sel')
+        except Exception as e:
+            print(
+                'ERROR (buffer_selection): caught exception while '
+                'buffering from Buffer ' + str(e))
+            raise e
+        finally:
+            bgl.glBindBuffer(bgl.GL_ARRAY_BUFFER, 0)
+        del buf_sel
+
     @profiler.profile
     def _check_error(self, title):
         if not self.DEBUG_CHKERR:
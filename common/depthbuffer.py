@@ -0,0 +1,158 @@
+'''
+Copyright (C) 2018 CG Cookie
+http://cgcookie.com
+hello@cgcookie.com
+
+Created by Jonathan Denning, Jonathan Williamson
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import numpy as np
+
+from .profiler import profiler
+
+
+class DepthBuffer:
+    '''
+    DepthBuffer is a software (CPU) depth buffer, used to answer whether
+    points are occluded by triangles without ray casting each point.
+
+    triangles are rasterized (vectorized with numpy) at pixel centers of a
+    buffer that can be smaller than the region (scale).  depths are view
+    depths (distance along view direction), which are interpolated
+    perspective-correctly.
+
+    because the buffer is sampled, each pixel also keeps the min and max
+    depth of its 3x3 neighborhood.  a point is only reported as visible or
+    hidden if that answer holds for the whole neighborhood; otherwise (near
+    depth discontinuities and silhouettes) it is unsure, and caller should
+    fall back to ray casting
+    '''
+
+    VISIBLE = 1
+    HIDDEN = 0
+    UNSURE = -1
+
+    max_candidates = 1 << 22    # max pixel candidates rasterized at once
+
+    def __init__(self, width, height, scale=0.5, perspective=True):
+        self.scale = scale
+        self.width = max(1, int(width * scale))
+        self.height = max(1, int(height * scale))
+        self.perspective = perspective
+        self.depth = np.full((self.height, self.width), np.inf)
+        self.depth_min = None
+        self.depth_max = None
+        self.unsure_all = False
+
+    @profiler.profile
+    def add_tris(self, xys, depths, tris):
+        '''
+        rasterizes triangles.  xys are Nx2 region coords (NaN if point
+        cannot be projected), depths are view depths of the N points, and
+        tris are Tx3 indices into xys
+        '''
+        tris = np.asarray(tris, dtype=np.int64).reshape((-1, 3))
+        if not len(tris): return
+        p = np.asarray(xys, dtype=np.float64)[tris] * self.scale
+        z = np.asarray(depths, dtype=np.float64)[tris]
+        behind = np.isnan(p).any(axis=2)
+        if self.perspective:
+            # in orthographic views, near clip is not at view origin, so
+            # points with depth <= 0 can still be in front of it
+            behind |= ~(z > 0)
+        if (behind.any(axis=1) & ~behind.all(axis=1)).any():
+            # triangle crosses the view plane, so its footprint is unbounded
+            self.unsure_all = True
+        ok = ~behind.any(axis=1)
+        p, z = p[ok], z[ok]
+
+        # pixels with centers inside triangle bbox
+        x0 = np.clip(np.ceil(p[:, :, 0].min(axis=1) - 0.5), 0, self.width).astype(np.int64)
+        x1 = np.clip(np.floor(p[:, :, 0].max(axis=1) - 0.5), -1, self.width - 1).astype(np.int64)
+        y0 = np.clip(np.ceil(p[:, :, 1].min(axis=1) - 0.5), 0, self.height).astype(np.int64)
+        y1 = np.clip(np.floor(p[:, :, 1].max(axis=1) - 0.5), -1, self.height - 1).astype(np.int64)
+        w, h = x1 - x0 + 1, y1 - y0 + 1
+        counts = np.where((w > 0) & (h > 0), w * h, 0)
+
+        # rasterize in batches to limit memory
+        ends = np.cumsum(counts)
+        i0 = 0
+        while i0 < len(counts):
+            i1 = max(i0 + 1, int(np.searchsorted(ends, ends[i0] - counts[i0] + self.max_candidates, side='right')))
+            sl = slice(i0, i1)
+            self._raster(p[sl], z[sl], x0[sl], y0[sl], w[sl], counts[sl])
+            i0 = i1
+
+    def _raster(self, p, z, x0, y0, w, counts):
+        total = int(counts.sum())
+        if not total: return
+        which = np.repeat(np.arange(len(counts)), counts)
+        local = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        px = x0[which] + local % w[which]
+        py = y0[which] + local // w[which]
+        c = np.column_stack((px + 0.5, py + 0.5))
+        a, b, d = p[which, 0], p[which, 1], p[which, 2]
+        def cross(u, v): return u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]
+        area = cross(b - a, d - a)
+        w0, w1, w2 = cross(d - b, c - b), cross(a - d, c - d), cross(b - a, c - a)
+        inside = (area != 0) & (
+            ((w0 >= 0) & (w1 >= 0) & (w2 >= 0)) |
+            ((w0 <= 0) & (w1 <= 0) & (w2 <= 0))
+        )
+        if not inside.any(): return
+        which, px, py = which[inside], px[inside], py[inside]
+        area = area[inside]
+        b0, b1, b2 = w0[inside] / area, w1[inside] / area, w2[inside] / area
+        zt = z[which]
+        if self.perspective:
+            depth = 1.0 / (b0 / zt[:, 0] + b1 / zt[:, 1] + b2 / zt[:, 2])
+        else:
+            depth = b0 * zt[:, 0] + b1 * zt[:, 1] + b2 * zt[:, 2]
+        np.minimum.at(self.depth.ravel(), py * self.width + px, depth)
+
+    @profiler.profile
+    def finish(self):
+        ''' computes neighborhood depth bounds.  call after adding all triangles '''
+        h, w = self.height, self.width
+        pad = np.pad(self.depth, 1, mode='edge')
+        lo, hi = self.depth.copy(), self.depth.copy()
+        for dy in range(3):
+            for dx in range(3):
+                s = pad[dy:dy+h, dx:dx+w]
+                np.minimum(lo, s, out=lo)
+                np.maximum(hi, s, out=hi)
+        self.depth_min, self.depth_max = lo, hi
+
+    def test(self, xys, depths, tolerances):
+        '''
+        returns VISIBLE, HIDDEN, or UNSURE for each point (xys in region
+        coords, depths are view depths).  a point is visible if no triangle
+        is nearer than its depth minus tolerance.  points that cannot be
+        projected are HIDDEN
+        '''
+        xys = np.asarray(xys, dtype=np.float64).reshape((-1, 2))
+        res = np.full(len(xys), self.HIDDEN, dtype=np.int8)
+        ok = ~np.isnan(xys).any(axis=1)
+        if self.unsure_all:
+            res[ok] = self.UNSURE
+            return res
+        idx = np.flatnonzero(ok)
+        px = np.clip((xys[idx, 0] * self.scale).astype(np.int64), 0, self.width - 1)
+        py = np.clip((xys[idx, 1] * self.scale).astype(np.int64), 0, self.height - 1)
+        d = np.asarray(depths, dtype=np.float64)[idx] - np.broadcast_to(tolerances, (len(xys),))[idx]
+        lo, hi = self.depth_min[py, px], self.depth_max[py, px]
+        res[idx] = np.where(d <= lo, self.VISIBLE, np.where(d > hi, self.HIDDEN, self.UNSURE))
+        return res
@@ -20,6 +20,9 @@ Created by Jonathan Denning, Jonathan Williamson
 '''
 
 from hashlib import md5
+from itertools import chain
+
+import numpy as np
 
 import bpy
 from bmesh.types import BMesh, BMVert, BMEdge, BMFace
@@ -39,6 +42,9 @@ class Hasher:
     def add(self, s):
         self._hasher.update(bytes(str(s), 'utf8'))
 
+    def add_bytes(self, b):
+        self._hasher.update(b)
+
     def get_hash(self):
         return self._hasher.hexdigest()
 
@@ -62,11 +68,10 @@ def hash_object(obj:bpy.types.Object):
     # get object data to act as a hash
     me = obj.data
     counts = (len(me.vertices), len(me.edges), len(me.polygons), len(obj.modifiers))
-    if me.vertices:
-        bbox = (tuple(min(v.co for v in me.vertices)), tuple(max(v.co for v in me.vertices)))
-    else:
-        bbox = (None, None)
-    vsum   = tuple(sum((v.co for v in me.vertices), Vector((0,0,0))))
+    # bulk copy coords (single pass in C) and hash the raw bytes
+    co = np.empty(len(me.vertices) * 3, dtype=np.float32)
+    me.vertices.foreach_get('co', co)
+    hco    = md5(co.tobytes()).hexdigest()
     xform  = tuple(e for l in obj.matrix_world for e in l)
     mods = []
     for mod in obj.modifiers:
@@ -76,15 +81,140 @@ def hash_object(obj:bpy.types.Object):
             mods += [('DECIMATE', mod.ratio)]
         else:
             mods += [(mod.type)]
-    hashed = (counts, bbox, vsum, xform, hash(obj), str(mods))      # ob.name???
+    hashed = (counts, hco, xform, hash(obj), str(mods))      # ob.name???
     #print(hashed)
     return hashed
 
+def _hash_props(hasher, struct, refs=None):
+    '''
+    hashes all non-collection properties of struct.  pointers are hashed by
+    name; pointed-to objects are added to refs (if given) and the settings of
+    pointed-to textures are hashed, too
+    '''
+    for prop in struct.bl_rna.properties:
+        if prop.identifier in {'rna_type', 'name', 'show_expanded'}: continue
+        if prop.type == 'COLLECTION': continue
+        v = getattr(struct, prop.identifier)
+        if prop.type == 'POINTER':
+            if refs is not None and type(v) is bpy.types.Object: refs.append(v)
+            if isinstance(v, bpy.types.Texture): _hash_props(hasher, v)
+            v = getattr(v, 'name', None)
+        elif getattr(prop, 'is_array', False): v = tuple(v)
+        # enum flags are sets, whose order may differ between sessions
+        elif isinstance(v, set): v = tuple(sorted(v))
+        hasher.add((prop.identifier, v))
+
+def _hash_array(hasher, seq, attr, dtype, size):
+    data = np.empty(len(seq) * size, dtype=dtype)
+    seq.foreach_get(attr, data)
+    hasher.add_bytes(data.tobytes())
+
+def _hash_matrix(hasher, m):
+    hasher.add(tuple(e for l in m for e in l))
+
+def _hash_dependency(hasher, obj:bpy.types.Object, visited):
+    '''
+    hashes transform and deforming data of an object that a mesh depends on.
+    returns False if the data of obj cannot be hashed
+    '''
+    hasher.add((obj.name, obj.type))
+    _hash_matrix(hasher, obj.matrix_world)
+    if obj.type == 'EMPTY': return True
+    if obj.type == 'MESH':
+        if obj.name in visited: return True
+        h = hash_object_data(obj, _visited=visited)
+        hasher.add(h)
+        return h is not None
+    if obj.type == 'ARMATURE':
+        hasher.add(obj.data.pose_position)
+        for pb in obj.pose.bones:
+            hasher.add(pb.name)
+            _hash_matrix(hasher, pb.matrix)
+        return True
+    if obj.type == 'LATTICE':
+        _hash_props(hasher, obj.data)
+        _hash_array(hasher, obj.data.points, 'co_deform', np.float32, 3)
+        return True
+    # curves, surfaces, text, etc. are not hashed
+    return False
+
+def _read_vertex_groups(obj:bpy.types.Object):
+    '''
+    returns vertex groups of obj that are read when evaluating it: groups
+    named by modifiers and shape keys, and groups of deforming bones when
+    obj is deformed by an armature
+    '''
+    names = set()
+    armatures = []
+    for mod in obj.modifiers:
+        for prop in mod.bl_rna.properties:
+            if prop.type == 'STRING' and 'vertex_group' in prop.identifier:
+                names.add(getattr(mod, prop.identifier))
+        if mod.type == 'ARMATURE' and mod.use_vertex_groups and mod.object:
+            armatures.append(mod.object)
+    if obj.parent and obj.parent_type == 'ARMATURE':
+        armatures.append(obj.parent)
+    for arm in armatures:
+        if arm.type != 'ARMATURE': continue
+        names |= {bone.name for bone in arm.data.bones if bone.use_deform}
+    if obj.data.shape_keys:
+        names |= {kb.vertex_group for kb in obj.data.shape_keys.key_blocks}
+    return [vg for vg in obj.vertex_groups if vg.name in names]
+
+def hash_object_data(obj:bpy.types.Object, _visited=None):
+    '''
+    returns content hash (hex string) of mesh data and modifier stack of obj,
+    for keying data derived from evaluated mesh.  unlike hash_object, the
+    transform of obj is not included, but all vertex coords, shape keys, and
+    settings of modifiers are.  objects that deform obj (referenced by
+    modifiers or armature/lattice parents) are hashed by transform and data,
+    and then the transform of obj is included, too.  vertex weights are
+    included only for vertex groups that are read (see _read_vertex_groups).
+    returns None if obj depends on an object whose data cannot be hashed
+    (ex: curves), in which case the evaluated mesh should not be cached
+    '''
+    assert type(obj) is bpy.types.Object, "Only call hash_object_data on mesh objects!"
+    assert type(obj.data) is bpy.types.Mesh, "Only call hash_object_data on mesh objects!"
+    visited = set() if _visited is None else _visited
+    visited.add(obj.name)
+    me = obj.data
+    hasher = Hasher()
+    hasher.add((len(me.vertices), len(me.loops), len(me.polygons)))
+    _hash_array(hasher, me.vertices, 'co',           np.float32, 3)
+    _hash_array(hasher, me.loops,    'vertex_index', np.int32,   1)
+    _hash_array(hasher, me.polygons, 'loop_total',   np.int32,   1)
+    keys = me.shape_keys
+    if keys:
+        # values set by drivers or animation are current, so hashing them is enough
+        hasher.add((keys.use_relative, keys.eval_time, obj.show_only_shape_key, obj.active_shape_key_index))
+        for kb in keys.key_blocks:
+            hasher.add((kb.name, kb.value, kb.mute, kb.relative_key.name, kb.vertex_group, kb.interpolation))
+            _hash_array(hasher, kb.data, 'co', np.float32, 3)
+    refs = []
+    for mod in obj.modifiers:
+        hasher.add(mod.type)
+        _hash_props(hasher, mod, refs)
+    if obj.parent and obj.parent_type in {'ARMATURE', 'LATTICE'}:
+        refs.append(obj.parent)
+    if refs:
+        # deformation by other objects depends on relative transform
+        _hash_matrix(hasher, obj.matrix_world)
+        for ref in refs:
+            if not _hash_dependency(hasher, ref, visited): return None
+    groups = _read_vertex_groups(obj)
+    if groups:
+        # Mesh has no bulk access to weights, so only weights that are read
+        # are hashed (most sources have none, and skip this loop)
+        hasher.add(sorted((vg.index, vg.name) for vg in groups))
+        indices = {vg.index for vg in groups}
+        weights = [(v.index, g.group, g.weight) for v in me.vertices for g in v.groups if g.group in indices]
+        hasher.add_bytes(np.array(weights, dtype=np.float64).tobytes())
+    return hasher.get_hash()
+
 def hash_bmesh(bme:BMesh):
     if bme is None: return None
     assert type(bme) is BMesh, 'Only call hash_bmesh on BMesh objects!'
     counts = (len(bme.verts), len(bme.edges), len(bme.faces))
-    bbox   = BBox(from_bmverts=bme.verts)
-    vsum   = tuple(sum((v.co for v in bme.verts), Vector((0,0,0))))
-    hashed = (counts, tuple(bbox.min) if bbox.min else None, tuple(bbox.max) if bbox.max else None, vsum)
-    return hashed
+    # BMesh has no foreach_get, but fromiter avoids building Vectors and BBox
+    co = np.fromiter(chain.from_iterable(bmv.co for bmv in bme.verts), dtype=np.float32, count=counts[0]*3)
+    return (counts, md5(co.tobytes()).hexdigest())
@@ -23,6 +23,7 @@ from math import sqrt, acos, cos, sin
 from typing import List
 
 import bgl
+import numpy as np
 from mathutils import Matrix, Vector, Quaternion
 from bmesh.types import BMVert
 from mathutils.geometry import intersect_line_plane, intersect_point_tri
@@ -432,6 +433,13 @@ class Plane(Entity3D):
     def signed_distance_to(self, p: Point):
         return (p - self.o).dot(self.n)
 
+    def sides(self, ps):
+        ''' vectorized side() for Nx3 numpy array of points '''
+        d = np.dot(ps - np.array(self.o), np.array(self.n))
+        s = np.sign(d).astype(np.int8)
+        s[np.abs(d) < 0.000001] = 0
+        return s
+
     def project(self, p: Point):
         return p + self.n * (self.o - p).dot(self.n)
 
@@ -684,6 +692,9 @@ class XForm:
             m['imx_d'] = m['mx_d'].inverted()
             m['mx_n'] = m['imx_d'].transposed()
             m['imx_n'] = m['mx_d'].transposed()
+            # largest scaling of a world length into local space (spectral norm)
+            m['w2l_scale'] = float(np.linalg.norm(np.array(m['imx_d']), 2))
+            m['l2w_scale'] = float(np.linalg.norm(np.array(m['mx_d']), 2))
             d[smat] = m
         return d[smat]
 
@@ -702,6 +713,8 @@ class XForm:
         self.mx_d, self.imx_d = mats['mx_d'], mats['imx_d']
         self.mx_n, self.imx_n = mats['mx_n'], mats['imx_n']
         self.mx_t = mats['mx_t']
+        self.w2l_scale = mats['w2l_scale']
+        self.l2w_scale = mats['l2w_scale']
 
         self.fn_l2w_typed = {
             Ray: lambda x: self.l2w_ray(x),
@@ -801,6 +814,14 @@ class XForm:
     def w2l_vector(self, v: Vector) -> Vec:
         return Vec(self.imx_d * v)
 
+    def w2l_distance(self, d: float) -> float:
+        ''' upper bound of local length of any world vector of length d '''
+        return d * self.w2l_scale
+
+    def l2w_distance(self, d: float) -> float:
+        ''' upper bound of world length of any local vector of length d '''
+        return d * self.l2w_scale
+
     def l2w_ray(self, ray: Ray) -> Ray:
         o = self.l2w_point(ray.o)
         d = self.l2w_direction(ray.d)
@@ -831,6 +852,25 @@ class XForm:
     def w2l_bmevrt(self, bmv: BMVert) -> Point:
         return Point(self.imx_p * bmv.co)
 
+    # vectorized versions, working on Nx3 numpy arrays
+
+    @staticmethod
+    def _np_points(mx, ps):
+        m = np.array(mx)
+        return np.dot(ps, m[:3, :3].T) + m[:3, 3]
+
+    @staticmethod
+    def _np_normals(mx, ns):
+        ns = np.dot(ns, np.array(mx).T)
+        l = np.sqrt((ns * ns).sum(axis=1))
+        l[l == 0] = 1
+        return ns / l[:, None]
+
+    def l2w_points(self, ps): return self._np_points(self.mx_p, ps)
+    def w2l_points(self, ps): return self._np_points(self.imx_p, ps)
+    def l2w_normals(self, ns): return self._np_normals(self.mx_n, ns)
+    def w2l_normals(self, ns): return self._np_normals(self.imx_n, ns)
+
     @staticmethod
     def to_bglMatrix(mat):
         # return bgl.Buffer(
@@ -915,8 +955,23 @@ class BBox:
 
 
 class Accel2D:
-    bin_cols = 20
-    bin_rows = 20
+    '''
+    Accel2D bins verts, edges, and faces (projected to 2D) into a grid for
+    fast spatial queries.  the grid is sized by the number of elements (so
+    bins hold only a few elements each), and elements are binned by exact
+    rasterization (edges as segments, faces as triangle fans) rather than
+    their bounding boxes.
+
+    each kind of element is stored as flat integer arrays (CSR): elements
+    in bin b are indices bin_elems[bin_start[b]:bin_start[b+1]]
+
+    update() removes and (re)inserts a few elements without rebuilding:
+    removed elements are marked dead, and inserted elements are appended
+    and binned into small per-bin overflow lists
+    '''
+
+    elems_per_bin = 4
+    max_bins = 1024     # max cols and rows
 
     class SimpleVert:
         def __init__(self, co):
@@ -949,68 +1004,158 @@ class Accel2D:
         return Accel2D(verts, edges, [], Point_to_Point2D)
 
     @profiler.profile
-    def __init__(self, verts, edges, faces, Point_to_Point2D):
+    def __init__(self, verts, edges, faces, Point_to_Point2D, Points_to_Point2Ds=None):
         self.verts = list(verts) if verts else []
         self.edges = list(edges) if edges else []
         self.faces = list(faces) if faces else []
         self.Point_to_Point2D = Point_to_Point2D
-        self.vert_type = type(self.verts[0]) if self.verts else None
-        self.edge_type = type(self.edges[0]) if self.edges else None
-        self.face_type = type(self.faces[0]) if self.faces else None
-        self.bins = {}
-
-        self.v2Ds = [Point_to_Point2D(v.co) for v in verts]
-        self.map_v_v2D = {v: v2d for (v, v2d) in zip(verts, self.v2Ds)}
-        if self.v2Ds:
-            self.min = Point2D((
-                min(x - 0.001 for (x, _) in self.v2Ds),
-                min(y - 0.001 for (_, y) in self.v2Ds)
-            ))
-            self.max = Point2D((
-                max(x + 0.001 for (x, _) in self.v2Ds),
-                max(y + 0.001 for (_, y) in self.v2Ds)
-            ))
+        self.Points_to_Point2Ds = Points_to_Point2Ds
+
+        pr = profiler.start('projecting verts')
+        nv = len(self.verts)
+        self.v2Ds = self._project(self.verts, Points_to_Point2Ds)
+        self.map_v_idx = {v: i for (i, v) in enumerate(self.verts)}
+        self.map_e_idx = {e: i for (i, e) in enumerate(self.edges)}
+        self.map_f_idx = {f: i for (i, f) in enumerate(self.faces)}
+        valid = ~np.isnan(self.v2Ds).any(axis=1)
+        pr.done()
+
+        if valid.any():
+            self.min = Point2D(self.v2Ds[valid].min(axis=0) - 0.001)
+            self.max = Point2D(self.v2Ds[valid].max(axis=0) + 0.001)
         else:
             self.min = Point2D((0, 0))
             self.max = Point2D((1, 1))
         self.size = self.max - self.min
 
+        # size grid so that each bin holds a few elements, keeping bins square-ish
+        count = nv + len(self.edges) + len(self.faces)
+        nbins = max(1, count // self.elems_per_bin)
+        aspect = self.size.x / self.size.y
+        self.bin_cols = int(max(1, min(self.max_bins, round(sqrt(nbins * aspect)))))
+        self.bin_rows = int(max(1, min(self.max_bins, -(-nbins // self.bin_cols))))
+        self._np_min = np.array(self.min)
+        self._np_max = np.array(self.max)
+        self._np_cell = np.array((self.size.x / self.bin_cols, self.size.y / self.bin_rows))
+
+        # incremental updates (see update)
+        self.vert_alive = np.ones(nv, dtype=bool)
+        self.edge_alive = np.ones(len(self.edges), dtype=bool)
+        self.face_alive = np.ones(len(self.faces), dtype=bool)
+        self.vert_extra, self.edge_extra, self.face_extra = {}, {}, {}
+        self.update_count = 0
+        self.max_update_count = max(1024, count // 4)
+
         pr = profiler.start('inserting verts')
-        for (v, v2d) in zip(verts, self.v2Ds):
-            i, j = self.compute_ij(v2d)
-            self._put(i, j, v)
+        vidx = np.flatnonzero(valid)
+        vi, vj = self._compute_ijs(self.v2Ds[vidx])
+        self.vert_bins = self._build_bins(vidx, vi, vj)
         pr.done()
 
         pr = profiler.start('inserting edges')
-        for e in edges:
-            v0, v1 = self.map_v_v2D[e.verts[0]], self.map_v_v2D[e.verts[1]]
-            ij0, ij1 = self.compute_ij(v0), self.compute_ij(v1)
-            mini, minj = min(ij0[0], ij1[0]), min(ij0[1], ij1[1])
-            maxi, maxj = max(ij0[0], ij1[0]), max(ij0[1], ij1[1])
-            for i in range(mini, maxi + 1):
-                for j in range(minj, maxj + 1):
-                    self._put(i, j, e)
-            # v0,v1 = e.verts
-            # self._put_edge(e, self.map_v_v2D[v0], self.map_v_v2D[v1])
+        self.edge_verts = self._elem_verts(self.edges, 2)
+        self.edge_bins = self._build_bins(*self._raster_edges(self.edge_verts))
         pr.done()
 
         pr = profiler.start('inserting faces')
-        for f in faces:
-            v2ds = [self.map_v_v2D[v] for v in f.verts]
-            if not v2ds:
-                continue
-            ijs = list(map(self.compute_ij, v2ds))
-            mini, minj = min(i for (i, j) in ijs), min(j for (i, j) in ijs)
-            maxi, maxj = max(i for (i, j) in ijs), max(j for (i, j) in ijs)
-            for i in range(mini, maxi + 1):
-                for j in range(minj, maxj + 1):
-                    self._put(i, j, f)
-            # v0 = v2ds[0]
-            # for v1,v2 in zip(v2ds[1:-1],v2ds[2:]):
-            #    self._put_face(f, v0, v1, v2)
+        self.tris, tri_counts = self._face_tris(self.faces)
+        self.tri_face = np.repeat(np.arange(len(self.faces), dtype=np.int64), tri_counts)
+        self.face_tri_start = np.concatenate(([0], np.cumsum(tri_counts)))
+        self.tri_valid = self._valid_rows(self.tris)
+        self.face_bins = self._build_bins(*self._raster_tris(self.tris, self.tri_face))
         pr.done()
 
     @profiler.profile
+    def update(self, remove=None, verts=None, edges=None, faces=None, Points_to_Point2Ds=None):
+        '''
+        removes elements, then (re)inserts verts, edges, and faces.  edges
+        and faces are binned using the current positions of their verts in
+        accel, so reinsert edges and faces of any reinserted vert.
+        returns False (and leaves accel untouched) if an inserted vert
+        projects outside of grid or accel has been updated too much, in
+        which case accel should be rebuilt
+        '''
+        verts = list(verts) if verts else []
+        edges = list(edges) if edges else []
+        faces = list(faces) if faces else []
+        remove = list(remove) if remove else []
+
+        self.update_count += len(remove) + len(verts) + len(edges) + len(faces)
+        if self.update_count > self.max_update_count: return False
+        v2Ds = self._project(verts, Points_to_Point2Ds or self.Points_to_Point2Ds)
+        ok = ~np.isnan(v2Ds).any(axis=1)
+        if ((v2Ds[ok] < self._np_min) | (v2Ds[ok] > self._np_max)).any(): return False
+
+        for o in remove:
+            for (m, alive) in ((self.map_v_idx, self.vert_alive), (self.map_e_idx, self.edge_alive), (self.map_f_idx, self.face_alive)):
+                i = m.pop(o, None)
+                if i is not None: alive[i] = False
+
+        nv = len(self.verts)
+        self.verts += verts
+        self.map_v_idx.update((v, nv + i) for (i, v) in enumerate(verts))
+        self.v2Ds = np.concatenate((self.v2Ds, v2Ds))
+        self.vert_alive = np.concatenate((self.vert_alive, np.ones(len(verts), dtype=bool)))
+        vidx = nv + np.flatnonzero(ok)
+        self._put_extra(self.vert_extra, vidx, *self._compute_ijs(self.v2Ds[vidx]))
+
+        ne = len(self.edges)
+        self.edges += edges
+        self.map_e_idx.update((e, ne + i) for (i, e) in enumerate(edges))
+        evs = self._elem_verts(edges, 2)
+        self.edge_verts = np.concatenate((self.edge_verts, evs))
+        self.edge_alive = np.concatenate((self.edge_alive, np.ones(len(edges), dtype=bool)))
+        eidx, ei, ej = self._raster_edges(evs)
+        self._put_extra(self.edge_extra, ne + eidx, ei, ej)
+
+        nf = len(self.faces)
+        self.faces += faces
+        self.map_f_idx.update((f, nf + i) for (i, f) in enumerate(faces))
+        tris, tri_counts = self._face_tris(faces)
+        tri_face = nf + np.repeat(np.arange(len(faces), dtype=np.int64), tri_counts)
+        self.tris = np.concatenate((self.tris, tris))
+        self.tri_face = np.concatenate((self.tri_face, tri_face))
+        self.face_tri_start = np.concatenate((self.face_tri_start, self.face_tri_start[-1] + np.cumsum(tri_counts)))
+        self.tri_valid = np.concatenate((self.tri_valid, self._valid_rows(tris)))
+        self.face_alive = np.concatenate((self.face_alive, np.ones(len(faces), dtype=bool)))
+        self._put_extra(self.face_extra, *self._raster_tris(tris, tri_face))
+
+        return True
+
+    def _project(self, verts, Points_to_Point2Ds):
+        ''' 2D positions of verts (Nx2), with NaN rows for verts that cannot be projected '''
+        nv = len(verts)
+        if Points_to_Point2Ds and nv:
+            cos = np.array([tuple(v.co) for v in verts], dtype=np.float64)
+            return np.asarray(Points_to_Point2Ds(cos), dtype=np.float64).reshape((nv, 2))
+        nan = (float('nan'), float('nan'))
+        return np.array([
+            tuple(p) if p is not None else nan
+            for p in (self.Point_to_Point2D(v.co) for v in verts)
+        ], dtype=np.float64).reshape((nv, 2))
+
+    def _face_tris(self, faces):
+        ''' fan triangulation of faces (Tx3 vert indices) and triangle count per face '''
+        fverts = [[self.map_v_idx.get(v, -1) for v in f.verts] for f in faces]
+        tris = np.array([
+            (fv[0], v1, v2)
+            for fv in fverts
+            for (v1, v2) in zip(fv[1:-1], fv[2:])
+        ], dtype=np.int64).reshape((-1, 3))
+        tri_counts = np.array([max(0, len(fv) - 2) for fv in fverts], dtype=np.int64)
+        return (tris, tri_counts)
+
+    def _put_extra(self, extra, elem, i, j):
+        cells = j * self.bin_cols + i
+        for (c, e) in zip(cells.tolist(), elem.tolist()):
+            extra.setdefault(c, []).append(e)
+
+    def _elem_verts(self, elems, n):
+        return np.array([
+            [self.map_v_idx.get(v, -1) for v in e.verts]
+            for e in elems
+        ], dtype=np.int64).reshape((-1, n))
+
     def compute_ij(self, v2d):
         n = v2d - self.min
         i = int(self.bin_cols * n.x / self.size.x)
@@ -1019,147 +1164,153 @@ class Accel2D:
         j = max(0, min(self.bin_rows - 1, j))
         return (i, j)
 
-    def _put(self, i, j, o):
-        t = (i, j)
-        if t not in self.bins: self.bins[t] = set()
-        self.bins[t].add(o)
+    def _compute_ijs(self, v2ds):
+        ij = np.floor((v2ds - self._np_min) / self._np_cell).astype(np.int64)
+        i = np.clip(ij[:, 0], 0, self.bin_cols - 1)
+        j = np.clip(ij[:, 1], 0, self.bin_rows - 1)
+        return (i, j)
 
-    def _get(self, i, j):
-        t = (i, j)
-        return self.bins.get(t, set())
+    def _valid_rows(self, vidxs):
+        ''' rows of vidxs (Nxk vert indices) where all verts are binned '''
+        ok = (vidxs >= 0).all(axis=1)
+        ok[ok] = ~np.isnan(self.v2Ds[vidxs[ok]]).any(axis=(1, 2))
+        return ok
+
+    def _candidates(self, elem, v2ds):
+        '''
+        expands each element into all cells of its 2D bounding box
+        v2ds is NxKx2.  returns (elem, i, j) arrays and cell corners (Mx4x2)
+        '''
+        i0, j0 = self._compute_ijs(v2ds.min(axis=1))
+        i1, j1 = self._compute_ijs(v2ds.max(axis=1))
+        w, h = i1 - i0 + 1, j1 - j0 + 1
+        counts = w * h
+        which = np.repeat(np.arange(len(elem)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        i = i0[which] + local % w[which]
+        j = j0[which] + local // w[which]
+        # cell corners, grown slightly to be conservative
+        eps = self._np_cell * 0.000001
+        lo = self._np_min + np.column_stack((i, j)) * self._np_cell - eps
+        hi = lo + self._np_cell + 2 * eps
+        corners = np.stack((
+            lo, np.column_stack((hi[:, 0], lo[:, 1])),
+            hi, np.column_stack((lo[:, 0], hi[:, 1])),
+        ), axis=1)
+        return (which, i, j, corners)
 
-    @profiler.profile
-    def clean_invalid(self):
-        self.bins = {
-            t: {o for o in objs if o.is_valid}
-            for (t, objs) in self.bins.items()
-        }
-
-    def _put_edge(self, e, v0, v1, depth=0):
-        i0, j0 = self.compute_ij(v0)
-        i1, j1 = self.compute_ij(v1)
-        if i0 == i1 and j0 == j1:
-            self._put(i0, j0, e)
-        elif i0 == i1:
-            i = i0
-            for j in range(min(j0, j1), max(j0, j1) + 1):
-                self._put(i, j, e)
-        elif j0 == j1:
-            j = j0
-            for i in range(min(i0, i1), max(i0, i1) + 1):
-                self._put(i, j, e)
-        elif depth == 6:
-            self._put(i0, j0, e)
-            self._put(i1, j1, e)
-        else:
-            vm = v0 + (v1 - v0) / 2
-            self._put_edge(e, v0, vm, depth=depth + 1)
-            self._put_edge(e, vm, v1, depth=depth + 1)
-
-    def _put_face(self, f, v0, v1, v2, depth=0):
-        i0, j0 = self.compute_ij(v0)
-        i1, j1 = self.compute_ij(v1)
-        i2, j2 = self.compute_ij(v2)
-        if i0 == i1 and i0 == i2 and j0 == j1 and j0 == j2:
-            self._put(i0, j0, f)
-        elif i0 == i1 and j0 == j1:
-            self._put_edge(f, v0, v2, depth=depth)
-        elif i0 == i2 and j0 == j2:
-            self._put_edge(f, v0, v1, depth=depth)
-        elif i1 == i2 and j1 == j2:
-            self._put_edge(f, v1, v2, depth=depth)
-        elif depth == 6:
-            self._put(i0, j0, f)
-            self._put(i1, j1, f)
-            self._put(i2, j2, f)
-        else:
-            v01 = v0 + (v1 - v0) / 2
-            v12 = v1 + (v2 - v1) / 2
-            v20 = v2 + (v0 - v2) / 2
-            self._put_face(f, v0, v01, v20, depth=depth + 1)
-            self._put_face(f, v1, v12, v01, depth=depth + 1)
-            self._put_face(f, v2, v20, v12, depth=depth + 1)
-
-    @profiler.profile
-    def get(self, v2d, within):
+    @staticmethod
+    def _sides(a, b, corners):
+        ''' which side of line a->b each of the corners lie (Mx4) '''
+        ab = (b - a)[:, None, :]
+        ac = corners - a[:, None, :]
+        return ab[:, :, 0] * ac[:, :, 1] - ab[:, :, 1] * ac[:, :, 0]
+
+    def _raster_edges(self, evs):
+        ok = np.flatnonzero(self._valid_rows(evs))
+        v2ds = self.v2Ds[evs[ok]]
+        which, i, j, corners = self._candidates(ok, v2ds)
+        p0, p1 = v2ds[which, 0], v2ds[which, 1]
+        s = self._sides(p0, p1, corners)
+        # segment touches cell if cell corners are not all on one side
+        hit = (s.min(axis=1) <= 0) & (s.max(axis=1) >= 0)
+        return (ok[which[hit]], i[hit], j[hit])
+
+    def _raster_tris(self, tris, tri_face):
+        ok = np.flatnonzero(self._valid_rows(tris))
+        v2ds = self.v2Ds[tris[ok]]
+        which, i, j, corners = self._candidates(ok, v2ds)
+        p0, p1, p2 = v2ds[which, 0], v2ds[which, 1], v2ds[which, 2]
+        # separating axis test against each triangle edge
+        hit = np.ones(len(which), dtype=bool)
+        for (a, b, c) in ((p0, p1, p2), (p1, p2, p0), (p2, p0, p1)):
+            o = (b - a)[:, 0] * (c - a)[:, 1] - (b - a)[:, 1] * (c - a)[:, 0]
+            s = self._sides(a, b, corners) * np.sign(o)[:, None]
+            hit &= s.max(axis=1) >= 0
+        faces = tri_face[ok[which[hit]]]
+        cells = j[hit] * self.bin_cols + i[hit]
+        # a face may cover a cell with more than one triangle
+        key = np.unique(cells * max(1, len(self.faces)) + faces)
+        faces = key % max(1, len(self.faces))
+        cells = key // max(1, len(self.faces))
+        return (faces, cells % self.bin_cols, cells // self.bin_cols)
+
+    def _build_bins(self, elem, i, j):
+        cells = j * self.bin_cols + i
+        order = np.argsort(cells, kind='mergesort')
+        cells, elem = cells[order], elem[order]
+        start = np.searchsorted(cells, np.arange(self.bin_cols * self.bin_rows + 1))
+        return (start, elem)
+
+    def _get(self, bins, extra, alive, v2d, within):
+        start, elems = bins
+        within = abs(within)    # symmetry snapping passes signed distances
         delta = Vec2D((within, within))
         i0, j0 = self.compute_ij(v2d - delta)
         i1, j1 = self.compute_ij(v2d + delta)
-        l = set()
-        for i in range(i0, i1 + 1):
-            for j in range(j0, j1 + 1):
-                l |= self._get(i, j)
-        return {v for v in l if v.is_valid}
+        cols = self.bin_cols
+        parts = [
+            elems[start[j * cols + i0]:start[j * cols + i1 + 1]]
+            for j in range(j0, j1 + 1)
+        ]
+        if extra:
+            parts += [
+                np.array(extra[c], dtype=np.int64)
+                for j in range(j0, j1 + 1)
+                for c in range(j * cols + i0, j * cols + i1 + 1)
+                if c in extra
+            ]
+        if not parts: return np.zeros(0, dtype=np.int64)
+        idx = np.unique(np.concatenate(parts))
+        return idx[alive[idx]]
+
+    def _get_elems(self, bins, extra, alive, objs, v2d, within):
+        return {o for o in (objs[k] for k in self._get(bins, extra, alive, v2d, within)) if o.is_valid}
+
+    @profiler.profile
+    def get(self, v2d, within):
+        return self.get_verts(v2d, within) | self.get_edges(v2d, within) | self.get_faces(v2d, within)
 
     @profiler.profile
     def get_verts(self, v2d, within):
-        vert_type = self.vert_type
-        return {g for g in self.get(v2d, within) if type(g) is vert_type}
+        return self._get_elems(self.vert_bins, self.vert_extra, self.vert_alive, self.verts, v2d, within)
 
     @profiler.profile
     def get_edges(self, v2d, within):
-        edge_type = self.edge_type
-        return {g for g in self.get(v2d, within) if type(g) is edge_type}
+        return self._get_elems(self.edge_bins, self.edge_extra, self.edge_alive, self.edges, v2d, within)
 
     @profiler.profile
     def get_faces(self, v2d, within):
-        face_type = self.face_type
-        return {g for g in self.get(v2d, within) if type(g) is face_type}
+        return self._get_elems(self.face_bins, self.face_extra, self.face_alive, self.faces, v2d, within)
 
     def nearest_vert(self, v2d):
-        Point_to_Point2D = self.Point_to_Point2D
-        vert_type = self.vert_type
-        x,y = v2d
-        i, j = self.compute_ij(v2d)
-        working = {(i,j)}
-        touched = set()
-        bv,bd = None,0
-        while working:
-            binij = working.pop()
-            if binij in touched: continue
-            touched.add(binij)
-            i,j = binij
-            if i < 0 or j < 0 or i >= self.bin_cols or j >= self.bin_rows: continue
-            mx,my = self.min + Vec2D((self.size.x * i / self.bin_cols, self.size.y * j / self.bin_rows))
-            Mx,My = self.min + Vec2D((self.size.x * (i+1) / self.bin_cols, self.size.y * (j+1) / self.bin_rows))
-            closest = Point2D((mid(x, mx, Mx), mid(y, my, My)))
-            d = (v2d - closest).length
-            if bv and d > bd:
-                # we have seen a vert that is closer than anything in this bin
-                continue
-            for v in self._get(i, j):
-                if type(v) is not vert_type: continue
-                d = (Point_to_Point2D(v.co) - v2d).length
-                if bv and d > bd: continue
-                bv,bd = v,d
-            working |= {(i-1,j-1), (i,j-1), (i+1,j-1), (i-1,j), (i+1,j), (i-1,j+1), (i,j+1), (i+1,j+1)}
-        return Point_to_Point2D(bv.co)
+        d = self.v2Ds - np.array(v2d)
+        d = (d * d).sum(axis=1)
+        d[np.isnan(d) | ~self.vert_alive] = float('inf')
+        if not len(d) or d.min() == float('inf'): return None
+        return Point2D(self.v2Ds[int(np.argmin(d))])
 
     @profiler.profile
     def nearest_face(self, v2d):
         ########################################
         # XXXX: ONLY FINDING FACE UNDER V2D!!! #
         ########################################
-
-        @profiler.profile
-        def intersect_face(bmf):
-            pts = [Point_to_Point2D(bmv.co) for bmv in bmf.verts]
-            pts = [pt for pt in pts if pt]
-            pt0 = pts[0]
-            for pt1, pt2 in zip(pts[1:-1], pts[2:]):
-                if intersect_point_tri(v2d, pt0, pt1, pt2):
-                    return True
-            return False
-
-        Point_to_Point2D = self.Point_to_Point2D
-        face_type = self.face_type
-        i, j = self.compute_ij(v2d)
-        faces = [bmf for bmf in self._get(i, j) if type(bmf) is face_type]
-        for bmf in faces:
-            if not bmf.is_valid:
-                continue
-            if intersect_face(bmf):
-                return bmf
+        faces = self._get(self.face_bins, self.face_extra, self.face_alive, v2d, 0)
+        if not len(faces): return None
+        # test each triangle of candidate faces
+        fts = self.face_tri_start
+        tidx = np.concatenate([np.arange(fts[f], fts[f+1]) for f in faces])
+        tidx = tidx[self.tri_valid[tidx]]
+        if not len(tidx): return None
+        p = np.array(v2d)
+        t = self.v2Ds[self.tris[tidx]]
+        a, b, c = t[:, 0], t[:, 1], t[:, 2]
+        def cross(u, v): return u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]
+        s0, s1, s2 = cross(b - a, p - a), cross(c - b, p - b), cross(a - c, p - c)
+        inside = ((s0 >= 0) & (s1 >= 0) & (s2 >= 0)) | ((s0 <= 0) & (s1 <= 0) & (s2 <= 0))
+        for k in tidx[inside]:
+            f = self.faces[self.tri_face[k]]
+            if f.is_valid: return f
         return None
 
 
@@ -150,6 +150,15 @@ class Profiler:
             text = text or fnname
         return self.ProfilerHelper(self, text)
 
+    def count(self, text):
+        ''' counts an event (ex: cache hit) without timing it '''
+        if Profiler._broken or not Profiler._enabled: return
+        self.d_count[text] = self.d_count.get(text, 0) + 1
+        self.d_times.setdefault(text, 0)
+        self.d_mins.setdefault(text, 0)
+        self.d_maxs.setdefault(text, 0)
+        self.d_last[text] = 0
+
     def __del__(self):
         # self.printout()
         pass
@@ -25,6 +25,7 @@ import sys
 import glob
 import inspect
 import importlib
+from concurrent.futures import ThreadPoolExecutor
 
 import bpy
 from bmesh.types import BMesh, BMVert, BMEdge, BMFace
@@ -157,6 +158,22 @@ def iter_pairs(items, wrap, repeat=False):
         if wrap: yield items[-1],items[0]
         if not repeat: return
 
+def relabel_stages(stages, label):
+    '''
+    steps generator stages, yielding label(stage) for each stage it yields.
+    returns return value of stages (use with `yield from`)
+    '''
+    while True:
+        try: stage = next(stages)
+        except StopIteration as stop: return stop.value
+        yield label(stage)
+
+def run_stages(stages):
+    ''' steps generator stages to the end, and returns its return value '''
+    while True:
+        try: next(stages)
+        except StopIteration as stop: return stop.value
+
 def rotate_cycle(cycle, offset):
     l = len(cycle)
     return [cycle[(l + ((i - offset) % l)) % l] for i in range(l)]
@@ -189,3 +206,64 @@ class UniqueCounter():
     def next():
         UniqueCounter.__counter += 1
         return UniqueCounter.__counter
+
+
+class QueryCache():
+    '''
+    memoizes query results while key stays the same (ex: during one event,
+    where mouse and view do not change).  results are also keyed on a
+    version (ex: of target mesh), which can change while key is the same
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.key = None
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def set_key(self, key):
+        if key == self.key: return
+        self.key = key
+        self.cache = {}
+
+    def clear(self):
+        self.key = None
+        self.cache = {}
+
+    def get(self, query, args, version, fn):
+        k = (query, args, version)
+        if k in self.cache:
+            self.hits += 1
+            profiler.count('%s hit: %s' % (self.name, query))
+            return self.cache[k]
+        self.misses += 1
+        profiler.count('%s miss: %s' % (self.name, query))
+        ret = fn()
+        self.cache[k] = ret
+        return ret
+
+
+class BatchMap():
+    '''
+    maps a function over a batch of items.  large batches are split into
+    chunks that run on a shared thread pool, which only pays off when the
+    function releases the GIL while working (threads <= 1 runs inline)
+    '''
+    executors = {}
+
+    def __init__(self, threads=1, chunk_size=512):
+        self.threads = threads
+        self.chunk_size = chunk_size
+
+    def _executor(self):
+        if self.threads not in BatchMap.executors:
+            BatchMap.executors[self.threads] = ThreadPoolExecutor(max_workers=self.threads)
+        return BatchMap.executors[self.threads]
+
+    def __call__(self, fn, items):
+        items = list(items)
+        if self.threads <= 1 or len(items) <= self.chunk_size:
+            return [fn(item) for item in items]
+        chunks = [items[i:i+self.chunk_size] for i in range(0, len(items), self.chunk_size)]
+        results = self._executor().map(lambda chunk: [fn(item) for item in chunk], chunks)
+        return [r for chunk in results for r in chunk]
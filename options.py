@@ -102,6 +102,7 @@ class Options:
 
         'show tooltips':        True,
         'undo change tool':     False,  # should undo change the selected tool?
+        'undo memory limit':    256,    # max memory (MB, estimated) used by undo stack
 
         'github issues url':    'https://github.com/CGCookie/retopoflow/issues',
         'github new issue url': 'https://github.com/CGCookie/retopoflow/issues/new',
@@ -113,6 +114,19 @@ class Options:
 
         'async mesh loading': True,
 
+        'visibility depth buffer':  True,   # test visibility against a depth buffer of sources (ray cast only when unsure)
+        'visibility buffer scale':  0.5,    # resolution of visibility depth buffer, relative to region
+        'staged startup':           True,   # load sources in stages while UI is responsive
+        'sources merge limit':      0,      # sources with fewer triangles are merged into one BVH (0: do not merge)
+        'sources disk cache':       False,  # keep prepared sources on disk, so they load quickly next time
+        'sources disk cache size':  2048,   # max size (MB) of sources disk cache
+        'target write rate':        4,      # max times per second target is written back to Blender mesh (0: every change)
+        'sources proxies':          True,   # build decimated copies of dense sources for visibility and hovering
+        'sources proxy min tris':   250000, # only sources with at least this many triangles get proxies
+        'sources proxy levels':     2,      # number of proxies per source
+        'sources proxy ratio':      0.2,    # triangle count ratio between successive proxies
+        'sources query threads':    1,      # threads for batched source queries (mathutils BVHTree holds the GIL, so 1)
+
         'tools autocollapse': True,             # should tool's options auto-open/-collapse when switching tools?
         'background gradient': True,
 
@@ -144,6 +158,7 @@ class Options:
         'instrument_filename':  'RetopoFlow_instrument',
         'log_filename':         'RetopoFlow_log',
         'backup_filename':      'RetopoFlow_backup',
+        'cache_foldername':     'RetopoFlow_cache',
         'quickstart_filename':  'RetopoFlow_quickstart',
         'profiler_filename':    'RetopoFlow_profiler.txt',
 
@@ -288,6 +303,10 @@ class Options:
         tempdir = bpy.context.user_preferences.filepaths.temporary_directory
         return os.path.join(tempdir, '%s.%s' % (self['backup_filename'], ext))
 
+    def cache_dirpath(self):
+        tempdir = bpy.context.user_preferences.filepaths.temporary_directory
+        return os.path.join(tempdir, self['cache_foldername'])
+
 
 def rgba_to_float(r, g, b, a): return (r/255.0, g/255.0, b/255.0, a/255.0)
 class Themes:
@@ -33,6 +33,7 @@ import random
 import binascii
 import importlib
 from copy import deepcopy
+from itertools import chain
 
 import bgl
 import bpy
@@ -47,7 +48,7 @@ from .rfcontext_spaces import RFContext_Spaces
 from .rfcontext_target import RFContext_Target
 from .rfcontext_sources import RFContext_Sources
 
-from ..common.utils import get_settings, find_and_import_all_subclasses
+from ..common.utils import get_settings, find_and_import_all_subclasses, QueryCache
 from ..common.debug import dprint, debugger
 from ..common.profiler import profiler
 from ..common.maths import Point, Vec, Direction, Normal, BBox
@@ -63,6 +64,7 @@ from ..keymaps import default_rf_keymaps
 
 from .rfmesh import RFSource, RFTarget
 from .rfmesh_render import RFMeshRender
+from .rfmesh_journal import RFMeshJournal
 
 from .rftool import RFTool
 from .rfwidget import RFWidget
@@ -95,7 +97,7 @@ class RFContext(RFContext_Drawing, RFContext_UI, RFContext_Spaces, RFContext_Tar
 
     instance = None     # reference to the current instance of RFContext
 
-    undo_depth = 100    # set in RF settings?
+    undo_depth = 500    # hard limit on count; memory is limited by options['undo memory limit']
 
     @staticmethod
     @blender_version_wrapper('<','2.80')
@@ -182,11 +184,12 @@ class RFContext(RFContext_Drawing, RFContext_UI, RFContext_Spaces, RFContext_Tar
     @profiler.profile
     def __init__(self, rfmode, starting_tool):
         RFContext.instance = self
-        self.undo = []  # undo stack of causing actions, FSM state, tool states, and rftargets
-        self.redo = []  # redo stack of causing actions, FSM state, tool states, and rftargets
+        self.undo = []  # undo stack of causing actions, FSM state, tool states, and rftarget journals
+        self.redo = []  # redo stack of causing actions, FSM state, tool states, and rftarget journals
         self.rfmode = rfmode
         self.FSM = {'main': self.modal_main}
         self.mode = 'main'
+        self.query_cache = QueryCache('query cache')    # see _update_query_cache
 
         # get scaling factor to fit all sources into unit box
         self.unit_scaling_factor = RFContext.get_unit_scaling_factor()
@@ -197,8 +200,7 @@ class RFContext(RFContext_Drawing, RFContext_UI, RFContext_Spaces, RFContext_Tar
         self._init_usersettings()           # set up user-defined settings and key mappings
         self._init_ui()                     # set up user interface
         self._init_target()                 # set up target object
-        self._init_sources()                # set up source objects, must call *AFTER* target is initialized!
-        self._init_sources_symmetry()       # set up symmetry plane info
+        self._init_sources()                # set up source objects and symmetry plane info (staged), must call *AFTER* target is initialized!
         self._init_rotate_about_active()    # must call *AFTER* target is initialized!
         self.fps_time = time.time()
         self.frames = 0
@@ -269,9 +271,10 @@ class RFContext(RFContext_Drawing, RFContext_UI, RFContext_Spaces, RFContext_Tar
 
     def commit(self):
         #self.rftarget.commit()
-        pass
+        self.rftarget.clean(force=True)
 
     def end(self):
+        self.rftarget.clean(force=True)
         self._end_rotate_about_active()
         self.unscale_from_unit_box()
 
@@ -321,40 +324,73 @@ class RFContext(RFContext_Drawing, RFContext_UI, RFContext_Spaces, RFContext_Tar
     ###################################################
     # undo / redo stack operations
 
+    #
+    # each state holds a journal of the changes made to rftarget since the
+    # state was pushed (rather than a full copy of rftarget).  the journal of
+    # the top undo state is live: rftarget records into it as changes happen.
+    # restoring a state reverts rftarget using its journal.  besides mesh
+    # data, journals restore rftarget settings (RFMeshJournal.target_attrs);
+    # other rftarget state (xform, unit scaling, symmetry accels) does not
+    # change while RetopoFlow runs, so it is not undone.
+
     def _create_state(self, action):
         return {
             'action':       action,
             'tool':         self.tool,
-            'rftarget':     copy.deepcopy(self.rftarget),
+            'journal':      RFMeshJournal(self.rftarget),
+            'grease_marks': copy.deepcopy(self.grease_marks),
+            }
+    def _invert_state(self, state, action):
+        # must be called *before* restoring state
+        return {
+            'action':       action,
+            'tool':         self.tool,
+            'journal':      state['journal'].invert(),
             'grease_marks': copy.deepcopy(self.grease_marks),
             }
     def _restore_state(self, state, set_tool=True):
-        self.rftarget = state['rftarget']
+        self.rftarget.set_journal(None)
+        remap = state['journal'].restore()
+        # recreated elements replace deleted ones in all other journals
+        for other in chain(self.undo, self.redo): other['journal'].remap(remap)
+        self._update_journal()
         self.rftarget.rewrap()
         self.rftarget.dirty()
         self.rftarget_draw.replace_rfmesh(self.rftarget)
         self.grease_marks = state['grease_marks']
         if set_tool:
             self.set_tool(state['tool'], forceUpdate=True, changeTool=options['undo change tool'])
+    def _update_journal(self):
+        self.rftarget.set_journal(self.undo[-1]['journal'] if self.undo else None)
+    def _limit_undo(self):
+        # limit stack size by memory, but always keep the most recent state
+        budget = options['undo memory limit'] * 1024 * 1024
+        total = sum(state['journal'].get_size() for state in self.undo)
+        total += sum(state['journal'].get_size() for state in self.redo)
+        while len(self.undo) > 1 and (total > budget or len(self.undo) > self.undo_depth):
+            total -= self.undo.pop(0)['journal'].get_size()
 
     def undo_push(self, action, repeatable=False):
         # skip pushing to undo if action is repeatable and we are repeating actions
         if repeatable and self.undo and self.undo[-1]['action'] == action: return
-        self.undo.append(self._create_state(action))
-        while len(self.undo) > self.undo_depth: self.undo.pop(0)     # limit stack size
         self.redo.clear()
+        self.undo.append(self._create_state(action))
+        self._limit_undo()
+        self._update_journal()
         self.instrument_write(action)
 
     def undo_repush(self, action):
         if not self.undo: return
         self._restore_state(self.undo.pop(), set_tool=False)
         self.undo.append(self._create_state(action))
+        self._update_journal()
         self.redo.clear()
 
     def undo_pop(self):
         if not self.undo: return
-        self.redo.append(self._create_state('undo'))
-        self._restore_state(self.undo.pop())
+        state = self.undo.pop()
+        self.redo.append(self._invert_state(state, 'undo'))
+        self._restore_state(state)
         self.instrument_write('undo')
 
     def undo_cancel(self):
@@ -364,8 +400,10 @@ class RFContext(RFContext_Drawing, RFContext_UI, RFContext_Spaces, RFContext_Tar
 
     def redo_pop(self):
         if not self.redo: return
-        self.undo.append(self._create_state('redo'))
-        self._restore_state(self.redo.pop())
+        state = self.redo.pop()
+        self.undo.append(self._invert_state(state, 'redo'))
+        self._restore_state(state)
+        self._limit_undo()
         self.instrument_write('redo')
 
     def instrument_write(self, action):
@@ -408,8 +446,10 @@ class RFContext(RFContext_Drawing, RFContext_UI, RFContext_Spaces, RFContext_Tar
         #   empty or None:  stay in modal
 
         self._process_event(context, event)
+        self._update_query_cache()
 
-        self.actions.hit_pos,self.actions.hit_norm,_,_ = self.raycast_sources_mouse()
+        # hover hit only drives brushes and previews, so it may use proxies
+        self.actions.hit_pos,self.actions.hit_norm,_,_ = self.raycast_sources_mouse(max_error=self._get_hover_max_error())
 
         if self.actions.pressed('toggle full area'):
             self.rfmode.ui_toggle_maximize_area()
@@ -437,6 +477,17 @@ class RFContext(RFContext_Drawing, RFContext_UI, RFContext_Spaces, RFContext_Tar
             self.check_auto_save()
             # do not return here!  might need TIMER event in RFTool
 
+        if not self.sources_ready:
+            self.step_startup()
+            self.ui_startup.set_label(self.startup_message or '')
+            self.ui_startup.visible = not self.sources_ready
+
+        if self.snap_stages:
+            # target is being snapped; wait (or cancel)
+            self.step_snap()
+            Drawing.set_cursor('WAIT')
+            return {}
+
         try:
             ret = self.window_manager.modal(context, event)
             if ret and 'hover' in ret:
@@ -480,6 +531,12 @@ class RFContext(RFContext_Drawing, RFContext_UI, RFContext_Spaces, RFContext_Tar
             self.alert_user(message=message, level='exception', msghash=h)
             #raise e
 
+        # hold off writing target back to Blender mesh while tool operation is in progress
+        self.rftarget.editmesh_defer = (
+            (self.tool is not None and self.tool.mode != 'main') or
+            self.rfwidget.mode != 'main'
+        )
+
         if self.actions.pressed('done') or self.exit:
             # all done!
             return {'confirm'}
@@ -491,6 +548,19 @@ class RFContext(RFContext_Drawing, RFContext_UI, RFContext_Spaces, RFContext_Tar
         return {}
 
 
+    def _update_query_cache(self):
+        '''
+        raycasts and nearest queries are memoized while mouse and view stay
+        the same (within an event, or across events such as TIMER ticks).
+        queries on target are also keyed on target version
+        '''
+        mouse = self.actions.mouse
+        self.query_cache.set_key((
+            tuple(mouse) if mouse is not None else None,
+            tuple(self.get_view_version()),
+            self.sources_ready,
+        ))
+
     def modal_main(self):
         # handle undo/redo
         if self.actions.pressed('undo'):
@@ -520,6 +590,12 @@ class RFContext(RFContext_Drawing, RFContext_UI, RFContext_Spaces, RFContext_Tar
         #    assert False, 'this is a test!'
         #    return
 
+        # tools need sources, so wait until they are ready
+        if not self.sources_ready:
+            self.rfwidget.clear()
+            Drawing.set_cursor('WAIT')
+            return
+
         # handle tool shortcut
         for action,tool in RFTool.action_tool:
             if self.actions.pressed(action):
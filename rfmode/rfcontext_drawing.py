@@ -134,7 +134,7 @@ class RFContext_Drawing:
                 pr.done()
 
             pr = profiler.start('tool draw postpixel')
-            self.tool.draw_postpixel()
+            if self.sources_ready: self.tool.draw_postpixel()
             pr.done()
 
             pr = profiler.start('widget draw postpixel')
@@ -262,8 +262,9 @@ class RFContext_Drawing:
         pr.done()
 
         pr = profiler.start('render other')
-        self.tool.draw_postview()
-        self.rfwidget.draw_postview()
+        if self.sources_ready:
+            self.tool.draw_postview()
+            self.rfwidget.draw_postview()
         pr.done()
 
         #time.sleep(0.5)
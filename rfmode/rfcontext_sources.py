@@ -19,11 +19,15 @@ Created by Jonathan Denning, Jonathan Williamson
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+import time
+
+import numpy as np
 from mathutils import Vector
 from itertools import chain
 from .rfmesh import RFMesh, RFVert, RFEdge, RFFace, RFSource, RFTarget
 from .rfmesh_render import RFMeshRender
-from ..common.utils import iter_pairs
+from .rfmesh_bvh import RFSourcesBVH
+from ..common.utils import iter_pairs, relabel_stages
 from ..common.maths import (
     Point, Vec, Direction, Normal,
     Point2D, Vec2D, Direction2D,
@@ -34,7 +38,8 @@ from ..common.maths import (
 from ..common.profiler import profiler
 from ..common.debug import dprint
 from ..common.decorators import stats_wrapper
-from ..options import visualization
+from ..common.depthbuffer import DepthBuffer
+from ..options import options, visualization
 
 
 class RFContext_Sources:
@@ -42,74 +47,174 @@ class RFContext_Sources:
     functions to work on all RFSource objects
     '''
 
-    @profiler.profile
+    ###################################################
+    # staged startup
+    #
+    # sources are prepared in small stages (evaluating a source, a chunk of
+    # triangulation, building its BVH, slicing a chunk of triangles with a
+    # symmetry plane, ...) that are stepped from modal (TIMER events), so
+    # RetopoFlow's UI is up and responsive while sources load.  until all
+    # stages are done, there are no sources to query and tools are gated
+    # (see sources_ready).
+    # note: BMesh and bpy are not thread safe, so stages run on main thread;
+    # render buffers and proxies are already gathered in worker threads.
+    # evaluating modifiers (Object.to_mesh) is one call, so it is one stage
+
+    startup_step_time = 0.05    # max seconds spent stepping stages per event
+
     def _init_sources(self):
         ''' find all valid source objects, which are mesh objects that are visible and not active '''
-        self.rfsources = [RFSource.new(src) for src in self.get_sources()]
-        self.sources_bbox = BBox.merge([rfs.get_bbox() for rfs in self.rfsources])
+        self.rfsources = []
+        self.rfsources_draw = []
+        self.rfsources_bvh = RFSourcesBVH([])
+        # bounding box of objects until sources are ready
+        self.sources_bbox = BBox(from_coords=[Point(c) for src in self.get_sources() for c in src.bound_box])
+        self.sources_ready = False
+        self.startup_stages = self._startup_stages()
+        self.startup_message = 'Loading sources'
+        if not options['staged startup']:
+            for _ in self.startup_stages: pass
+            self.startup_stages = None
+            self.startup_message = None
+        self.ui_startup.visible = not self.sources_ready
+
+    def _startup_stages(self):
+        ''' generator of startup stages; yields message describing next stage '''
+        sources = self.get_sources()
+        rfsources = []
+        for i,src in enumerate(sources):
+            label = 'Preparing source %d/%d: %s' % (i+1, len(sources), src.name)
+            yield label
+            rfsource = yield from relabel_stages(
+                RFSource.new_stages(src),
+                lambda stage: '%s (%s)' % (label, stage)
+            )
+            rfsource.obj_set_select(False)
+            rfsources.append(rfsource)
+
+        yield 'Building source acceleration'
+        self.rfsources_bvh = RFSourcesBVH(
+            rfsources,
+            merge_limit=options['sources merge limit'],
+            threads=options['sources query threads'],
+        )
+        self.sources_bbox = BBox.merge([rfs.get_bbox() for rfs in rfsources])
+        self.rfsources = rfsources
         dprint('%d sources found' % len(self.rfsources))
         opts = visualization.get_source_settings()
         self.rfsources_draw = [RFMeshRender.new(rfs, opts) for rfs in self.rfsources]
 
+        yield from self._init_sources_symmetry()
+
+        self.sources_ready = True
+        self.accel_recompute = True
+        # tool is not set yet if startup is not staged
+        if getattr(self, 'tool', None): self.tool.update()
+
     @profiler.profile
+    def step_startup(self):
+        ''' steps startup stages for a limited time.  returns True if startup is done '''
+        if not self.startup_stages: return True
+        time_end = time.time() + self.startup_step_time
+        try:
+            while time.time() < time_end:
+                self.startup_message = next(self.startup_stages)
+        except StopIteration:
+            self.startup_stages = None
+            self.startup_message = None
+        return self.startup_stages is None
+
     def _init_sources_symmetry(self):
-        xyplane,xzplane,yzplane = self.rftarget.get_xy_plane(),self.rftarget.get_xz_plane(),self.rftarget.get_yz_plane()
+        ''' generator of stages intersecting sources with symmetry planes '''
         w2l_point = self.rftarget.w2l_point
-        rfsources_xyplanes = [e for rfs in self.rfsources for e in rfs.plane_intersection(xyplane)]
-        rfsources_xzplanes = [e for rfs in self.rfsources for e in rfs.plane_intersection(xzplane)]
-        rfsources_yzplanes = [e for rfs in self.rfsources for e in rfs.plane_intersection(yzplane)]
 
-        def gen_accel(edges, Point_to_Point2D):
+        def gen_accel(name, plane, Point_to_Point2D):
             nonlocal w2l_point
+            edges = []
+            for rfs in self.rfsources:
+                label = 'Intersecting %s with %s symmetry plane' % (rfs.obj.name, name)
+                yield label
+                edges += yield from relabel_stages(
+                    rfs.plane_intersection_stages(plane),
+                    lambda progress: '%s (%d/%d)' % (label, *progress)
+                )
             edges = [(w2l_point(v0), w2l_point(v1)) for (v0, v1) in edges]
             return Accel2D.simple_edges(edges, Point_to_Point2D)
 
-        self.rftarget.set_symmetry_accel(
-            gen_accel(rfsources_xyplanes, lambda p:Point2D((p.x,p.y))),
-            gen_accel(rfsources_xzplanes, lambda p:Point2D((p.x,p.z))),
-            gen_accel(rfsources_yzplanes, lambda p:Point2D((p.y,p.z))),
-        )
+        xy_accel = yield from gen_accel('XY', self.rftarget.get_xy_plane(), lambda p:Point2D((p.x,p.y)))
+        xz_accel = yield from gen_accel('XZ', self.rftarget.get_xz_plane(), lambda p:Point2D((p.x,p.z)))
+        yz_accel = yield from gen_accel('YZ', self.rftarget.get_yz_plane(), lambda p:Point2D((p.y,p.z)))
+        self.rftarget.set_symmetry_accel(xy_accel, xz_accel, yz_accel)
 
     ###################################################
     # ray casting functions
 
-    def raycast_sources_Ray(self, ray:Ray):
-        bp,bn,bi,bd = None,None,None,None
-        for rfsource in self.rfsources:
-            hp,hn,hi,hd = rfsource.raycast(ray)
-            if bp is None or (hp is not None and hd < bd):
-                bp,bn,bi,bd = hp,hn,hi,hd
+    def raycast_sources_Ray(self, ray:Ray, max_error=0):
+        '''
+        max_error (world) allows dense sources to be replaced by decimated
+        proxies for latency-sensitive queries.  leave at 0 when hit is used
+        to place geometry
+        '''
+        bp,bn,bi,bd,_ = self.rfsources_bvh.raycast(ray, max_error=max_error)
         return (bp,bn,bi,bd)
 
     def raycast_sources_Ray_all(self, ray:Ray):
         return [hit for rfsource in self.rfsources for hit in rfsource.raycast_all(ray)]
 
-    def raycast_sources_Point2D(self, xy:Point2D):
+    def raycast_sources_Point2D(self, xy:Point2D, max_error=0):
         if xy is None: return None,None,None,None
-        return self.raycast_sources_Ray(self.Point2D_to_Ray(xy))
+        return self.query_cache.get(
+            'raycast_sources_Point2D', (tuple(xy), max_error), None,
+            lambda: self.raycast_sources_Ray(self.Point2D_to_Ray(xy), max_error=max_error)
+        )
 
     def raycast_sources_Point2D_all(self, xy:Point2D):
         if xy is None: return None,None,None,None
         return self.raycast_sources_Ray_all(self.Point2D_to_Ray(xy))
 
-    def raycast_sources_mouse(self):
-        return self.raycast_sources_Point2D(self.actions.mouse)
+    def raycast_sources_mouse(self, max_error=0):
+        return self.raycast_sources_Point2D(self.actions.mouse, max_error=max_error)
+
+    def _get_hover_max_error(self):
+        ''' max world error of proxies used for mouse hover (brushes, previews) '''
+        return self._get_vis_max_error()
 
     def raycast_sources_Point(self, xyz:Point):
         if xyz is None: return None,None,None,None
         xy = self.Point_to_Point2D(xyz)
         return self.raycast_sources_Point2D(xy)
 
+    # batched versions: Nx3 (or Nx2) arrays in, arrays out.  each returns
+    # (points, normals, face indices, distances); misses are NaN, NaN, -1, inf
+
+    def raycast_sources_Rays(self, origins, dirs, max_error=0):
+        bp,bn,bi,bd,_ = self.rfsources_bvh.raycasts(origins, dirs, max_error=max_error)
+        return (bp,bn,bi,bd)
+
+    def raycast_sources_Point2Ds(self, xys, max_error=0):
+        xys = np.asarray(xys, dtype=np.float64).reshape((-1, 2))
+        # points that cannot be projected (NaN) miss
+        ok = ~np.isnan(xys).any(axis=1)
+        bp,bn = np.full((len(xys), 3), np.nan),np.full((len(xys), 3), np.nan)
+        bi,bd = np.full(len(xys), -1),np.full(len(xys), np.inf)
+        origins,dirs = self.Point2Ds_to_Rays(xys[ok])
+        bp[ok],bn[ok],bi[ok],bd[ok] = self.raycast_sources_Rays(origins, dirs, max_error=max_error)
+        return (bp,bn,bi,bd)
+
+    def raycast_sources_Points(self, xyzs):
+        return self.raycast_sources_Point2Ds(self.Points_to_Point2Ds(xyzs))
+
 
     ###################################################
     # nearest surface point (snapping) functions
 
     def nearest_sources_Point(self, point:Point, max_dist=float('inf')): #sys.float_info.max):
-        bp,bn,bi,bd = None,None,None,None
-        for rfsource in self.rfsources:
-            hp,hn,hi,hd = rfsource.nearest(point, max_dist=max_dist)
-            if bp is None or (hp is not None and hd < bd):
-                bp,bn,bi,bd = hp,hn,hi,hd
+        bp,bn,bi,bd,_ = self.rfsources_bvh.nearest(point, max_dist=max_dist)
+        return (bp,bn,bi,bd)
+
+    def nearest_sources_Points(self, points, max_dist=float('inf')):
+        ''' batched nearest_sources_Point; returns arrays as raycast_sources_Rays '''
+        bp,bn,bi,bd,_ = self.rfsources_bvh.nearests(points, max_dist=max_dist)
         return (bp,bn,bi,bd)
 
 
@@ -117,11 +222,7 @@ class RFContext_Sources:
     # plane intersection
 
     def plane_intersection_crawl(self, ray:Ray, plane:Plane, walk=False):
-        bp,bn,bi,bd,bo = None,None,None,None,None
-        for rfsource in self.rfsources:
-            hp,hn,hi,hd = rfsource.raycast(ray)
-            if bp is None or (hp is not None and hd < bd):
-                bp,bn,bi,bd,bo = hp,hn,hi,hd,rfsource
+        bp,bn,bi,bd,bo = self.rfsources_bvh.raycast(ray)
         if not bp: return []
         
         if walk:
@@ -132,20 +233,118 @@ class RFContext_Sources:
     def plane_intersections_crawl(self, plane:Plane):
         return [crawl for rfsource in self.rfsources for crawl in rfsource.plane_intersections_crawl(plane)]
 
+    def planes_intersections_crawl(self, planes):
+        ''' batched plane_intersections_crawl, returns list of crawls for each plane '''
+        rets = [[] for _ in planes]
+        for rfsource in self.rfsources:
+            for ret,crawls in zip(rets, rfsource.planes_intersections_crawl(planes)):
+                ret += crawls
+        return rets
+
 
     ###################################################
     # visibility testing
 
+    # a depth buffer of sources is rasterized once per view, so most points
+    # can be tested without ray casting.  ray casting is still used for
+    # points near depth discontinuities (where the buffer is unsure)
+    #
+    # dense sources are replaced by their proxies where the proxy error is
+    # within the visibility offset.  the offset then grows by the proxy
+    # error, so proxy surfaces do not hide points on the original surface
+
+    def _get_vis_max_dist_offset(self):
+        return self.sources_bbox.get_min_dimension()*0.01 + 0.0008
+
+    def _get_vis_max_error(self):
+        ''' max world error of proxies used for visibility '''
+        if not options['sources proxies']: return 0
+        return self._get_vis_max_dist_offset()
+
+    def _get_vis_offset(self):
+        max_error = self._get_vis_max_error()
+        return self._get_vis_max_dist_offset() + self.rfsources_bvh.proxy_error(max_error)
+
+    def _get_vis_depth(self):
+        ''' returns DepthBuffer of sources for current view (or None if disabled) '''
+        if not options['visibility depth buffer']: return None
+        self._get_view_matrices()
+        proxies = tuple(len(rfs.proxies) for rfs in self.rfsources)
+        key = (self._view_matrices_key, options['visibility buffer scale'], proxies)
+        if getattr(self, '_vis_depth_key', None) != key:
+            self._vis_depth = self._build_vis_depth()
+            self._vis_depth_key = key
+        return self._vis_depth
+
+    @profiler.profile
+    def _build_vis_depth(self):
+        w,h = self.actions.size
+        perspective = self._get_view_matrices()['perspective']
+        vis_depth = DepthBuffer(w, h, scale=options['visibility buffer scale'], perspective=perspective)
+        max_error = self._get_vis_max_error()
+        for rfsource in self.rfsources:
+            arrays = (max_error and rfsource.get_proxy(max_error)) or rfsource.get_arrays()
+            xyzs = rfsource.xform.l2w_points(arrays.co)
+            vis_depth.add_tris(self.Points_to_Point2Ds(xyzs), self.Points_to_depths(xyzs), arrays.tris)
+        vis_depth.finish()
+        return vis_depth
+
+    def _vis_depth_tolerances(self, xyzs, depths):
+        ''' max_dist_offset is along view ray, so convert it to view depth '''
+        tolerance = self._get_vis_offset()
+        m = self._get_view_matrices()
+        if not m['perspective']: return tolerance
+        dists = np.sqrt(((xyzs - m['viewinv'][:3, 3]) ** 2).sum(axis=1))
+        return tolerance * depths / np.where(dists == 0, 1.0, dists)
+
+    def _is_visible_ray(self, point:Point):
+        ray = self.Point_to_Ray(point, max_dist_offset=-self._get_vis_offset())
+        if not ray: return False
+        return not self.rfsources_bvh.raycast_hit(ray, max_error=self._get_vis_max_error())
+
     @profiler.profile
     def is_visible(self, point:Point, normal:Normal):
         p2D = self.Point_to_Point2D(point)
         if not p2D: return False
         if p2D.x < 0 or p2D.x > self.actions.size[0]: return False
         if p2D.y < 0 or p2D.y > self.actions.size[1]: return False
-        max_dist_offset = self.sources_bbox.get_min_dimension()*0.01 + 0.0008
+        max_dist_offset = self._get_vis_offset()
         ray = self.Point_to_Ray(point, max_dist_offset=-max_dist_offset)
         if not ray: return False
         if normal and normal.dot(ray.d) >= 0: return False
-        return not any(rfsource.raycast_hit(ray) for rfsource in self.rfsources)
+        vis_depth = self._get_vis_depth()
+        if vis_depth:
+            xyzs = np.array([tuple(point)], dtype=np.float64)
+            depths = self.Points_to_depths(xyzs)
+            res = vis_depth.test([tuple(p2D)], depths, self._vis_depth_tolerances(xyzs, depths))[0]
+            if res != DepthBuffer.UNSURE: return res == DepthBuffer.VISIBLE
+        return not self.rfsources_bvh.raycast_hit(ray, max_error=self._get_vis_max_error())
+
+    @profiler.profile
+    def is_visible_Points(self, xyzs, normals=None):
+        '''
+        batched is_visible: returns boolean array of whether each of Nx3
+        array of world points (with optional Nx3 normals) is visible
+        '''
+        xyzs = np.asarray(xyzs, dtype=np.float64).reshape((-1, 3))
+        xys = self.Points_to_Point2Ds(xyzs)
+        w,h = self.actions.size
+        with np.errstate(invalid='ignore'):
+            vis = (xys[:, 0] >= 0) & (xys[:, 0] <= w) & (xys[:, 1] >= 0) & (xys[:, 1] <= h)
+        if normals is not None:
+            _,dirs = self.Point2Ds_to_Rays(np.where(np.isnan(xys), 0.0, xys))
+            normals = np.asarray(normals, dtype=np.float64).reshape((-1, 3))
+            vis &= (normals * dirs).sum(axis=1) < 0
+        vis_depth = self._get_vis_depth()
+        if vis_depth:
+            depths = self.Points_to_depths(xyzs)
+            res = vis_depth.test(xys, depths, self._vis_depth_tolerances(xyzs, depths))
+            unsure = vis & (res == DepthBuffer.UNSURE)
+            vis &= res != DepthBuffer.HIDDEN
+        else:
+            unsure = vis.copy()
+        for i in np.flatnonzero(unsure):
+            vis[i] = self._is_visible_ray(Point(xyzs[i]))
+        return vis
 
 
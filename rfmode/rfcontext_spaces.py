@@ -20,6 +20,7 @@ Created by Jonathan Denning, Jonathan Williamson
 '''
 
 import bpy
+import numpy as np
 
 from mathutils import Matrix, Vector
 from bpy_extras.view3d_utils import location_3d_to_region_2d, region_2d_to_vector_3d
@@ -86,6 +87,88 @@ class RFContext_Spaces:
         dist = (o - xyz).length
         return Ray(o, d, min_dist=min_dist, max_dist=dist+max_dist_offset)
 
+    #############################################
+    # batched versions of above, working on numpy arrays
+
+    def _get_view_matrices(self):
+        '''
+        returns matrices needed to convert between screen and world space,
+        cached until view (or region) changes
+        '''
+        region,r3d = self.actions.region,self.actions.r3d
+        key = (
+            tuple(self.get_view_version()),
+            region.width, region.height,
+            r3d.view_perspective, r3d.view_camera_zoom, tuple(r3d.view_camera_offset),
+        )
+        if getattr(self, '_view_matrices_key', None) != key:
+            persmat = np.array(r3d.perspective_matrix, dtype=np.float64)
+            self._view_matrices = {
+                'persmat': persmat,
+                'persinv': np.linalg.inv(persmat),
+                'viewmat': np.array(r3d.view_matrix, dtype=np.float64),
+                'viewinv': np.array(r3d.view_matrix.inverted(), dtype=np.float64),
+                'half': np.array((region.width / 2.0, region.height / 2.0)),
+                'perspective': r3d.is_perspective,
+                'camera': r3d.view_perspective == 'CAMERA',
+            }
+            self._view_matrices_key = key
+        return self._view_matrices
+
+    def Points_to_Point2Ds(self, xyzs, clip=False):
+        '''
+        batched Point_to_Point2D: projects Nx3 array of world points to Nx2
+        array of region points.  rows of points behind the camera (and, if
+        clip is set, outside the view frustum) are NaN
+        '''
+        xyzs = np.asarray(xyzs, dtype=np.float64).reshape((-1, 3))
+        m = self._get_view_matrices()
+        persmat = m['persmat']
+        prj = np.dot(xyzs, persmat[:, :3].T) + persmat[:, 3]
+        w = prj[:, 3]
+        cull = w <= 0.0
+        if clip: cull |= (np.abs(prj[:, :3]) > w[:, None]).any(axis=1)
+        w = np.where(cull, 1.0, w)
+        xys = m['half'] * (1.0 + prj[:, :2] / w[:, None])
+        xys[cull] = np.nan
+        return xys
+
+    def Points_to_depths(self, xyzs):
+        '''
+        view depth (distance along view direction) of Nx3 array of world
+        points.  note: unlike Point_to_depth, this is not distance to the
+        view origin, which is depth / cos of angle to view direction
+        '''
+        xyzs = np.asarray(xyzs, dtype=np.float64).reshape((-1, 3))
+        viewmat = self._get_view_matrices()['viewmat']
+        return -(np.dot(xyzs, viewmat[2, :3]) + viewmat[2, 3])
+
+    def Point2Ds_to_Rays(self, xys):
+        '''
+        batched Point2D_to_Ray: returns (origins, directions) as Nx3 arrays
+        for Nx2 array of region points (directions are normalized)
+        '''
+        xys = np.asarray(xys, dtype=np.float64).reshape((-1, 2))
+        count = len(xys)
+        m = self._get_view_matrices()
+        persinv,viewinv = m['persinv'],m['viewinv']
+        dxy = xys / m['half'] - 1.0
+        if m['perspective']:
+            # see bpy_extras.view3d_utils.region_2d_to_vector_3d
+            out = np.column_stack((dxy, np.full(count, -0.5)))
+            w = np.dot(out, persinv[3, :3]) + persinv[3, 3]
+            vecs = (np.dot(out, persinv[:3, :3].T) + persinv[:3, 3]) / w[:, None]
+            vecs -= viewinv[:3, 3]
+            origins = np.tile(viewinv[:3, 3], (count, 1))
+        else:
+            # see bpy_extras.view3d_utils.region_2d_to_origin_3d
+            vecs = np.tile(-viewinv[:3, 2], (count, 1))
+            origins = dxy[:, 0:1] * persinv[:3, 0] + dxy[:, 1:2] * persinv[:3, 1] + persinv[:3, 3]
+            if not m['camera']: origins -= persinv[:3, 2]
+        l = np.sqrt((vecs * vecs).sum(axis=1))
+        l[l == 0] = 1.0
+        return (origins, vecs / l[:, None])
+
     def size2D_to_size(self, size2D:float, xy:Point2D, depth:float):
         # computes size of 3D object at distance (depth) as it projects to 2D size
         # TODO: there are more efficient methods of computing this!
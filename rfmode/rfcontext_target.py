@@ -21,6 +21,8 @@ Created by Jonathan Denning, Jonathan Williamson
 
 import time
 from itertools import chain
+
+import numpy as np
 from mathutils import Vector
 from ..common.debug import dprint
 from ..common.profiler import profiler
@@ -55,6 +57,9 @@ class RFContext_Target:
         self.accel_vis_edges = None
         self.accel_vis_faces = None
         self.accel_vis_accel = None
+        self.accel_changes = self.rftarget.track_changes()
+
+        self.snap_stages = None
 
     #########################################
     # acceleration structures
@@ -66,6 +71,7 @@ class RFContext_Target:
         target_version = self.get_target_version(selection=False)
         view_version = self.get_view_version()
 
+        rebuild = force or self.accel_recompute
         recompute = self.accel_recompute
         recompute |= self.accel_target_version != target_version
         recompute |= self.accel_view_version != view_version
@@ -79,18 +85,74 @@ class RFContext_Target:
         self.accel_recompute = False
 
         if force or recompute:
+            rebuild |= self.accel_view_version != view_version
+            rebuild |= self.accel_vis_accel is None
+            if rebuild or not self._update_vis_accel():
+                self.accel_changes.reset()
+                self.accel_vis_verts = self.visible_verts()
+                self.accel_vis_edges = self.visible_edges(verts=self.accel_vis_verts)
+                self.accel_vis_faces = self.visible_faces(verts=self.accel_vis_verts)
+                self.accel_vis_accel = Accel2D(self.accel_vis_verts, self.accel_vis_edges, self.accel_vis_faces, self.get_point2D, Points_to_Point2Ds=self.Points_to_Point2Ds)
             self.accel_target_version = target_version
             self.accel_view_version = view_version
-            self.accel_vis_verts = self.visible_verts()
-            self.accel_vis_edges = self.visible_edges(verts=self.accel_vis_verts)
-            self.accel_vis_faces = self.visible_faces(verts=self.accel_vis_verts)
-            self.accel_vis_accel = Accel2D(self.accel_vis_verts, self.accel_vis_edges, self.accel_vis_faces, self.get_point2D)
 
         return self.accel_vis_accel
 
+    @profiler.profile
+    def _update_vis_accel(self):
+        '''
+        view is unchanged, so only target verts that changed since last time
+        need visibility retested and (along with their edges and faces)
+        rebinned.  returns False if accel must be rebuilt instead
+        '''
+        changes = self.accel_changes
+        if changes.unknown: return False
+        bmvs = { bmv for bmv in changes.verts if bmv.is_valid }
+        if len(bmvs) > len(self.rftarget.bme.verts) // 4 + 16: return False
+        wrap_v = self.rftarget._wrap_bmvert
+        wrap_e = self.rftarget._wrap_bmedge
+        wrap_f = self.rftarget._wrap_bmface
+
+        verts = { wrap_v(bmv) for bmv in bmvs }
+        edges = { wrap_e(bme) for bmv in bmvs for bme in bmv.link_edges }
+        faces = { wrap_f(bmf) for bmv in bmvs for bmf in bmv.link_faces }
+        remove = verts | edges | faces
+        vis_verts = self.accel_vis_verts - verts
+        vis_edges = self.accel_vis_edges - edges
+        vis_faces = self.accel_vis_faces - faces
+        if changes.topology:
+            # drop deleted elements
+            valid_verts = { v for v in vis_verts if v.is_valid }
+            valid_edges = { e for e in vis_edges if e.is_valid }
+            valid_faces = { f for f in vis_faces if f.is_valid }
+            remove |= (vis_verts - valid_verts) | (vis_edges - valid_edges) | (vis_faces - valid_faces)
+            vis_verts,vis_edges,vis_faces = valid_verts,valid_edges,valid_faces
+
+        new_verts = { wrap_v(bmv) for bmv in self.rftarget._visible_verts(self.is_visible, bmvs=bmvs, is_visible_Points=self.is_visible_Points) }
+        vis_verts |= new_verts
+        new_edges = { e for e in edges if all(v in vis_verts for v in e.verts) }
+        new_faces = { f for f in faces if all(v in vis_verts for v in f.verts) }
+        vis_edges |= new_edges
+        vis_faces |= new_faces
+
+        if not self.accel_vis_accel.update(remove=remove, verts=new_verts, edges=new_edges, faces=new_faces):
+            return False
+        changes.reset()
+        self.accel_vis_verts = vis_verts
+        self.accel_vis_edges = vis_edges
+        self.accel_vis_faces = vis_faces
+        return True
+
     @profiler.profile
     def accel_nearest2D_vert(self, point=None, max_dist=None):
         xy = self.get_point2D(point or self.actions.mouse)
+        if xy is None: return self._accel_nearest2D_vert(xy, max_dist)
+        return self.query_cache.get(
+            'accel_nearest2D_vert', (tuple(xy), max_dist), self.get_target_version(),
+            lambda: self._accel_nearest2D_vert(xy, max_dist)
+        )
+
+    def _accel_nearest2D_vert(self, xy, max_dist):
         vis_accel = self.get_vis_accel()
         if not vis_accel: return None,None
 
@@ -100,11 +162,18 @@ class RFContext_Target:
             max_dist = self.drawing.scale(max_dist)
             verts = vis_accel.get_verts(xy, max_dist)
 
-        return self.rftarget.nearest2D_bmvert_Point2D(xy, self.Point_to_Point2D, verts=verts, max_dist=max_dist)
+        return self.rftarget.nearest2D_bmvert_Point2D(xy, self.Point_to_Point2D, verts=verts, max_dist=max_dist, Points_to_Point2Ds=self.Points_to_Point2Ds)
 
     @profiler.profile
     def accel_nearest2D_edge(self, point=None, max_dist=None):
         xy = self.get_point2D(point or self.actions.mouse)
+        if xy is None: return self._accel_nearest2D_edge(xy, max_dist)
+        return self.query_cache.get(
+            'accel_nearest2D_edge', (tuple(xy), max_dist), self.get_target_version(),
+            lambda: self._accel_nearest2D_edge(xy, max_dist)
+        )
+
+    def _accel_nearest2D_edge(self, xy, max_dist):
         vis_accel = self.get_vis_accel()
         if not vis_accel: return None,None
 
@@ -114,11 +183,18 @@ class RFContext_Target:
             max_dist = self.drawing.scale(max_dist)
             edges = vis_accel.get_edges(xy, max_dist)
 
-        return self.rftarget.nearest2D_bmedge_Point2D(xy, self.Point_to_Point2D, edges=edges, max_dist=max_dist)
+        return self.rftarget.nearest2D_bmedge_Point2D(xy, self.Point_to_Point2D, edges=edges, max_dist=max_dist, Points_to_Point2Ds=self.Points_to_Point2Ds)
 
     @profiler.profile
     def accel_nearest2D_face(self, point=None, max_dist=None):
         xy = self.get_point2D(point or self.actions.mouse)
+        if xy is None: return self._accel_nearest2D_face(xy, max_dist)
+        return self.query_cache.get(
+            'accel_nearest2D_face', (tuple(xy), max_dist), self.get_target_version(),
+            lambda: self._accel_nearest2D_face(xy, max_dist)
+        )
+
+    def _accel_nearest2D_face(self, xy, max_dist):
         vis_accel = self.get_vis_accel()
         if not vis_accel: return None
 
@@ -142,25 +218,25 @@ class RFContext_Target:
     def nearest2D_vert(self, point=None, max_dist=None, verts=None):
         xy = self.get_point2D(point or self.actions.mouse)
         if max_dist: max_dist = self.drawing.scale(max_dist)
-        return self.rftarget.nearest2D_bmvert_Point2D(xy, self.Point_to_Point2D, verts=verts, max_dist=max_dist)
+        return self.rftarget.nearest2D_bmvert_Point2D(xy, self.Point_to_Point2D, verts=verts, max_dist=max_dist, Points_to_Point2Ds=self.Points_to_Point2Ds)
 
     @profiler.profile
     def nearest2D_verts(self, point=None, max_dist:float=10, verts=None):
         xy = self.get_point2D(point or self.actions.mouse)
         max_dist = self.drawing.scale(max_dist)
-        return self.rftarget.nearest2D_bmverts_Point2D(xy, max_dist, self.Point_to_Point2D, verts=verts)
+        return self.rftarget.nearest2D_bmverts_Point2D(xy, max_dist, self.Point_to_Point2D, verts=verts, Points_to_Point2Ds=self.Points_to_Point2Ds)
 
     @profiler.profile
     def nearest2D_edge(self, point=None, max_dist=None, edges=None):
         xy = self.get_point2D(point or self.actions.mouse)
         if max_dist: max_dist = self.drawing.scale(max_dist)
-        return self.rftarget.nearest2D_bmedge_Point2D(xy, self.Point_to_Point2D, edges=edges, max_dist=max_dist)
+        return self.rftarget.nearest2D_bmedge_Point2D(xy, self.Point_to_Point2D, edges=edges, max_dist=max_dist, Points_to_Point2Ds=self.Points_to_Point2Ds)
 
     @profiler.profile
     def nearest2D_edges(self, point=None, max_dist:float=10, edges=None):
         xy = self.get_point2D(point or self.actions.mouse)
         if max_dist: max_dist = self.drawing.scale(max_dist)
-        return self.rftarget.nearest2D_bmedges_Point2D(xy, max_dist, self.Point_to_Point2D, edges=edges)
+        return self.rftarget.nearest2D_bmedges_Point2D(xy, max_dist, self.Point_to_Point2D, edges=edges, Points_to_Point2Ds=self.Points_to_Point2Ds)
 
     # TODO: implement max_dist
     @profiler.profile
@@ -220,9 +296,9 @@ class RFContext_Target:
     def nearest_verts_mouse(self, max_dist:float):
         return self.nearest_verts_point(self.actions.mouse, max_dist)
 
-    def nearest_edges_Point(self, point, max_dist:float):
+    def nearest_edges_Point(self, point, max_dist:float, edges=None):
         max_dist = self.drawing.scale(max_dist)
-        return self.rftarget.nearest_bmedges_Point(point, max_dist)
+        return self.rftarget.nearest_bmedges_Point(point, max_dist, edges=edges)
 
     def nearest_edge_Point(self, point:Point, edges=None):
         return self.rftarget.nearest_bmedge_Point(point, edges=edges)
@@ -233,15 +309,15 @@ class RFContext_Target:
 
     @profiler.profile
     def visible_verts(self):
-        return self.rftarget.visible_verts(self.is_visible)
+        return self.rftarget.visible_verts(self.is_visible, is_visible_Points=self.is_visible_Points)
 
     @profiler.profile
     def visible_edges(self, verts=None):
-        return self.rftarget.visible_edges(self.is_visible, verts=verts)
+        return self.rftarget.visible_edges(self.is_visible, verts=verts, is_visible_Points=self.is_visible_Points)
 
     @profiler.profile
     def visible_faces(self, verts=None):
-        return self.rftarget.visible_faces(self.is_visible, verts=verts)
+        return self.rftarget.visible_faces(self.is_visible, verts=verts, is_visible_Points=self.is_visible_Points)
 
 
     ########################################
@@ -329,13 +405,46 @@ class RFContext_Target:
     def clamp_point_to_symmetry(self, point):
         return self.rftarget.symmetry_real(point)
 
+    #######################################
+    # snapping verts
+    #
+    # snapping many verts takes a while, so it is stepped from modal (like
+    # staged startup) to show progress.  cancel action (Esc) stops snapping
+    # and restores target from undo
+
+    snap_step_time = 0.05       # max seconds spent snapping per event
+
     def snap_all_verts(self):
-        self.undo_push('snap all verts')
-        self.rftarget.snap_all_verts(self.nearest_sources_Point)
+        self._start_snap('snap all verts', selected_only=False)
 
     def snap_selected_verts(self):
-        self.undo_push('snap selected verts')
-        self.rftarget.snap_selected_verts(self.nearest_sources_Point)
+        self._start_snap('snap selected verts', selected_only=True)
+
+    def _start_snap(self, action, selected_only):
+        # there is nothing to snap to until sources are ready (see step_startup)
+        if self.snap_stages or not self.sources_ready: return
+        self.undo_push(action)
+        self.snap_stages = self.rftarget.snap_verts_stages(self.nearest_sources_Points, selected_only=selected_only)
+        self.step_snap()
+
+    @profiler.profile
+    def step_snap(self):
+        ''' steps snapping for a limited time.  returns True if snapping is done '''
+        if not self.snap_stages: return True
+        if self.actions.pressed('cancel'):
+            self.snap_stages.close()
+            self.snap_stages = None
+            self.undo_cancel()
+        else:
+            time_end = time.time() + self.snap_step_time
+            try:
+                while time.time() < time_end:
+                    done,total = next(self.snap_stages)
+                    self.ui_progress.set_label('Snapping verts: %d%% (Esc to cancel)' % (100 * done // max(1, total)))
+            except StopIteration:
+                self.snap_stages = None
+        self.ui_progress.visible = self.snap_stages is not None
+        return self.snap_stages is None
 
     #######################################
     # target manipulation functions
@@ -369,6 +478,29 @@ class RFContext_Target:
         vert.normal = norm
         return xyz
 
+    def set_coords(self, verts, coords, normals=None):
+        self.rftarget.set_coords(verts, coords, normals=normals)
+
+    def snap_verts(self, verts, coords=None):
+        '''
+        snaps verts to nearest source points.  if coords are given, verts are
+        snapped from coords rather than from their current positions
+        '''
+        verts = list(verts)
+        if not verts: return
+        if coords is None: coords = [vert.co for vert in verts]
+        xyzs,norms,idxs,_ = self.nearest_sources_Points(coords)
+        hit = np.flatnonzero(idxs >= 0)
+        self.rftarget.set_coords([verts[i] for i in hit], xyzs[hit], norms[hit])
+
+    def set2D_verts(self, verts, xys):
+        ''' batched set2D_vert: moves verts to sources under Nx2 region points '''
+        verts = list(verts)
+        if not verts: return
+        xyzs,norms,idxs,_ = self.raycast_sources_Point2Ds(xys)
+        hit = np.flatnonzero(idxs >= 0)
+        self.rftarget.set_coords([verts[i] for i in hit], xyzs[hit], norms[hit])
+
     def set2D_crawl_vert(self, vert:RFVert, xy:Point2D):
         hits = self.raycast_sources_Point2D_all(xy)
         if not hits: return
@@ -416,6 +548,9 @@ class RFContext_Target:
     def update_face_normal(self, face):
         return self.rftarget.update_face_normal(face)
 
+    def update_face_normals(self, faces):
+        return self.rftarget.update_face_normals(faces)
+
     def clean_duplicate_bmedges(self, vert):
         return self.rftarget.clean_duplicate_bmedges(vert)
 
@@ -462,6 +462,8 @@ class RFContext_UI:
         def get_selected_tool():
             return self.tool.name()
         def set_selected_tool(value):
+            # tools need sources, so keep current tool until they are ready
+            if not self.sources_ready: return
             for ids,rft in RFTool.get_tools():
                 if rft.bl_label == value: #get_label() == name:
                     self.set_tool(rft.rft_class())
@@ -594,6 +596,9 @@ class RFContext_UI:
         container.add(UI_Button('Welcome!', show_reporting, tooltip='Show "Welcome!" message'))
         container.add(UI_Button('Report Issue', open_github, tooltip='Report an issue with RetopoFlow (opens default browser)'))
         self.window_info.add(UI_Button('Buy us a drink', open_tip, tooltip='Send us a "Thank you"'))
+        self.ui_startup = self.window_info.add(UI_Label('Loading sources', color=(1,1,0.5,1)))
+        self.ui_progress = self.window_info.add(UI_Label('', color=(1,1,0.5,1)))
+        self.ui_progress.visible = False
 
         self.window_tool_options = self.window_manager.create_window('Options', {
             'fn_pos':wrap_pos_option('options pos'),
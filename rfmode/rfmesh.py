@@ -21,6 +21,10 @@ Created by Jonathan Denning, Jonathan Williamson
 
 import math
 import copy
+import time
+from itertools import chain
+
+import numpy as np
 
 import bpy
 import bmesh
@@ -32,13 +36,13 @@ from bmesh.ops import (
 from mathutils import Vector
 from mathutils.bvhtree import BVHTree
 from mathutils.kdtree import KDTree
-from mathutils.geometry import normal as compute_normal, intersect_point_tri
+from mathutils.geometry import intersect_point_tri
 
 from ..common.maths import Point, Normal
 from ..common.maths import Point2D
 from ..common.maths import Ray, XForm, BBox, Plane
-from ..common.hasher import hash_object
-from ..common.utils import min_index, UniqueCounter
+from ..common.hasher import hash_object, hash_object_data, hash_bmesh
+from ..common.utils import min_index, UniqueCounter, run_stages
 from ..common.decorators import stats_wrapper, blender_version_wrapper
 from ..common.debug import dprint
 from ..common.profiler import profiler
@@ -46,6 +50,13 @@ from ..common.profiler import profiler
 from .rfmesh_wrapper import (
     BMElemWrapper, RFVert, RFEdge, RFFace, RFEdgeSequence
 )
+from .rfmesh_arrays import RFMeshArrays, closest_on_segments, plane_slice, plane_slice_stages, chain_segments
+from .rfmesh_journal import RFMeshChanges
+from .rfmesh_cache import RFMeshDiskCache, rfmesh_arrays_to_cache, bmesh_from_cache
+from .rfmesh_proxy import RFMeshProxy, build_proxies
+from .rfmesh_bvh import raycast_batch, nearest_batch
+
+from ..options import options
 
 
 class RFMesh():
@@ -73,11 +84,24 @@ class RFMesh():
         deform=False, bme=None, triangulate=False,
         selection=True, keepeme=False
     ):
-        hasnan = any(
-            math.isnan(v)
-            for emv in obj.data.vertices
-            for v in emv.co
-        )
+        for _ in self._setup_stages(
+            obj, deform=deform, bme=bme, triangulate=triangulate,
+            selection=selection, keepeme=keepeme
+        ): pass
+
+    def _setup_stages(
+        self, obj,
+        deform=False, bme=None, triangulate=False,
+        selection=True, keepeme=False
+    ):
+        '''
+        generator version of __setup__.  yields message describing next stage,
+        so setting up large meshes can be spread over time (see staged startup)
+        '''
+        co = np.empty(len(obj.data.vertices) * 3, dtype=np.float32)
+        obj.data.vertices.foreach_get('co', co)
+        hasnan = bool(np.isnan(co).any())
+        del co
         if hasnan:
             dprint('Mesh data contains NaN in vertex coordinate!')
             dprint('Cleaning mesh')
@@ -88,6 +112,8 @@ class RFMesh():
 
         pr = profiler.start('setup init')
         self.obj = obj
+        self.journal = None
+        self._trackers = []
         self.xform = XForm(self.obj.matrix_world)
         self.hash = hash_object(self.obj)
         pr.done()
@@ -95,6 +121,7 @@ class RFMesh():
         if bme is not None:
             self.bme = bme
         else:
+            yield 'evaluating'
             pr = profiler.start('edit mesh > bmesh')
             self.eme = self.obj.to_mesh(
                 scene=bpy.context.scene,
@@ -113,18 +140,14 @@ class RFMesh():
                 pr = profiler.start('copying selection')
                 self.bme.select_mode = {'FACE', 'EDGE', 'VERT'}
                 # copy selection from editmesh
-                for bmf, emf in zip(self.bme.faces, self.obj.data.polygons):
-                    bmf.select = emf.select
-                for bme, eme in zip(self.bme.edges, self.obj.data.edges):
-                    bme.select = eme.select
-                for bmv, emv in zip(self.bme.verts, self.obj.data.vertices):
-                    bmv.select = emv.select
+                self._copy_selection_from_mesh(self.obj.data)
                 pr.done()
             else:
                 self.deselect_all()
 
         if triangulate:
-            self.triangulate()
+            for (done, total) in self.triangulate_stages():
+                yield 'triangulating %d/%d' % (done, total)
 
         pr = profiler.start('setup finishing')
         self.selection_center = Point((0, 0, 0))
@@ -134,6 +157,49 @@ class RFMesh():
 
     ##########################################################
 
+    @staticmethod
+    def _mesh_select_flags(seq):
+        ''' returns select flags of Mesh elements (vertices, edges, polygons) as bool array '''
+        sel = np.empty(len(seq), dtype=bool)
+        seq.foreach_get('select', sel)
+        return sel
+
+    @staticmethod
+    def _bmesh_select_flags(seq):
+        ''' returns select flags of BMesh elements (verts, edges, faces) as bool array '''
+        return np.fromiter((elem.select for elem in seq), dtype=bool, count=len(seq))
+
+    def _copy_selection_from_mesh(self, me):
+        '''
+        copies selection of Mesh elements to corresponding BMesh elements.
+        faces are copied first, then edges, then verts (setting selection of
+        a face or edge also sets its verts), but only elements that differ
+        are touched (from_mesh typically already copied selection)
+        '''
+        for bmseq, meseq in [
+                (self.bme.faces, me.polygons),
+                (self.bme.edges, me.edges),
+                (self.bme.verts, me.vertices),
+                ]:
+            if len(bmseq) != len(meseq): continue
+            want = self._mesh_select_flags(meseq)
+            diff = np.flatnonzero(self._bmesh_select_flags(bmseq) != want)
+            if not len(diff): continue
+            bmseq.ensure_lookup_table()
+            for i in diff.tolist(): bmseq[i].select = bool(want[i])
+
+    def _copy_selection_to_mesh(self, me):
+        ''' copies selection of BMesh elements to corresponding Mesh elements '''
+        ver = self.get_version(selection=False)
+        if hasattr(self, 'arrays') and self.arrays_version == ver:
+            # arrays are current, so reuse their selection flags
+            arrays = self.get_arrays()
+            flags = [arrays.vert_sel, arrays.edge_sel, arrays.face_sel]
+        else:
+            flags = [self._bmesh_select_flags(seq) for seq in (self.bme.verts, self.bme.edges, self.bme.faces)]
+        for meseq, sel in zip((me.vertices, me.edges, me.polygons), flags):
+            if len(meseq) == len(sel): meseq.foreach_set('select', sel)
+
     def get_frame(self): return self.xform.to_frame()
 
     def w2l_point(self, p): return self.xform.w2l_point(p)
@@ -162,6 +228,9 @@ class RFMesh():
     def get_version(self, selection=True):
         return self._version + (self._version_selection if selection else 0)
 
+    def get_selection_version(self):
+        return self._version_selection
+
     def get_bvh(self):
         ver = self.get_version(selection=False)
         if not hasattr(self, 'bvh') or self.bvh_version != ver:
@@ -169,22 +238,145 @@ class RFMesh():
             self.bvh_version = ver
         return self.bvh
 
+    def get_hash(self):
+        ''' returns hash_bmesh of mesh, which is recomputed when version changes '''
+        ver = self.get_version(selection=False)
+        if not hasattr(self, 'bmesh_hash') or self.bmesh_hash_version != ver:
+            self.bmesh_hash = hash_bmesh(self.bme)
+            self.bmesh_hash_version = ver
+        return self.bmesh_hash
+
     def get_bbox(self):
         ver = self.get_version(selection=False)
         if not hasattr(self, 'bbox') or self.bbox_version != ver:
-            self.bbox = BBox(from_bmverts=self.bme.verts)
+            co = self.get_arrays().co
+            if len(co):
+                self.bbox = BBox(from_coords=[Point(co.min(axis=0)), Point(co.max(axis=0))])
+            else:
+                self.bbox = BBox()
             self.bbox_version = ver
         return self.bbox
 
-    def get_kdtree(self):
+    def get_arrays(self):
+        '''
+        returns RFMeshArrays of mesh, which is rebuilt when version changes
+        (or topology changes).  selection is refreshed separately
+        '''
         ver = self.get_version(selection=False)
-        if not hasattr(self, 'kdt') or self.kdt_version != ver:
-            self.kdt = KDTree(len(self.bme.verts))
-            for i, bmv in enumerate(self.bme.verts):
+        if not hasattr(self, 'arrays') or self.arrays_version != ver:
+            self.arrays = RFMeshArrays(self.bme)
+            self.arrays_version = ver
+            self.arrays_version_selection = self._version_selection
+        elif self.arrays_version_selection != self._version_selection:
+            self.arrays.update_selection()
+            self.arrays_version_selection = self._version_selection
+        return self.arrays
+
+    def get_kdtree(self):
+        '''
+        returns (KDTree of local vert coords, BMVerts indexed by tree, set of
+        BMVerts changed since tree was built).  rather than rebuilding tree
+        whenever mesh changes, changed verts are skipped in tree and tested
+        directly (see _nearest_bmverts_local) until there are too many
+        '''
+        if not hasattr(self, 'kdt_changes'):
+            self.kdt_changes = self.track_changes()
+        changes = self.kdt_changes
+        if not hasattr(self, 'kdt') or changes.unknown or len(changes.verts) > self.kdt_max_changed:
+            pr = profiler.start('building kdtree')
+            changes.reset()
+            self.kdt_verts = list(self.bme.verts)
+            self.kdt = KDTree(len(self.kdt_verts))
+            for i, bmv in enumerate(self.kdt_verts):
                 self.kdt.insert(bmv.co, i)
             self.kdt.balance()
-            self.kdt_version = ver
-        return self.kdt
+            self.kdt_max_changed = max(256, len(self.kdt_verts) // 32)
+            pr.done()
+        return (self.kdt, self.kdt_verts, changes.verts)
+
+    def _nearest_bmverts_local(self, co, dist):
+        ''' BMVerts within (local) dist of (local) co '''
+        kdt, kdt_verts, changed = self.get_kdtree()
+        # pad dist a little, because tree is single precision
+        bmvs = [kdt_verts[i] for (_, i, _) in kdt.find_range(co, dist * 1.0001 + 0.000001)]
+        bmvs = [bmv for bmv in bmvs if bmv.is_valid and bmv not in changed]
+        bmvs += [bmv for bmv in changed if bmv.is_valid and (bmv.co - co).length <= dist]
+        return bmvs
+
+    ##########################################################
+    # tracking changes, so consumers (RFMeshRender, visibility accel) can
+    # update incrementally rather than rebuild (see rfmesh_journal.py)
+
+    def track_changes(self):
+        ''' returns new RFMeshChanges that collects all changes from now on '''
+        changes = RFMeshChanges()
+        self._trackers.append(changes)
+        return changes
+
+    def untrack_changes(self, changes):
+        if changes in self._trackers: self._trackers.remove(changes)
+
+    def changes_unknown(self):
+        ''' call when mesh was changed without going through journal hooks '''
+        for changes in self._trackers: changes.unknown = True
+
+    def _changed_verts(self, bmvs):
+        for changes in self._trackers: changes.verts.update(bmvs)
+
+    ##########################################################
+    # journaling changes for undo (see rfmesh_journal.py)
+    # note: only RFTarget sets a journal
+    # note: journal hooks also feed change tracking (above)
+
+    def set_journal(self, journal):
+        self.journal = journal
+
+    def journal_vert(self, bmv):
+        bmv = self._unwrap(bmv)
+        for changes in self._trackers: changes.verts.add(bmv)
+        if self.journal is None: return
+        self.journal.record_vert(bmv)
+
+    def journal_attr(self, bmelem, attr):
+        if attr == 'select':
+            for changes in self._trackers: changes.select = True
+        if self.journal is None: return
+        self.journal.record_attr(self._unwrap(bmelem), attr)
+
+    def journal_attrs(self, bmelems, attr):
+        if attr == 'select':
+            for changes in self._trackers: changes.select = True
+        if self.journal is None: return
+        record_attr,unwrap = self.journal.record_attr,self._unwrap
+        for bmelem in bmelems: record_attr(unwrap(bmelem), attr)
+
+    def journal_flip(self, bmf):
+        bmf = self._unwrap(bmf)
+        for changes in self._trackers: changes.topology = True
+        self._changed_verts(bmf.verts)
+        if self.journal is None: return
+        self.journal.record_flip(bmf)
+
+    def journal_topology(self, verts=None):
+        '''
+        call right *before* changing topology.  verts are the verts whose
+        neighborhood is about to change (new elements must use at least
+        one of them).  if verts is None, changes are unknown
+        '''
+        for changes in self._trackers:
+            changes.topology = True
+            if verts is None: changes.unknown = True
+        if verts is not None:
+            verts = [self._unwrap(bmv) for bmv in verts]
+            self._changed_verts(verts)
+        if hasattr(self, 'arrays'): del self.arrays
+        if self.journal is None: return
+        self.journal.record_topology(verts)
+
+    def journal_new_vert(self, bmv):
+        ''' call right *after* creating a vert that is not connected to anything '''
+        if self.journal is None: return
+        self.journal.record_new_vert(self._unwrap(bmv))
 
     ##########################################################
 
@@ -230,9 +422,22 @@ class RFMesh():
 
     @profiler.profile
     def triangulate(self):
+        for _ in self.triangulate_stages(): pass
+
+    triangulate_chunk_size = 50000  # faces triangulated per stage
+
+    def triangulate_stages(self):
+        '''
+        generator version of triangulate.  faces are triangulated in chunks,
+        and each stage yields (done, total) faces
+        '''
         faces = [face for face in self.bme.faces if len(face.verts) != 3]
         dprint('%d non-triangles' % len(faces))
-        bmesh.ops.triangulate(self.bme, faces=faces)
+        total = len(faces)
+        for i0 in range(0, total, self.triangulate_chunk_size):
+            i1 = min(total, i0 + self.triangulate_chunk_size)
+            bmesh.ops.triangulate(self.bme, faces=faces[i0:i1])
+            yield (i1, total)
 
     @profiler.profile
     def plane_split(self, plane: Plane):
@@ -251,44 +456,53 @@ class RFMesh():
             clear_outer=False, clear_inner=False
         )
 
+    @profiler.profile
+    def _plane_slice(self, plane: Plane):
+        ''' returns (world endpoints (S,2,3), endpoint ids (S,2)) of segments where plane slices mesh '''
+        plane_local = self.xform.w2l_plane(plane)
+        arrays = self.get_arrays()
+        pts, keys = plane_slice(arrays.co, arrays.tris, np.array(plane_local.o), np.array(plane_local.n))
+        pts = self.xform.l2w_points(pts.reshape((-1, 3))).reshape((-1, 2, 3))
+        return (pts, keys)
+
     @profiler.profile
     def plane_intersection(self, plane: Plane):
-        # TODO: do not duplicate vertices!
-        l2w_point = self.xform.l2w_point
+        ''' returns list of world segments (Point, Point) where plane slices mesh '''
+        pts, _ = self._plane_slice(plane)
+        return [(Point(p0), Point(p1)) for (p0, p1) in pts.tolist()]
+
+    slice_chunk_size = 200000   # triangles sliced per stage
+
+    def plane_intersection_stages(self, plane: Plane):
+        '''
+        generator version of plane_intersection.  triangles are sliced in
+        chunks, and each stage yields (done, total) triangles.  returns same
+        as plane_intersection (use with `yield from`)
+        '''
         plane_local = self.xform.w2l_plane(plane)
-        side = plane_local.side
-        triangle_intersection = plane_local.triangle_intersection
+        arrays = self.get_arrays()
+        pts, _ = yield from plane_slice_stages(
+            arrays.co, arrays.tris, np.array(plane_local.o), np.array(plane_local.n),
+            chunk_size=self.slice_chunk_size
+        )
+        pts = self.xform.l2w_points(pts.reshape((-1, 3))).reshape((-1, 2, 3))
+        return [(Point(p0), Point(p1)) for (p0, p1) in pts.tolist()]
 
-        pr = profiler.start('vert sides')
-        vert_side = {
-            bmv: side(bmv.co)
-            for bmv in self.bme.verts
-        }
-        pr.done()
-        pr = profiler.start('split edges')
-        edges = {
-            bme
-            for bme in self.bme.edges
-            if vert_side[bme.verts[0]] != vert_side[bme.verts[1]]
-        }
-        pr.done()
-        pr = profiler.start('split faces')
-        faces = {
-            bmf
-            for bme in edges
-            for bmf in bme.link_faces
-        }
-        pr.done()
-        pr = profiler.start('intersections')
-        intersection = [
-            (l2w_point(p0), l2w_point(p1))
-            for bmf in faces
-            for (p0, p1) in triangle_intersection([
-                bmv.co for bmv in bmf.verts
-            ])
-        ]
-        pr.done()
-        return intersection
+    @profiler.profile
+    def plane_intersection_polylines(self, plane: Plane):
+        '''
+        returns list of (world Points, is_loop) polylines where plane slices
+        mesh.  loops do not repeat first point
+        '''
+        pts, keys = self._plane_slice(plane)
+        polylines = []
+        for (segs, revs, is_loop) in chain_segments(keys):
+            ends = [pts[i, 1 if rev else 0] for (i, rev) in zip(segs, revs)]
+            if not is_loop:
+                i, rev = segs[-1], revs[-1]
+                ends.append(pts[i, 0 if rev else 1])
+            polylines.append(([Point(p) for p in ends], is_loop))
+        return polylines
 
     def get_xy_plane(self):
         o = self.xform.l2w_point(Point((0, 0, 0)))
@@ -306,102 +520,110 @@ class RFMesh():
         return Plane(o, n)
 
     @profiler.profile
-    def _crawl(self, bmf_start, plane):
+    def _crawl(self, t_start, plane, dists=None, touched=None):
         '''
-        crawl about RFMesh along plane starting with bmf
+        crawl about RFMesh along (local) plane starting with triangle
+        t_start, stepping across triangle adjacency of arrays (see
+        RFMeshArrays.get_adjacency).  returns list of (BMFace, BMEdge,
+        BMFace, local cross point); the BMFaces are None at ends of open
+        crawls.  dists are optional precomputed signed distances of all
+        verts to plane (otherwise, distances are computed as needed).
+        indices of crawled triangles are added to touched list, if given
         '''
-
-        def intersect_edge(bme):
-            bmv0, bmv1 = bme.verts
-            crosses = plane.edge_intersection((bmv0.co, bmv1.co))
-            return crosses[0][0] if crosses else None
-
-        def intersect_face(bmf):
-            crosses = [(bme, intersect_edge(bme)) for bme in bmf.edges]
-            return [(bme, cross) for (bme, cross) in crosses if cross]
+        arrays = self.get_arrays()
+        tris, co, faces, edges, tri_face = arrays.tris, arrays.co, arrays.faces, arrays.edges, arrays.tri_face
+        tri_edges, tri_adj, edge_bmedge = arrays.get_adjacency()
+        (ox, oy, oz), (nx, ny, nz) = plane.o, plane.n
+        od = ox*nx + oy*ny + oz*nz
+
+        def dist(v):
+            if dists is not None: return float(dists[v])
+            x, y, z = co[v].tolist()
+            return x*nx + y*ny + z*nz - od
+
+        def side(d):
+            return 0 if abs(d) < 0.000001 else (-1 if d < 0 else 1)
+
+        def intersect_tri(t):
+            ''' returns [(edge id, cross)] for edges of triangle t crossing plane '''
+            vs = tris[t].tolist()
+            ds = [dist(v) for v in vs]
+            ss = [side(d) for d in ds]
+            crosses = []
+            for k in range(3):
+                k1 = (k + 1) % 3
+                if abs(ss[k] + ss[k1]) == 2: continue
+                if ss[k] == 0: cross = Point(co[vs[k]])
+                elif ss[k1] == 0: cross = Point(co[vs[k1]])
+                else:
+                    f = ds[k] / (ds[k] - ds[k1])
+                    cross = Point(co[vs[k]] + (co[vs[k1]] - co[vs[k]]) * f)
+                crosses.append((k, cross))
+            return crosses
+
+        def face(t): return faces[tri_face[t]] if t >= 0 else None
+
+        def edge(e):
+            e = edge_bmedge[e]
+            return edges[e] if e >= 0 else None
+
+        def walk(t_current, k_next, cross, cross_loop):
+            ''' returns (steps, is_loop) of walk out of triangle t_current across its edge k_next '''
+            steps = []
+            e_next = tri_edges[t_current, k_next]
+            while True:
+                t_next = int(tri_adj[t_current, k_next])
+                if t_next < 0:
+                    steps += [(t_current, e_next, -1, cross)]
+                    return (steps, False)
+                if t_next == t_start:
+                    steps += [(t_current, e_next, t_next, cross_loop)]
+                    return (steps, True)
+                steps += [(t_current, e_next, t_next, cross)]
+                crosses = intersect_tri(t_next)
+                if len(crosses) != 2:
+                    steps += [(t_current, e_next, -1, cross)]
+                    return (steps, False)
+                t_current = t_next
+                k_next_, cross_ = next((
+                    (k, c)
+                    for (k, c) in crosses
+                    if tri_edges[t_current, k] != e_next
+                ), (None, None))
+                if k_next_ is None:
+                    steps += [(t_current, e_next, -1, cross)]
+                    return (steps, False)
+                k_next, cross = k_next_, cross_
+                e_next = tri_edges[t_current, k_next]
+
+        def steps_to_ret(steps):
+            if touched is not None:
+                touched.extend(t for (t0, _, t1, _) in steps for t in (t0, t1) if t >= 0)
+            return [(face(t0), edge(e), face(t1), c) for (t0, e, t1, c) in steps]
 
         # assuming all faces are triangles!
-        ret = []
-        bmf_current = bmf_start
-        crosses = intersect_face(bmf_current)
-        if len(crosses) != 2:
-            return ret
-        bme_start0, bme_start1 = crosses[0][0], crosses[1][0]
-        bme_next = bme_start0
-        cross, cross1 = crosses[0][1], crosses[1][1]
-        while True:
-            bmf_next = next((
-                bmf
-                for bmf in bme_next.link_faces
-                if bmf != bmf_current
-            ), None)
-            if not bmf_next:
-                ret += [(bmf_current, bme_next, None, cross)]
-                break
-            if bmf_next == bmf_start:
-                ret += [(bmf_current, bme_next, bmf_next, cross1)]
-                return ret
-            ret += [(bmf_current, bme_next, bmf_next, cross)]
-            crosses = intersect_face(bmf_next)
-            if len(crosses) != 2:
-                ret += [(bmf_current, bme_next, None, cross)]
-                break
-            bmf_current = bmf_next
-            bme_next_, cross_ = next((
-                (bme, cross)
-                for (bme, cross) in crosses
-                if bme != bme_next
-            ), (None, None))
-            if not bme_next_:
-                ret += [(bmf_current, bme_next, None, cross)]
-                break
-            bme_next, cross = bme_next_, cross_
+        crosses = intersect_tri(t_start)
+        if len(crosses) != 2: return []
+        (k0, cross0), (k1, cross1) = crosses
+        steps, is_loop = walk(t_start, k0, cross0, cross1)
+        ret = steps_to_ret(steps)
+        if is_loop: return ret
 
         # go other way
         ret = [(f1, e, f0, c) for (f0, e, f1, c) in reversed(ret)]
-        bme_next = bme_start1
-        cross = cross1
-        bmf_current = bmf_start
-        while True:
-            bmf_next = next((
-                bmf
-                for bmf in bme_next.link_faces
-                if bmf != bmf_current
-            ), None)
-            if not bmf_next:
-                ret += [(bmf_current, bme_next, None, cross)]
-                break
-            if bmf_next == bmf_start:
-                # PROBLEM!
-                ret += [(bmf_current, bme_next, bmf_next, cross1)]
-                return ret
-            ret += [(bmf_current, bme_next, bmf_next, cross)]
-            crosses = intersect_face(bmf_next)
-            if len(crosses) != 2:
-                ret += [(bmf_current, bme_next, None, cross)]
-                break
-            bmf_current = bmf_next
-            bme_next_, cross_ = next((
-                (bme, cross)
-                for (bme, cross) in crosses
-                if bme != bme_next
-            ), (None, None))
-            if not bme_next_:
-                ret += [(bmf_current, bme_next, None, cross)]
-                break
-            bme_next, cross = bme_next_, cross_
-
-        return ret
+        steps, _ = walk(t_start, k1, cross1, cross1)
+        return ret + steps_to_ret(steps)
+
+    def _wrap_crawl(self, ret):
+        w,l2w_point = self._wrap,self.xform.l2w_point
+        return [(w(f0),w(e),w(f1),l2w_point(c)) for f0,e,f1,c in ret]
 
     @profiler.profile
     def plane_intersection_crawl(self, ray:Ray, plane:Plane):
         ray,plane = self.xform.w2l_ray(ray),self.xform.w2l_plane(plane)
         _,_,i,_ = self.get_bvh().ray_cast(ray.o, ray.d, ray.max)
-        bmf = self.bme.faces[i]
-        ret = self._crawl(bmf, plane)
-        w,l2w_point = self._wrap,self.xform.l2w_point
-        ret = [(w(f0),w(e),w(f1),l2w_point(c)) for f0,e,f1,c in ret]
-        return ret
+        ret = self._crawl(self.get_arrays().face_tri(i), plane)
+        return self._wrap_crawl(ret)
 
     @profiler.profile
     def plane_intersection_walk_crawl(self, ray:Ray, plane:Plane):
@@ -443,69 +665,48 @@ class RFMesh():
         if not bmf: return None
 
         # crawl about self along plane
-        ret = self._crawl(bmf, plane)
-        w,l2w_point = self._wrap,self.xform.l2w_point
-        ret = [(w(f0),w(e),w(f1),l2w_point(c)) for f0,e,f1,c in ret]
-        return ret
+        ret = self._crawl(self.get_arrays().face_tri(bmf.index), plane)
+        return self._wrap_crawl(ret)
 
     @profiler.profile
     def plane_intersections_crawl(self, plane:Plane):
-        plane = self.xform.w2l_plane(plane)
-        w,l2w_point = self._wrap,self.xform.l2w_point
-
-        # find all faces that cross the plane
-        pr = profiler.start('finding all edges crossing plane')
-        dot = plane.n.dot
-        o = dot(plane.o)
-        edges = [bme for bme in self.bme.edges if (dot(bme.verts[0].co)-o) * (dot(bme.verts[1].co)-o) <= 0]
-        pr.done()
-
-        pr = profiler.start('finding faces crossing plane')
-        faces = set(bmf for bme in edges for bmf in bme.link_faces)
-        pr.done()
-
-        pr = profiler.start('crawling faces along plane')
-        rets = []
-        touched = set()
-        for bmf in faces:
-            if bmf in touched: continue
-            ret = self._crawl(bmf, plane)
-            touched |= set(f0 for f0,_,_,_ in ret if f0)
-            touched |= set(f1 for _,_,f1,_ in ret if f1)
-            ret = [(w(f0),w(e),w(f1),l2w_point(c)) for f0,e,f1,c in ret]
-            rets += [ret]
-        pr.done()
-
-        return rets
+        ''' returns crawls of all intersections of plane with RFMesh '''
+        return self.planes_intersections_crawl([plane])[0]
 
     @profiler.profile
-    def plane_intersections_crawl(self, plane:Plane):
-        plane = self.xform.w2l_plane(plane)
-        w,l2w_point = self._wrap,self.xform.l2w_point
-
-        # find all faces that cross the plane
-        pr = profiler.start('finding all edges crossing plane')
-        dot = plane.n.dot
-        o = dot(plane.o)
-        edges = [bme for bme in self.bme.edges if (dot(bme.verts[0].co)-o) * (dot(bme.verts[1].co)-o) <= 0]
-        pr.done()
-
-        pr = profiler.start('finding faces crossing plane')
-        faces = set(bmf for bme in edges for bmf in bme.link_faces)
-        pr.done()
-
-        pr = profiler.start('crawling faces along plane')
+    def planes_intersections_crawl(self, planes):
+        '''
+        returns list of crawls of all intersections for each plane.  vert
+        distances are computed once per distinct plane normal, so many
+        parallel planes (ex: uniform cuts) are sliced in one pass
+        '''
+        arrays = self.get_arrays()
+        planes = [self.xform.w2l_plane(plane) for plane in planes]
+        projections = {}
         rets = []
-        touched = set()
-        for bmf in faces:
-            if bmf in touched: continue
-            ret = self._crawl(bmf, plane)
-            touched |= set(f0 for f0,_,_,_ in ret if f0)
-            touched |= set(f1 for _,_,f1,_ in ret if f1)
-            ret = [(w(f0),w(e),w(f1),l2w_point(c)) for f0,e,f1,c in ret]
-            rets += [ret]
-        pr.done()
+        for plane in planes:
+            pr = profiler.start('finding triangles crossing plane')
+            n = tuple(plane.n)
+            if n not in projections: projections[n] = arrays.co @ np.array(n)
+            dists = projections[n] - np.dot(np.array(plane.o), np.array(n))
+            s = np.sign(dists).astype(np.int8)
+            s[np.abs(dists) < 0.000001] = 0
+            ts = s[arrays.tris]
+            crossing = np.abs(ts.sum(axis=1)) != 3
+            pr.done()
 
+            pr = profiler.start('crawling triangles along plane')
+            crawls = []
+            touched = ~crossing
+            for t in np.flatnonzero(crossing).tolist():
+                if touched[t]: continue
+                touched[t] = True
+                crawled = []
+                ret = self._crawl(t, plane, dists=dists, touched=crawled)
+                touched[crawled] = True
+                crawls += [self._wrap_crawl(ret)]
+            rets += [crawls]
+            pr.done()
         return rets
 
 
@@ -560,6 +761,16 @@ class RFMesh():
         p,n,i,d = self.get_bvh().ray_cast(ray_local.o, ray_local.d, ray_local.max)
         return p is not None
 
+    def raycast_batch(self, origins, dirs, batch_map):
+        ''' batched raycast for Nx3 arrays of world ray origins and directions (see rfmesh_bvh.raycast_batch) '''
+        bbox = self.get_bbox()
+        keep = lambda p: bbox.Point_within(p, margin=1)
+        return raycast_batch(self.get_bvh(), self.xform, origins, dirs, batch_map, keep=keep)
+
+    def nearest_batch(self, points, max_dists, batch_map):
+        ''' batched nearest for Nx3 array of world points (see rfmesh_bvh.nearest_batch) '''
+        return nearest_batch(self.get_bvh(), self.xform, points, max_dists, batch_map)
+
     def nearest(self, point:Point, max_dist=float('inf')): #sys.float_info.max):
         point_local = self.xform.w2l_point(point)
         p,n,i,_ = self.get_bvh().find_nearest(point_local, max_dist)
@@ -568,63 +779,114 @@ class RFMesh():
         d = (point - p).length
         return (p,n,i,d)
 
+    def _verts_co(self, verts=None):
+        '''
+        returns (BMVerts, Nx3 array of local coords) for all verts (from
+        arrays) or given verts
+        '''
+        if verts is None:
+            arrays = self.get_arrays()
+            return (arrays.verts, arrays.co)
+        bmvs = [self._unwrap(bmv) for bmv in verts if bmv.is_valid]
+        co = np.array([tuple(bmv.co) for bmv in bmvs], dtype=np.float64).reshape((-1, 3))
+        return (bmvs, co)
+
+    def _edges_co(self, edges=None):
+        '''
+        returns (BMEdges, Nx3 array, Nx3 array) of local coords of edge
+        endpoints for all edges (from arrays) or given edges
+        '''
+        if edges is None:
+            arrays = self.get_arrays()
+            ev = arrays.edge_verts
+            return (arrays.edges, arrays.co[ev[:,0]], arrays.co[ev[:,1]])
+        bmes = [self._unwrap(bme) for bme in edges if bme.is_valid]
+        co = np.array([
+            tuple(bmv.co) for bme in bmes for bmv in bme.verts
+        ], dtype=np.float64).reshape((-1, 2, 3))
+        return (bmes, co[:,0], co[:,1])
+
+    def _dists2D(self, xy, p2ds):
+        ''' distances from xy to rows of p2ds; NaN rows (unprojectable) are inf '''
+        d = p2ds - np.array(xy)
+        d = np.sqrt((d * d).sum(axis=1))
+        d[np.isnan(d)] = float('inf')
+        return d
+
     def nearest_bmvert_Point(self, point:Point, verts=None):
         if verts is None:
-            verts = self.bme.verts
-        else:
-            verts = [self._unwrap(bmv) for bmv in verts if bmv.is_valid]
-        point_local = self.xform.w2l_point(point)
-        bv,bd = None,None
-        for bmv in verts:
-            d3d = (bmv.co - point_local).length
-            if bv is None or d3d < bd: bv,bd = bmv,d3d
+            nearest = self.nearest_k_bmverts_Point(point, 1)
+            return nearest[0] if nearest else (None,None)
+        bmvs,co = self._verts_co(verts)
+        if not bmvs: return (None,None)
+        point_local = np.array(self.xform.w2l_point(point))
+        d = co - point_local
+        bv = bmvs[int(np.argmin((d * d).sum(axis=1)))]
         bmv_world = self.xform.l2w_point(bv.co)
         return (self._wrap_bmvert(bv),(point-bmv_world).length)
 
     def nearest_bmverts_Point(self, point:Point, dist3d:float):
-        nearest = []
-        for bmv in self.bme.verts:
-            bmv_world = self.xform.l2w_point(bmv.co)
-            d3d = (bmv_world - point).length
-            if d3d > dist3d: continue
-            nearest += [(self._wrap_bmvert(bmv), d3d)]
-        return nearest
+        point_local = self.xform.w2l_point(point)
+        bmvs = self._nearest_bmverts_local(point_local, self.xform.w2l_distance(dist3d))
+        bmvs,co = self._verts_co(bmvs)
+        d = self.xform.l2w_points(co) - np.array(point)
+        d3d = np.sqrt((d * d).sum(axis=1))
+        return [
+            (self._wrap_bmvert(bmvs[i]), float(d3d[i]))
+            for i in np.flatnonzero(d3d <= dist3d)
+        ]
 
-    def nearest_bmedge_Point(self, point:Point, edges=None):
-        if edges is None:
-            edges = self.bme.edges
-        else:
-            edges = [self._unwrap(bme) for bme in edges if bme.is_valid]
-        l2w_point = self.xform.l2w_point
-        be,bd,bpp = None,None,None
-        for bme in self.bme.edges:
-            bmv0,bmv1 = l2w_point(bme.verts[0].co), l2w_point(bme.verts[1].co)
-            diff = bmv1 - bmv0
-            l = diff.length
-            d = diff / l
-            pp = bmv0 + d * max(0, min(l, (point - bmv0).dot(d)))
-            dist = (point - pp).length
-            if be is None or dist < bd: be,bd,bpp = bme,dist,pp
-        if be is None: return (None,None)
-        return (self._wrap_bmedge(be), (point-self.xform.l2w_point(bpp)).length)
+    def nearest_k_bmverts_Point(self, point:Point, k:int):
+        ''' returns list of (RFVert, distance) of (up to) k verts nearest to point, sorted by distance '''
+        kdt, kdt_verts, changed = self.get_kdtree()
+        point_local = self.xform.w2l_point(point)
+        # find k verts that are up to date in tree.  nearest k in local
+        # space are not necessarily nearest in world space (non-uniform
+        # scale), so use them only to bound the radius of a range query
+        n = k
+        while True:
+            bmvs = [kdt_verts[i] for (_, i, _) in kdt.find_n(point_local, n)]
+            bmvs = [bmv for bmv in bmvs if bmv.is_valid and bmv not in changed]
+            if len(bmvs) >= k or n >= len(kdt_verts): break
+            n *= 2
+        bmvs += [bmv for bmv in changed if bmv.is_valid]
+        if not bmvs or k <= 0: return []
+        bmvs,co = self._verts_co(bmvs)
+        d = self.xform.l2w_points(co) - np.array(point)
+        d3d = np.sort(np.sqrt((d * d).sum(axis=1)))
+        dist3d = float(d3d[min(k, len(d3d)) - 1])
+        nearest = self.nearest_bmverts_Point(point, dist3d)
+        return sorted(nearest, key=lambda vd: vd[1])[:k]
+
+    def _edges_dists(self, point:Point, edges=None):
+        ''' returns (BMEdges, world distances from point to each edge) '''
+        bmes,co0,co1 = self._edges_co(edges)
+        if not bmes: return (bmes, np.zeros(0))
+        l2w_points = self.xform.l2w_points
+        p = np.array(point)
+        d = closest_on_segments(p, l2w_points(co0), l2w_points(co1)) - p
+        return (bmes, np.sqrt((d * d).sum(axis=1)))
 
-    def nearest_bmedges_Point(self, point:Point, dist3d:float):
-        l2w_point = self.xform.l2w_point
-        nearest = []
-        for bme in self.bme.edges:
-            bmv0,bmv1 = l2w_point(bme.verts[0].co), l2w_point(bme.verts[1].co)
-            diff = bmv1 - bmv0
-            l = diff.length
-            d = diff / l
-            pp = bmv0 + d * max(0, min(l, (point - bmv0).dot(d)))
-            dist = (point - pp).length
-            if dist > dist3d: continue
-            nearest += [(self._wrap_bmedge(bme), dist)]
-        return nearest
+    def nearest_bmedge_Point(self, point:Point, edges=None):
+        bmes,dists = self._edges_dists(point, edges=edges)
+        if not bmes: return (None,None)
+        i = int(np.argmin(dists))
+        return (self._wrap_bmedge(bmes[i]), float(dists[i]))
+
+    def nearest_bmedges_Point(self, point:Point, dist3d:float, edges=None):
+        bmes,dists = self._edges_dists(point, edges=edges)
+        return [
+            (self._wrap_bmedge(bmes[i]), float(dists[i]))
+            for i in np.flatnonzero(dists <= dist3d)
+        ]
 
-    def nearest2D_bmverts_Point2D(self, xy:Point2D, dist2D:float, Point_to_Point2D, verts=None):
+    def nearest2D_bmverts_Point2D(self, xy:Point2D, dist2D:float, Point_to_Point2D, verts=None, Points_to_Point2Ds=None):
         # TODO: compute distance from camera to point
         # TODO: sort points based on 3d distance
+        if Points_to_Point2Ds:
+            bmvs,co = self._verts_co(verts)
+            d2d = self._dists2D(xy, Points_to_Point2Ds(self.xform.l2w_points(co)))
+            return [(self._wrap_bmvert(bmvs[i]), 0) for i in np.flatnonzero(d2d <= dist2D)]
         if verts is None:
             verts = self.bme.verts
         else:
@@ -638,10 +900,17 @@ class RFMesh():
             nearest += [(self._wrap_bmvert(bmv), d3d)]
         return nearest
 
-    def nearest2D_bmvert_Point2D(self, xy:Point2D, Point_to_Point2D, verts=None, max_dist=None):
+    def nearest2D_bmvert_Point2D(self, xy:Point2D, Point_to_Point2D, verts=None, max_dist=None, Points_to_Point2Ds=None):
         if not max_dist or max_dist < 0: max_dist = float('inf')
         # TODO: compute distance from camera to point
         # TODO: sort points based on 3d distance
+        if Points_to_Point2Ds:
+            bmvs,co = self._verts_co(verts)
+            if not bmvs: return (None,None)
+            d2d = self._dists2D(xy, Points_to_Point2Ds(self.xform.l2w_points(co)))
+            i = int(np.argmin(d2d))
+            if np.isinf(d2d[i]) or d2d[i] > max_dist: return (None,None)
+            return (self._wrap_bmvert(bmvs[i]), float(d2d[i]))
         if verts is None:
             verts = self.bme.verts
         else:
@@ -657,9 +926,15 @@ class RFMesh():
         if bv is None: return (None,None)
         return (self._wrap_bmvert(bv),bd)
 
-    def nearest2D_bmedges_Point2D(self, xy:Point2D, dist2D:float, Point_to_Point2D, edges=None, shorten=0.01):
+    def nearest2D_bmedges_Point2D(self, xy:Point2D, dist2D:float, Point_to_Point2D, edges=None, shorten=0.01, Points_to_Point2Ds=None):
         # TODO: compute distance from camera to point
         # TODO: sort points based on 3d distance
+        if Points_to_Point2Ds:
+            bmes,co0,co1 = self._edges_co(edges)
+            l2w_points = self.xform.l2w_points
+            p0,p1 = Points_to_Point2Ds(l2w_points(co0)),Points_to_Point2Ds(l2w_points(co1))
+            d2d = self._dists2D(xy, closest_on_segments(np.array(xy), p0, p1, shorten=shorten))
+            return [(self._wrap_bmedge(bmes[i]), float(d2d[i])) for i in np.flatnonzero(d2d <= dist2D)]
         edges = self.bme.edges if edges is None else [self._unwrap(bme) for bme in edges]
         l2w_point = self.xform.l2w_point
         nearest = []
@@ -679,8 +954,17 @@ class RFMesh():
             nearest.append((self._wrap_bmedge(bme), math.sqrt(dist2)))
         return nearest
 
-    def nearest2D_bmedge_Point2D(self, xy:Point2D, Point_to_Point2D, edges=None, shorten=0.01, max_dist=None):
+    def nearest2D_bmedge_Point2D(self, xy:Point2D, Point_to_Point2D, edges=None, shorten=0.01, max_dist=None, Points_to_Point2Ds=None):
         if not max_dist or max_dist < 0: max_dist = float('inf')
+        if Points_to_Point2Ds:
+            bmes,co0,co1 = self._edges_co(edges)
+            if not bmes: return (None,None)
+            l2w_points = self.xform.l2w_points
+            p0,p1 = Points_to_Point2Ds(l2w_points(co0)),Points_to_Point2Ds(l2w_points(co1))
+            d2d = self._dists2D(xy, closest_on_segments(np.array(xy), p0, p1, shorten=shorten))
+            i = int(np.argmin(d2d))
+            if np.isinf(d2d[i]) or d2d[i] > max_dist: return (None,None)
+            return (self._wrap_bmedge(bmes[i]), float(d2d[i]))
         if edges is None:
             edges = self.bme.edges
         else:
@@ -757,30 +1041,40 @@ class RFMesh():
 
     ##########################################################
 
-    def _visible_verts(self, is_visible):
+    def _visible_verts(self, is_visible, bmvs=None, is_visible_Points=None):
+        if is_visible_Points:
+            # test all verts at once
+            bmvs, co = self._verts_co(bmvs)
+            vis = is_visible_Points(self.xform.l2w_points(co))
+            return { bmv for (bmv, v) in zip(bmvs, vis) if v }
         l2w_point, l2w_normal = self.xform.l2w_point, self.xform.l2w_normal
         #is_vis = lambda bmv: is_visible(l2w_point(bmv.co), l2w_normal(bmv.normal))
         is_vis = lambda bmv: is_visible(l2w_point(bmv.co), None)
-        return { bmv for bmv in self.bme.verts if is_vis(bmv) }
+        if bmvs is None: bmvs = self.bme.verts
+        return { bmv for bmv in bmvs if is_vis(bmv) }
 
-    def _visible_edges(self, is_visible, bmvs=None):
-        if bmvs is None: bmvs = self._visible_verts(is_visible)
-        return { bme for bme in self.bme.edges if all(bmv in bmvs for bmv in bme.verts) }
+    def _visible_edges(self, is_visible, bmvs=None, is_visible_Points=None):
+        if bmvs is None: bmvs = self._visible_verts(is_visible, is_visible_Points=is_visible_Points)
+        arrays = self.get_arrays()
+        mask = arrays.edges_mask(arrays.verts_mask(bmvs))
+        return { arrays.edges[i] for i in np.flatnonzero(mask) }
 
-    def _visible_faces(self, is_visible, bmvs=None):
-        if bmvs is None: bmvs = self._visible_verts(is_visible)
-        return { bmf for bmf in self.bme.faces if all(bmv in bmvs for bmv in bmf.verts) }
+    def _visible_faces(self, is_visible, bmvs=None, is_visible_Points=None):
+        if bmvs is None: bmvs = self._visible_verts(is_visible, is_visible_Points=is_visible_Points)
+        arrays = self.get_arrays()
+        mask = arrays.faces_mask(arrays.verts_mask(bmvs))
+        return { arrays.faces[i] for i in np.flatnonzero(mask) }
 
-    def visible_verts(self, is_visible):
-        return { self._wrap_bmvert(bmv) for bmv in self._visible_verts(is_visible) }
+    def visible_verts(self, is_visible, is_visible_Points=None):
+        return { self._wrap_bmvert(bmv) for bmv in self._visible_verts(is_visible, is_visible_Points=is_visible_Points) }
 
-    def visible_edges(self, is_visible, verts=None):
+    def visible_edges(self, is_visible, verts=None, is_visible_Points=None):
         bmvs = None if verts is None else { self._unwrap(bmv) for bmv in verts }
-        return { self._wrap_bmedge(bme) for bme in self._visible_edges(is_visible, bmvs=bmvs) }
+        return { self._wrap_bmedge(bme) for bme in self._visible_edges(is_visible, bmvs=bmvs, is_visible_Points=is_visible_Points) }
 
-    def visible_faces(self, is_visible, verts=None):
+    def visible_faces(self, is_visible, verts=None, is_visible_Points=None):
         bmvs = None if verts is None else { self._unwrap(bmv) for bmv in verts }
-        bmfs = { self._wrap_bmface(bmf) for bmf in self._visible_faces(is_visible, bmvs=bmvs) }
+        bmfs = { self._wrap_bmface(bmf) for bmf in self._visible_faces(is_visible, bmvs=bmvs, is_visible_Points=is_visible_Points) }
         #print('seeing %d / %d faces' % (len(bmfs), len(self.bme.faces)))
         return bmfs
 
@@ -821,6 +1115,9 @@ class RFMesh():
         return self.xform.l2w_point(self.selection_center)
 
     def deselect_all(self):
+        self.journal_attrs((bmv for bmv in self.bme.verts if bmv.select), 'select')
+        self.journal_attrs((bme for bme in self.bme.edges if bme.select), 'select')
+        self.journal_attrs((bmf for bmf in self.bme.faces if bmf.select), 'select')
         for bmv in self.bme.verts: bmv.select = False
         for bme in self.bme.edges: bme.select = False
         for bmf in self.bme.faces: bmf.select = False
@@ -852,6 +1149,8 @@ class RFMesh():
                 selems.update(e for e in elem.edges if not (set(e.verts)&elems))
         selems = selems - elems
         selems = { e for e in selems if e.select }
+        self.journal_attrs(nelems, 'select')
+        self.journal_attrs(selems, 'select')
         for elem in nelems: elem.select = False
         for elem in selems: elem.select = True
         if subparts:
@@ -874,6 +1173,7 @@ class RFMesh():
                         if any(e.select for e in bmv.link_edges): continue
                         if any(f.select for f in bmv.link_faces): continue
                         nelems.add(bmv)
+            self.journal_attrs(nelems, 'select')
             for elem in nelems:
                 elem.select = False
         self.dirty(selectionOnly=True)
@@ -895,6 +1195,7 @@ class RFMesh():
                     nelems.update(e for e in elem.verts)
                     nelems.update(e for e in elem.edges)
             elems = nelems
+        self.journal_attrs(elems, 'select')
         for elem in elems: elem.select = True
         if supparts:
             for elem in elems:
@@ -902,9 +1203,11 @@ class RFMesh():
                 if t is not BMVert and t is not RFVert: continue
                 for bme in elem.link_edges:
                     if all(bmv.select for bmv in bme.verts):
+                        self.journal_attr(bme, 'select')
                         bme.select = True
                 for bmf in elem.link_faces:
                     if all(bmv.select for bmv in bmf.verts):
+                        self.journal_attr(bmf, 'select')
                         bmf.select = True
         self.dirty(selectionOnly=True)
 
@@ -1090,6 +1393,9 @@ class RFMesh():
         return (edges, False)
 
     def select_all(self):
+        self.journal_attrs((bmv for bmv in self.bme.verts if not bmv.select), 'select')
+        self.journal_attrs((bme for bme in self.bme.edges if not bme.select), 'select')
+        self.journal_attrs((bmf for bmf in self.bme.faces if not bmf.select), 'select')
         for bmv in self.bme.verts: bmv.select = True
         for bme in self.bme.edges: bme.select = True
         for bmf in self.bme.faces: bmf.select = True
@@ -1115,6 +1421,14 @@ class RFSource(RFMesh):
     @staticmethod
     @profiler.profile
     def new(obj:bpy.types.Object):
+        return run_stages(RFSource.new_stages(obj))
+
+    @staticmethod
+    def new_stages(obj:bpy.types.Object):
+        '''
+        generator version of new.  yields message describing next stage of
+        setting up source, and returns RFSource (use with `yield from`)
+        '''
         assert type(obj) is bpy.types.Object and type(obj.data) is bpy.types.Mesh, 'obj must be mesh object'
 
         # check cache
@@ -1132,7 +1446,7 @@ class RFSource(RFMesh):
             RFSource.creating = True
             rfsource = RFSource()
             del RFSource.creating
-            rfsource.__setup__(obj)
+            yield from rfsource._setup_stages(obj)
             RFSource.__cache[obj.data.name] = rfsource
 
         src = RFSource.__cache[obj.data.name]
@@ -1143,9 +1457,57 @@ class RFSource(RFMesh):
         assert hasattr(RFSource, 'creating'), 'Do not create new RFSource directly!  Use RFSource.new()'
 
     def __setup__(self, obj:bpy.types.Object):
-        super().__setup__(obj, deform=True, triangulate=True, selection=False, keepeme=True)
+        for _ in self._setup_stages(obj): pass
+
+    def _setup_stages(self, obj:bpy.types.Object):
+        disk_cache, key = None, None
+        if options['sources disk cache']:
+            yield 'checking disk cache'
+            disk_cache = RFMeshDiskCache(options.cache_dirpath(), options['sources disk cache size'])
+            key = hash_object_data(obj)
+            # obj depends on data that is not hashed, so do not cache it
+            if key is None: disk_cache = None
+        data = disk_cache.get(key) if disk_cache else None
+        if data is not None:
+            dprint('Loading source %s from disk cache' % obj.name)
+            self.eme = None
+            yield 'loading from disk cache'
+            yield from super()._setup_stages(obj, bme=bmesh_from_cache(data), selection=False)
+        else:
+            yield from super()._setup_stages(obj, deform=True, triangulate=True, selection=False, keepeme=True)
+            if disk_cache:
+                yield 'writing disk cache'
+                disk_cache.put(key, **rfmesh_arrays_to_cache(self))
         self.symmetry = set()
+        yield 'building lookup tables'
         self.ensure_lookup_tables()
+        self.get_arrays()
+        yield 'building BVH'
+        self.get_bvh()
+        self.proxies = []
+        if options['sources proxies']: self.start_proxies()
+
+    def start_proxies(self):
+        ''' starts building decimated proxies in background (only for dense sources) '''
+        arrays = self.get_arrays()
+        if len(arrays.tris) < options['sources proxy min tris']: return
+        RFMeshProxy.executor.submit(
+            build_proxies,
+            arrays.co.copy(), arrays.tris.copy(), arrays.tri_face.copy(), XForm(self.xform),
+            options['sources proxy ratio'], options['sources proxy levels'],
+            self.proxies,
+        )
+
+    def get_proxy(self, max_error):
+        '''
+        returns coarsest proxy built so far with world error at most
+        max_error, or None if there is none (use full resolution)
+        '''
+        best = None
+        for proxy in list(self.proxies):
+            if proxy.world_error > max_error: continue
+            if best is None or len(proxy) < len(best): best = proxy
+        return best
 
 
 
@@ -1200,6 +1562,10 @@ class RFTarget(RFMesh):
             self.mirror_mod.use_z = 'z' in self.symmetry
             self.mirror_mod.merge_threshold = self.symmetry_threshold
         self.editmesh_version = None
+        self.editmesh_changes = self.track_changes()
+        self.editmesh_time = 0
+        self.editmesh_defer = False     # set while a tool operation is in progress
+        self.editmesh_mirror = None
         self.xy_symmetry_accel = xy_symmetry_accel
         self.xz_symmetry_accel = xz_symmetry_accel
         self.yz_symmetry_accel = yz_symmetry_accel
@@ -1261,6 +1627,58 @@ class RFTarget(RFMesh):
         if to_world: point = self.xform.l2w_point(point)
         return point
 
+    @profiler.profile
+    def symmetry_real_points(self, points):
+        '''
+        vectorized symmetry_real for Nx3 array of local points.  only points
+        that symmetry_real would clamp query the symmetry accels; all other
+        points are passed through untouched
+        '''
+        co = np.array(points, dtype=np.float64).reshape((-1, 3))
+        if not self.symmetry or not len(co): return co
+        threshold = self.symmetry_threshold * self.unit_scaling_factor / 2.0
+        # (axis, coord index, 2D coord indices, accel, which side of plane is clamped)
+        planes = [
+            ('x', 0, (1, 2), self.yz_symmetry_accel, -1),
+            ('y', 1, (0, 2), self.xz_symmetry_accel,  1),
+            ('z', 2, (0, 1), self.xy_symmetry_accel, -1),
+        ]
+        for axis,i,(j,k),accel,side in planes:
+            if axis not in self.symmetry: continue
+            if side < 0: clamp = np.flatnonzero(co[:, i] <= threshold)
+            else:        clamp = np.flatnonzero(co[:, i] >= threshold)
+            for idx in clamp:
+                point = Point(co[idx])
+                dist = lambda p: (p - point).length_squared
+                default = Point(point)
+                default[i] = 0
+                edges = accel.get_edges(Point2D((point[j], point[k])), side * point[i])
+                co[idx] = min((e.closest(point) for e in edges), key=dist, default=default)
+        return co
+
+    @profiler.profile
+    def set_coords(self, verts, coords, normals=None):
+        '''
+        sets coords (and normals) of verts in world space, same as setting
+        co (and normal) of each RFVert, but transforms and clamps to symmetry
+        all of the coords at once
+        '''
+        bmvs = [self._unwrap(v) for v in verts]
+        if not bmvs: return
+        co = np.array(coords, dtype=np.float64).reshape((-1, 3))
+        assert len(co) == len(bmvs), 'Expected %d coords, got %d' % (len(bmvs), len(co))
+        assert not np.isnan(co).any(), 'Setting coords to NaN'
+        co = self.symmetry_real_points(self.xform.w2l_points(co))
+        if normals is not None:
+            no = np.array(normals, dtype=np.float64).reshape((-1, 3))
+            assert len(no) == len(bmvs), 'Expected %d normals, got %d' % (len(bmvs), len(no))
+            no = self.xform.w2l_normals(no).tolist()
+        journal_vert = self.journal_vert
+        for (n,(bmv,c)) in enumerate(zip(bmvs, co.tolist())):
+            journal_vert(bmv)
+            bmv.co = c
+            if normals is not None: bmv.normal = no[n]
+
     def __deepcopy__(self, memo):
         '''
         custom deepcopy method, because BMesh and BVHTree are not copyable
@@ -1297,30 +1715,73 @@ class RFTarget(RFMesh):
     def cancel(self):
         self.restore_state()
 
-    def clean(self):
+    def clean(self, force=False):
+        '''
+        writes changes back to edit mesh.  unless forced, writing is deferred
+        while a tool operation is in progress (editmesh_defer) and limited to
+        options['target write rate'] times per second
+        '''
         super().clean()
         if self.editmesh_version == self.get_version(): return
+        if not force:
+            if self.editmesh_defer: return
+            rate = options['target write rate']
+            if rate > 0 and time.time() - self.editmesh_time < 1.0 / rate: return
+        self._write_editmesh()
+
+    @profiler.profile
+    def _write_editmesh(self):
+        me = self.obj.data
+        changes = self.editmesh_changes
+        patch = all([
+            self.editmesh_version is not None,
+            not changes.unknown, not changes.topology,
+            len(me.vertices) == len(self.bme.verts),
+        ])
+        if patch:
+            # only verts moved (and maybe selection changed)
+            if changes.verts: self._patch_editmesh_verts(me, changes.verts)
+            if changes.select: self._copy_selection_to_mesh(me)
+        else:
+            self.bme.to_mesh(me)
+            self._copy_selection_to_mesh(me)
+        changes.reset()
         self.editmesh_version = self.get_version()
-        self.bme.to_mesh(self.obj.data)
-        for bmv,emv in zip(self.bme.verts, self.obj.data.vertices):
-            emv.select = bmv.select
-        for bme,eme in zip(self.bme.edges, self.obj.data.edges):
-            eme.select = bme.select
-        for bmf,emf in zip(self.bme.faces, self.obj.data.polygons):
-            emf.select = bmf.select
-        self.mirror_mod.use_x = 'x' in self.symmetry
-        self.mirror_mod.use_y = 'y' in self.symmetry
-        self.mirror_mod.use_z = 'z' in self.symmetry
-        self.mirror_mod.use_clip = True
-        self.mirror_mod.use_mirror_merge = True
-        self.mirror_mod.merge_threshold = self.symmetry_threshold
+        self.editmesh_time = time.time()
+
+        mirror = (tuple(sorted(self.symmetry)), self.symmetry_threshold)
+        if self.editmesh_mirror != mirror:
+            self.editmesh_mirror = mirror
+            self.mirror_mod.use_x = 'x' in self.symmetry
+            self.mirror_mod.use_y = 'y' in self.symmetry
+            self.mirror_mod.use_z = 'z' in self.symmetry
+            self.mirror_mod.use_clip = True
+            self.mirror_mod.use_mirror_merge = True
+            self.mirror_mod.merge_threshold = self.symmetry_threshold
+
+    def _patch_editmesh_verts(self, me, bmvs):
+        ''' copies coords of bmvs to corresponding verts of me (topology must match) '''
+        bmvs = [bmv for bmv in bmvs if bmv.is_valid]
+        if not bmvs: return
+        if len(bmvs) > len(self.bme.verts) // 8:
+            # many verts moved, so copy all coords at once
+            nv = len(self.bme.verts)
+            co = np.fromiter(chain.from_iterable(bmv.co for bmv in self.bme.verts), dtype=np.float32, count=nv*3)
+            me.vertices.foreach_set('co', co)
+        else:
+            self.bme.verts.index_update()
+            mverts = me.vertices
+            for bmv in bmvs: mverts[bmv.index].co = bmv.co
+        me.update()
 
     def enable_symmetry(self, axis): self.symmetry.add(axis)
     def disable_symmetry(self, axis): self.symmetry.discard(axis)
     def has_symmetry(self, axis): return axis in self.symmetry
 
     def new_vert(self, co, norm):
+        self.journal_topology(verts=[])     # new vert is tracked when co is set
         bmv = self.bme.verts.new((0,0,0))
+        self.journal_new_vert(bmv)
         rfv = self._wrap_bmvert(bmv)
         rfv.co = co
         rfv.normal = norm
@@ -1328,17 +1789,20 @@ class RFTarget(RFMesh):
 
     def new_edge(self, verts):
         verts = [self._unwrap(v) for v in verts]
+        self.journal_topology(verts=verts)
         bme = self.bme.edges.new(verts)
         return self._wrap_bmedge(bme)
 
     def new_face(self, verts):
         verts = [self._unwrap(v) for v in verts]
+        self.journal_topology(verts=verts)
         bmf = self.bme.faces.new(verts)
         self.update_face_normal(bmf)
         return self._wrap_bmface(bmf)
 
     def holes_fill(self, edges, sides):
         edges = list(map(self._unwrap, edges))
+        self.journal_topology(verts={bmv for bme in edges for bmv in bme.verts})
         ret = holes_fill(self.bme, edges=edges, sides=sides)
         print(ret)
 
@@ -1355,11 +1819,14 @@ class RFTarget(RFMesh):
 
 
     def delete_verts(self, verts):
-        for bmv in map(self._unwrap, verts): self.bme.verts.remove(bmv)
+        verts = set(map(self._unwrap, verts))
+        self.journal_topology(verts=verts)
+        for bmv in verts: self.bme.verts.remove(bmv)
 
     def delete_edges(self, edges, del_empty_verts=True):
         edges = set(self._unwrap(e) for e in edges)
         verts = set(v for e in edges for v in e.verts)
+        self.journal_topology(verts=verts)
         for bme in edges: self.bme.edges.remove(bme)
         if del_empty_verts:
             for bmv in verts:
@@ -1369,6 +1836,7 @@ class RFTarget(RFMesh):
         faces = set(self._unwrap(f) for f in faces)
         edges = set(e for f in faces for e in f.edges)
         verts = set(v for f in faces for v in f.verts)
+        self.journal_topology(verts=verts)
         for bmf in faces: self.bme.faces.remove(bmf)
         if del_empty_edges:
             for bme in edges:
@@ -1379,32 +1847,70 @@ class RFTarget(RFMesh):
 
     def dissolve_verts(self, verts, use_face_split=False, use_boundary_tear=False):
         verts = list(map(self._unwrap, verts))
+        self.journal_topology(verts=self._neighborhood(verts))
         dissolve_verts(self.bme, verts=verts, use_face_split=use_face_split, use_boundary_tear=use_boundary_tear)
 
     def dissolve_edges(self, edges, use_verts=False, use_face_split=False):
         edges = list(map(self._unwrap, edges))
+        self.journal_topology(verts=self._neighborhood(bmv for bme in edges for bmv in bme.verts))
         dissolve_edges(self.bme, edges=edges, use_verts=use_verts, use_face_split=use_face_split)
 
     def dissolve_faces(self, faces, use_verts=False):
         faces = list(map(self._unwrap, faces))
+        self.journal_topology(verts=self._neighborhood(bmv for bmf in faces for bmv in bmf.verts))
         dissolve_faces(self.bme, faces=faces, use_verts=use_verts)
 
+    def _neighborhood(self, bmvs):
+        ''' bmvs and all verts of their link faces and link edges '''
+        bmvs = set(bmvs)
+        return bmvs | {
+            bmv
+            for bmv0 in bmvs
+            for bmelems in (bmv0.link_edges, bmv0.link_faces)
+            for bmelem in bmelems
+            for bmv in bmelem.verts
+        }
+
     def update_verts_faces(self, verts):
-        faces = set(f for v in verts for f in self._unwrap(v).link_faces)
-        for bmf in faces:
-            n = compute_normal(v.co for v in bmf.verts)
-            vnorm = sum((v.normal for v in bmf.verts), Vector())
-            if n.dot(vnorm) < 0:
-                bmf.normal_flip()
-            bmf.normal_update()
+        self.update_face_normals(f for v in verts for f in self._unwrap(v).link_faces)
 
     def update_face_normal(self, face):
-        bmf = self._unwrap(face)
-        n = compute_normal(v.co for v in bmf.verts)
-        vnorm = sum((v.normal for v in bmf.verts), Vector())
-        if n.dot(vnorm) < 0:
-            bmf.normal_flip()
-        bmf.normal_update()
+        self.update_face_normals([face])
+
+    @profiler.profile
+    def update_face_normals(self, faces):
+        '''
+        recomputes normals of faces (Newell's method, all faces at once).
+        faces whose winding disagrees with their vert normals are flipped.
+        vert normals are not changed, as they hold the source normals that
+        orient the faces
+        '''
+        bmfs = list({self._unwrap(f) for f in faces})
+        bmfs = [bmf for bmf in bmfs if bmf.is_valid]
+        if not bmfs: return
+        counts = np.fromiter((len(bmf.verts) for bmf in bmfs), dtype=np.int64, count=len(bmfs))
+        bmvs = [bmv for bmf in bmfs for bmv in bmf.verts]
+        nc = len(bmvs)
+        co = np.fromiter(chain.from_iterable(bmv.co for bmv in bmvs), dtype=np.float64, count=nc*3).reshape((nc, 3))
+        no = np.fromiter(chain.from_iterable(bmv.normal for bmv in bmvs), dtype=np.float64, count=nc*3).reshape((nc, 3))
+        starts = np.cumsum(counts) - counts
+        # corners relative to first corner of face, for precision
+        co -= np.repeat(co[starts], counts, axis=0)
+        nxt = np.arange(1, nc + 1)
+        nxt[starts + counts - 1] = starts
+        n = np.add.reduceat(np.cross(co, co[nxt]), starts)
+        vnorm = np.add.reduceat(no, starts)
+        flip = (n * vnorm).sum(axis=1) < 0
+        n[flip] *= -1
+        l = np.sqrt((n * n).sum(axis=1))
+        l[l == 0] = 1
+        n /= l[:, None]
+        self.journal_attrs(bmfs, 'normal')
+        for i in np.flatnonzero(flip):
+            self.journal_flip(bmfs[i])
+            bmfs[i].normal_flip()
+        for bmf,fn in zip(bmfs, n.tolist()):
+            bmf.normal = fn
 
     def clean_duplicate_bmedges(self, vert):
         bmv = self._unwrap(vert)
@@ -1417,6 +1923,7 @@ class RFTarget(RFMesh):
                 if bme0.other_vert(bmv) == bme1.other_vert(bmv):
                     lbme_dup += [(bme0,bme1)]
         mapping = {}
+        if lbme_dup: self.journal_topology(verts=self._neighborhood([bmv]))
         for bme0,bme1 in lbme_dup:
             #if not bme0.is_valid or bme1.is_valid: continue
             l0,l1 = len(bme0.link_faces), len(bme1.link_faces)
@@ -1463,19 +1970,36 @@ class RFTarget(RFMesh):
                 if check: break
         return mapping
 
-    def snap_all_verts(self, nearest):
-        for v in self.get_verts():
-            xyz,norm,_,_ = nearest(v.co)
-            v.co = xyz
-            v.normal = norm
-        self.dirty()
+    snap_chunk_size = 1024      # verts queried per snapping stage
 
-    def snap_selected_verts(self, nearest):
-        for v in self.get_verts():
-            if not v.select: continue
-            xyz,norm,_,_ = nearest(v.co)
-            v.co = xyz
-            v.normal = norm
+    def snap_verts_stages(self, nearest_Points, selected_only=False):
+        '''
+        generator that snaps all (or selected) verts to nearest source
+        points, where nearest_Points is batched (ex: nearest_sources_Points).
+        coords are queried in chunks, and each stage yields (done, total)
+        verts.  verts are only moved after all chunks are queried, in one
+        pass, so closing the generator early leaves target untouched
+        '''
+        arrays = self.get_arrays()
+        idx = np.flatnonzero(arrays.vert_sel) if selected_only else np.arange(len(arrays.verts))
+        bmvs = [arrays.verts[i] for i in idx]
+        co = self.xform.l2w_points(arrays.co[idx])
+        total = len(bmvs)
+        ps,ns = np.full((total, 3), np.nan),np.full((total, 3), np.nan)
+        hit = np.zeros(total, dtype=bool)
+        for i0 in range(0, total, self.snap_chunk_size):
+            i1 = min(total, i0 + self.snap_chunk_size)
+            ps[i0:i1],ns[i0:i1],idxs,_ = nearest_Points(co[i0:i1])
+            hit[i0:i1] = idxs >= 0
+            yield (i1, total)
+        hit = np.flatnonzero(hit)
+        self.set_coords([bmvs[i] for i in hit], ps[hit], ns[hit])
         self.dirty()
 
+    def snap_all_verts(self, nearest_Points):
+        for _ in self.snap_verts_stages(nearest_Points): pass
+
+    def snap_selected_verts(self, nearest_Points):
+        for _ in self.snap_verts_stages(nearest_Points, selected_only=True): pass
+
 
@@ -0,0 +1,299 @@
+'''
+Copyright (C) 2018 CG Cookie
+http://cgcookie.com
+hello@cgcookie.com
+
+Created by Jonathan Denning, Jonathan Williamson
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from itertools import chain
+
+import numpy as np
+
+from ..common.profiler import profiler
+
+
+'''
+RFMeshArrays is a structure-of-arrays copy of a BMesh, used to vectorize
+queries over the whole mesh.  Row i of the vert/edge/face arrays corresponds
+to verts[i], edges[i], faces[i], which are also BMesh element indices (the
+BMesh is index_update'd when arrays are built).
+
+arrays (all in local space):
+
+    co, normal:      (V,3) float   vert coords and normals
+    edge_verts:      (E,2) int     vert indices of each edge
+    face_verts:      (L,)  int     vert indices of all faces, concatenated
+    face_start:      (F,)  int     start of each face in face_verts
+    face_count:      (F,)  int     number of verts of each face
+    tris:            (T,3) int     vert indices of fan-triangulated faces
+    tri_face:        (T,)  int     face index of each triangle
+    vert_sel, edge_sel, face_sel:  bool selection flags
+
+triangle adjacency (see get_adjacency) is built on first use.
+
+NOTE: RFMesh rebuilds these when its version changes (see RFMesh.get_arrays)
+'''
+
+
+class RFMeshArrays:
+    @profiler.profile
+    def __init__(self, bme):
+        bme.verts.index_update()
+        bme.edges.index_update()
+        bme.faces.index_update()
+        self.verts = list(bme.verts)
+        self.edges = list(bme.edges)
+        self.faces = list(bme.faces)
+        nv,ne,nf = len(self.verts),len(self.edges),len(self.faces)
+
+        self.co = np.fromiter(
+            chain.from_iterable(bmv.co for bmv in self.verts),
+            dtype=np.float64, count=nv*3
+        ).reshape((nv, 3))
+        self.normal = np.fromiter(
+            chain.from_iterable(bmv.normal for bmv in self.verts),
+            dtype=np.float64, count=nv*3
+        ).reshape((nv, 3))
+
+        self.edge_verts = np.fromiter(
+            (bmv.index for bme in self.edges for bmv in bme.verts),
+            dtype=np.int32, count=ne*2
+        ).reshape((ne, 2))
+
+        self.face_count = np.fromiter(
+            (len(bmf.verts) for bmf in self.faces),
+            dtype=np.int32, count=nf
+        )
+        self.face_start = np.zeros(nf, dtype=np.int32)
+        if nf: self.face_start[1:] = np.cumsum(self.face_count)[:-1]
+        self.face_verts = np.fromiter(
+            (bmv.index for bmf in self.faces for bmv in bmf.verts),
+            dtype=np.int32, count=int(self.face_count.sum())
+        )
+
+        # fan triangulation (same as bmesh_render.triangulateFace)
+        tri_count = self.face_count - 2
+        self.tri_face = np.repeat(np.arange(nf, dtype=np.int32), tri_count)
+        nt = len(self.tri_face)
+        tri_first = np.zeros(nf, dtype=np.int32)
+        if nf: tri_first[1:] = np.cumsum(tri_count)[:-1]
+        j = np.arange(nt, dtype=np.int32) - tri_first[self.tri_face] + 1
+        base = self.face_start[self.tri_face]
+        loops = np.stack([base, base + j, base + j + 1], axis=1).reshape((nt, 3))
+        self.tris = self.face_verts[loops] if nt else np.zeros((0, 3), dtype=np.int32)
+
+        self.update_selection()
+
+    @profiler.profile
+    def update_selection(self):
+        self.vert_sel = np.fromiter((bmv.select for bmv in self.verts), dtype=bool, count=len(self.verts))
+        self.edge_sel = np.fromiter((bme.select for bme in self.edges), dtype=bool, count=len(self.edges))
+        self.face_sel = np.fromiter((bmf.select for bmf in self.faces), dtype=bool, count=len(self.faces))
+
+    @profiler.profile
+    def get_adjacency(self):
+        '''
+        returns (tri_edges, tri_adj, edge_bmedge).  edge k of triangle t
+        goes from tris[t,k] to tris[t,(k+1)%3]; tri_edges[t,k] is its
+        index into the unique (undirected) triangle edges, tri_adj[t,k] is
+        the triangle across it (-1 if none), and edge_bmedge[e] is index
+        of the BMEdge of triangle edge e (-1 for fan diagonals).
+        NOTE: non-manifold edges only link two of their triangles
+        '''
+        if hasattr(self, '_adjacency'): return self._adjacency
+        nt, nv = len(self.tris), len(self.verts)
+        a, b = self.tris.astype(np.int64), self.tris[:, [1, 2, 0]].astype(np.int64)
+        keys = (np.minimum(a, b) * nv + np.maximum(a, b)).ravel()
+        ukeys, edge = np.unique(keys, return_inverse=True)
+        edge = edge.ravel()
+        tri_edges = edge.reshape((nt, 3))
+
+        # pair up triangle edge slots that share an edge
+        order = np.argsort(edge, kind='mergesort')
+        i = np.flatnonzero(edge[order[1:]] == edge[order[:-1]])
+        tri_adj = np.full(nt * 3, -1, dtype=np.int64)
+        tri_adj[order[i]] = order[i + 1] // 3
+        tri_adj[order[i + 1]] = order[i] // 3
+        tri_adj = tri_adj.reshape((nt, 3))
+
+        ev = self.edge_verts.astype(np.int64)
+        bmkeys = ev.min(axis=1) * nv + ev.max(axis=1)
+        pos = np.clip(np.searchsorted(ukeys, bmkeys), 0, max(0, len(ukeys) - 1))
+        found = np.flatnonzero(ukeys[pos] == bmkeys) if len(ukeys) else np.zeros(0, dtype=np.int64)
+        edge_bmedge = np.full(len(ukeys), -1, dtype=np.int64)
+        edge_bmedge[pos[found]] = found
+
+        self._adjacency = (tri_edges, tri_adj, edge_bmedge)
+        return self._adjacency
+
+    def face_tri(self, face_index):
+        ''' index of first triangle of face '''
+        return int(np.searchsorted(self.tri_face, face_index))
+
+    def verts_mask(self, bmverts):
+        ''' boolean mask over verts that are in bmverts '''
+        mask = np.zeros(len(self.verts), dtype=bool)
+        idx = np.fromiter((bmv.index for bmv in bmverts if bmv.is_valid), dtype=np.int64)
+        mask[idx[(idx >= 0) & (idx < len(self.verts))]] = True
+        return mask
+
+    def edges_mask(self, vert_mask):
+        ''' boolean mask over edges with all verts in vert_mask '''
+        return vert_mask[self.edge_verts].all(axis=1)
+
+    def faces_mask(self, vert_mask):
+        ''' boolean mask over faces with all verts in vert_mask '''
+        mask = np.ones(len(self.faces), dtype=bool)
+        mask[self.tri_face[~vert_mask[self.tris].all(axis=1)]] = False
+        return mask
+
+
+def closest_on_segments(p, p0, p1, shorten=0.0):
+    '''
+    returns closest point on each segment (p0[i],p1[i]) to point p, where
+    p0,p1 are NxD arrays (2D or 3D).  shorten trims that fraction off of
+    each segment (half from each end).  degenerate segments return p0
+    '''
+    diff = p1 - p0
+    l = np.sqrt((diff * diff).sum(axis=1))
+    d = diff / np.where(l == 0, 1.0, l)[:, None]
+    t = np.clip(((p - p0) * d).sum(axis=1), l * (shorten / 2), l * (1 - shorten / 2))
+    return p0 + d * t[:, None]
+
+
+def plane_slice(co, tris, o, n, eps=0.000001):
+    '''
+    slices triangles (T,3 indices into co) with plane (o,n).  returns
+    (points, keys), where points is (S,2,3) endpoints of the S segments and
+    keys is (S,2) int ids of endpoints: shared endpoints of adjacent
+    segments have same id (vert index, or V + id of crossed edge), so
+    segments can be chained (see chain_segments).  verts within eps of
+    plane are on it (same as Plane.side).  triangles that lie in plane or
+    only touch it at a vert are skipped, and segments are unique
+    '''
+    d, s = _plane_sides(co, o, n, eps)
+    return _unique_segments(*_slice_tris(co, d, s, tris))
+
+
+def plane_slice_stages(co, tris, o, n, eps=0.000001, chunk_size=200000):
+    '''
+    generator version of plane_slice.  triangles are sliced in chunks, and
+    each stage yields (done, total) triangles.  returns same as plane_slice
+    (use with `yield from`)
+    '''
+    d, s = _plane_sides(co, o, n, eps)
+    total = len(tris)
+    parts = []
+    for i0 in range(0, total, chunk_size):
+        i1 = min(total, i0 + chunk_size)
+        parts.append(_slice_tris(co, d, s, tris[i0:i1]))
+        yield (i1, total)
+    if not parts: return _no_segments()
+    pts = np.concatenate([p for (p, _) in parts])
+    keys = np.concatenate([k for (_, k) in parts])
+    return _unique_segments(pts, keys)
+
+
+def _no_segments():
+    return (np.zeros((0, 2, 3)), np.zeros((0, 2), dtype=np.int64))
+
+
+def _plane_sides(co, o, n, eps):
+    ''' returns (signed distances, sides as -1/0/+1) of verts to plane '''
+    d = (co - o) @ n
+    s = np.sign(d).astype(np.int8)
+    s[np.abs(d) < eps] = 0
+    return (d, s)
+
+
+def _slice_tris(co, d, s, tris):
+    ''' returns segments (points, keys) of triangles, not yet unique '''
+    nv = len(co)
+    ts = s[tris]
+    # a triangle crosses plane where it has exactly two points on plane:
+    # verts on plane plus edges with verts on opposite sides
+    ea, eb = tris[:, [0, 1, 2]], tris[:, [1, 2, 0]]
+    crossing = (ts[:, [0, 1, 2]] * ts[:, [1, 2, 0]]) < 0
+    onplane = ts == 0
+    valid = np.concatenate([onplane, crossing], axis=1)
+    sel = valid.sum(axis=1) == 2
+    if not sel.any(): return _no_segments()
+    tris, valid = tris[sel], valid[sel]
+    ea, eb = ea[sel], eb[sel]
+
+    da, db = d[ea], d[eb]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(da == db, 0.0, da / (da - db))
+    epts = co[ea] + (co[eb] - co[ea]) * t[:, :, None]
+    lo, hi = np.minimum(ea, eb).astype(np.int64), np.maximum(ea, eb).astype(np.int64)
+    pts = np.concatenate([co[tris], epts], axis=1)                          # (S,6,3)
+    keys = np.concatenate([tris.astype(np.int64), nv + lo * nv + hi], axis=1)  # (S,6)
+
+    # pick the two valid candidates of each triangle
+    pick = np.argsort(~valid, axis=1, kind='mergesort')[:, :2]
+    rows = np.arange(len(pick))[:, None]
+    return (pts[rows, pick], keys[rows, pick])
+
+
+def _unique_segments(pts, keys):
+    ''' edges lying in plane are found by both of their triangles '''
+    if not len(keys): return _no_segments()
+    _, first = np.unique(np.sort(keys, axis=1), axis=0, return_index=True)
+    first.sort()
+    return (pts[first], keys[first])
+
+
+def chain_segments(keys):
+    '''
+    chains segments (S,2 endpoint ids, see plane_slice) that share
+    endpoints.  returns list of (segment indices, reversed flags, is_loop)
+    where reversed[i] means segment is walked from its second endpoint
+    '''
+    keys = np.asarray(keys)
+    ends = {}
+    for i, (k0, k1) in enumerate(keys.tolist()):
+        ends.setdefault(k0, []).append(i)
+        ends.setdefault(k1, []).append(i)
+    used = np.zeros(len(keys), dtype=bool)
+
+    def walk(i, key):
+        ''' walks from segment i out of endpoint key, returns [(segment, reversed)] '''
+        chain = []
+        while True:
+            nxt = [j for j in ends[key] if not used[j]]
+            if not nxt: return chain
+            j = nxt[0]
+            used[j] = True
+            k0, k1 = keys[j]
+            rev = (k1 == key)
+            chain.append((j, rev))
+            key = k0 if rev else k1
+
+    chains = []
+    for i in range(len(keys)):
+        if used[i]: continue
+        used[i] = True
+        k0, k1 = keys[i]
+        fwd = walk(i, k1)
+        if fwd and (keys[fwd[-1][0]][0 if fwd[-1][1] else 1] == k0):
+            chain, is_loop = [(i, False)] + fwd, True
+        else:
+            bwd = walk(i, k0)
+            chain = [(j, not rev) for (j, rev) in reversed(bwd)] + [(i, False)] + fwd
+            is_loop = False
+        chains.append(([j for (j, _) in chain], [rev for (_, rev) in chain], is_loop))
+    return chains
@@ -0,0 +1,343 @@
+'''
+Copyright (C) 2018 CG Cookie
+http://cgcookie.com
+hello@cgcookie.com
+
+Created by Jonathan Denning, Jonathan Williamson
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import numpy as np
+from mathutils import Vector
+from mathutils.bvhtree import BVHTree
+
+from ..common.maths import Point, Normal
+from ..common.utils import BatchMap
+from ..common.profiler import profiler
+
+
+'''
+RFSourcesBVH is a top-level acceleration structure over the world space
+bounding boxes of all RFSources, so queries skip sources they cannot hit.
+
+    ray casts visit sources in order of where the ray enters their boxes,
+    and stop once a hit is nearer than the next box entry.
+    nearest point queries visit sources in order of distance to their boxes,
+    and stop once a hit is nearer than the next box.
+
+sources are few (tens), so the boxes are kept as flat arrays and tested
+all at once rather than arranged into a hierarchy.
+
+optionally, sources with few triangles (ex: eyes, teeth) are merged into
+a single world space BVHTree, so they are queried together.
+
+ray casts can take max_error, which allows dense sources to be replaced by
+their decimated proxies (see RFSource.get_proxy) where the proxy error is
+at most max_error.  proxy_error reports the actual error used.
+
+raycasts and nearests answer whole batches of queries (Nx3 arrays in,
+arrays out).  each source answers its share of a batch at once (see
+raycast_batch and nearest_batch below), so transforms are done with numpy
+rather than per query.
+
+NOTE: sources must not change while RFSourcesBVH is in use
+'''
+
+
+def _normalized(vs):
+    l = np.sqrt((vs * vs).sum(axis=1))
+    l[l == 0] = 1
+    return vs / l[:, None]
+
+
+def _batch_results(count):
+    ''' returns empty batch results: (points, normals, face indices, distances) '''
+    return (np.full((count, 3), np.nan), np.full((count, 3), np.nan), np.full(count, -1), np.full(count, np.inf))
+
+
+def raycast_batch(bvh, xform, origins, dirs, batch_map, keep=None):
+    '''
+    casts world space rays (Nx3 origins and directions) against bvh, which
+    is in local space of xform (or world space if xform is None).  keep can
+    reject local hit points.  returns (points, normals, face indices,
+    distances) arrays in world space; misses are NaN, NaN, -1, inf
+    '''
+    ps, ns, idxs, ds = _batch_results(len(origins))
+    if not len(origins): return (ps, ns, idxs, ds)
+    if xform:
+        o = xform.w2l_points(origins)
+        d = _normalized(xform.w2l_points(origins + dirs) - o)
+    else:
+        o, d = origins, dirs
+    def cast(od):
+        p,n,i,_ = bvh.ray_cast(Vector(od[0]), Vector(od[1]))
+        if p is None or (keep and not keep(p)): return None
+        return (p, n, i)
+    hits = batch_map(cast, zip(o.tolist(), d.tolist()))
+    hit = np.array([h is not None for h in hits], dtype=bool)
+    if not hit.any(): return (ps, ns, idxs, ds)
+    hits = [h for h in hits if h is not None]
+    p = np.array([h[0] for h in hits])
+    n = np.array([h[1] for h in hits])
+    if xform: p, n = xform.l2w_points(p), xform.l2w_normals(n)
+    ps[hit], ns[hit] = p, n
+    idxs[hit] = [h[2] for h in hits]
+    dv = p - origins[hit]
+    ds[hit] = np.sqrt((dv * dv).sum(axis=1))
+    return (ps, ns, idxs, ds)
+
+
+def nearest_batch(bvh, xform, points, max_dists, batch_map):
+    '''
+    finds nearest points on bvh (local space of xform, or world if None) to
+    Nx3 world points, up to world max_dists.  returns same as raycast_batch
+    '''
+    ps, ns, idxs, ds = _batch_results(len(points))
+    if not len(points): return (ps, ns, idxs, ds)
+    if xform:
+        q = xform.w2l_points(points)
+        local_dists = [xform.w2l_distance(md) for md in max_dists.tolist()]
+    else:
+        q, local_dists = points, max_dists.tolist()
+    def find(qd):
+        p,n,i,_ = bvh.find_nearest(Vector(qd[0]), qd[1])
+        return None if p is None else (p, n, i)
+    hits = batch_map(find, zip(q.tolist(), local_dists))
+    hit = np.array([h is not None for h in hits], dtype=bool)
+    if not hit.any(): return (ps, ns, idxs, ds)
+    hits = [h for h in hits if h is not None]
+    p = np.array([h[0] for h in hits])
+    n = np.array([h[1] for h in hits])
+    if xform: p, n = xform.l2w_points(p), xform.l2w_normals(n)
+    ps[hit], ns[hit] = p, n
+    idxs[hit] = [h[2] for h in hits]
+    dv = p - points[hit]
+    ds[hit] = np.sqrt((dv * dv).sum(axis=1))
+    # world distances can exceed max_dist (local max_dist is an upper bound)
+    far = ds > max_dists
+    ps[far], ns[far], idxs[far], ds[far] = np.nan, np.nan, -1, np.inf
+    return (ps, ns, idxs, ds)
+
+
+class RFSourcesBVH:
+    box_margin = 0.0001     # relative to size of scene
+
+    @profiler.profile
+    def __init__(self, rfsources, merge_limit=0, threads=1):
+        '''
+        rfsources with fewer than merge_limit triangles are merged into one
+        BVHTree (if there are at least two of them).  0 disables merging.
+        batched queries are spread over threads
+        '''
+        self.rfsources = list(rfsources)
+        self.batch_map = BatchMap(threads=threads)
+        world = []
+        for rfsource in self.rfsources:
+            arrays = rfsource.get_arrays()
+            world.append((rfsource.xform.l2w_points(arrays.co), arrays.tris, arrays.tri_face))
+
+        merge = [
+            i for (i, (co, tris, _)) in enumerate(world)
+            if len(co) and len(tris) < merge_limit
+        ]
+        if len(merge) < 2: merge = []
+
+        # entries are either an RFSource or None (the merged sources)
+        self.entries = [rfs for (i, rfs) in enumerate(self.rfsources) if i not in merge]
+        cos = [world[i][0] for (i, rfs) in enumerate(self.rfsources) if i not in merge]
+        self.merged_bvh = None
+        if merge:
+            pr = profiler.start('merging small sources')
+            offsets = np.cumsum([0] + [len(world[i][0]) for i in merge])
+            co = np.concatenate([world[i][0] for i in merge])
+            tris = np.concatenate([world[i][1] + offset for (i, offset) in zip(merge, offsets)])
+            self.merged_source = np.concatenate([np.full(len(world[i][1]), i) for i in merge])
+            self.merged_face = np.concatenate([world[i][2] for i in merge])
+            self.merged_bvh = BVHTree.FromPolygons(co.tolist(), tris.tolist(), all_triangles=True)
+            self.entries.append(None)
+            cos.append(co)
+            pr.done()
+
+        self.box_min = np.array([co.min(axis=0) if len(co) else (np.inf,)*3 for co in cos]).reshape((-1, 3))
+        self.box_max = np.array([co.max(axis=0) if len(co) else (-np.inf,)*3 for co in cos]).reshape((-1, 3))
+        ok = np.isfinite(self.box_min).all(axis=1)
+        if ok.any():
+            margin = (self.box_max[ok].max(axis=0) - self.box_min[ok].min(axis=0)).max() * self.box_margin
+            self.box_min[ok] -= margin
+            self.box_max[ok] += margin
+
+    def _merged_hit(self, p, n, i, d):
+        if p is None: return (None,None,None,None,None)
+        return (Point(p), Normal(n), int(self.merged_face[i]), d, self.rfsources[int(self.merged_source[i])])
+
+    def _ray_entries(self, ray):
+        ''' returns indices of entries with boxes hit by ray, sorted by entry distance, and entry distances '''
+        o, d = np.array(ray.o), np.array(ray.d)
+        inside = (self.box_min <= o) & (o <= self.box_max)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t0 = (self.box_min - o) / d
+            t1 = (self.box_max - o) / d
+        parallel = (d == 0)
+        t0 = np.where(parallel, np.where(inside, -np.inf, np.inf), t0)
+        t1 = np.where(parallel, np.inf, t1)
+        tnear = np.minimum(t0, t1).max(axis=1)
+        tfar = np.maximum(t0, t1).min(axis=1)
+        hit = (tnear <= tfar) & (tfar >= 0) & (tnear <= ray.max)
+        tnear = np.maximum(tnear, 0)
+        idx = np.flatnonzero(hit)
+        return (idx[np.argsort(tnear[idx], kind='mergesort')], tnear)
+
+    def _proxy(self, rfsource, max_error):
+        if not max_error: return None
+        return rfsource.get_proxy(max_error)
+
+    def proxy_error(self, max_error):
+        ''' returns max world error of proxies that queries with max_error would use '''
+        if not max_error: return 0
+        proxies = [self._proxy(rfs, max_error) for rfs in self.entries if rfs]
+        return max([proxy.world_error for proxy in proxies if proxy] + [0])
+
+    @profiler.profile
+    def raycast(self, ray, max_error=0):
+        ''' returns (point, normal, face index, distance, RFSource) of nearest hit '''
+        best = (None,None,None,None,None)
+        order, tnear = self._ray_entries(ray)
+        for k in order:
+            if best[0] is not None and best[3] < tnear[k]: break
+            rfsource = self.entries[k]
+            if rfsource:
+                proxy = self._proxy(rfsource, max_error)
+                p,n,i,d = (proxy or rfsource).raycast(ray)
+                hit = (p,n,i,d,rfsource)
+            else:
+                hit = self._merged_hit(*self.merged_bvh.ray_cast(ray.o, ray.d, ray.max))
+            if hit[0] is not None and (best[0] is None or hit[3] < best[3]):
+                best = hit
+        return best
+
+    @profiler.profile
+    def raycast_hit(self, ray, max_error=0):
+        ''' returns whether ray hits any source (not necessarily nearest) '''
+        order, _ = self._ray_entries(ray)
+        for k in order:
+            rfsource = self.entries[k]
+            if rfsource:
+                proxy = self._proxy(rfsource, max_error)
+                if (proxy or rfsource).raycast_hit(ray): return True
+            elif self.merged_bvh.ray_cast(ray.o, ray.d, ray.max)[0] is not None:
+                return True
+        return False
+
+    @profiler.profile
+    def nearest(self, point, max_dist=float('inf')):
+        ''' returns (point, normal, face index, distance, RFSource) of nearest source point '''
+        best = (None,None,None,None,None)
+        p = np.array(point)
+        dv = np.maximum(np.maximum(self.box_min - p, p - self.box_max), 0)
+        dist = np.sqrt((dv * dv).sum(axis=1))
+        dist[np.isnan(dist)] = np.inf
+        for k in np.argsort(dist, kind='mergesort'):
+            bound = max_dist if best[0] is None else min(max_dist, best[3])
+            if dist[k] > bound: break
+            rfsource = self.entries[k]
+            if rfsource:
+                hp,hn,hi,hd = rfsource.nearest(point, max_dist=rfsource.xform.w2l_distance(bound))
+                hit = (hp,hn,hi,hd,rfsource)
+            else:
+                hit = self._merged_hit(*self.merged_bvh.find_nearest(Vector(point), bound))
+                if hit[0] is not None: hit = hit[:3] + ((point - hit[0]).length,) + hit[4:]
+            if hit[0] is not None and hit[3] <= max_dist and (best[0] is None or hit[3] < best[3]):
+                best = hit
+        return best
+
+    def _rays_entries(self, o, d):
+        ''' batched _ray_entries: returns (NxE array of whether box is hit, NxE entry distances) '''
+        o, d = o[:, None, :], d[:, None, :]
+        inside = (self.box_min <= o) & (o <= self.box_max)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t0 = (self.box_min - o) / d
+            t1 = (self.box_max - o) / d
+        parallel = np.broadcast_to(d == 0, t0.shape)
+        t0 = np.where(parallel, np.where(inside, -np.inf, np.inf), t0)
+        t1 = np.where(parallel, np.inf, t1)
+        tnear = np.minimum(t0, t1).max(axis=2)
+        tfar = np.maximum(t0, t1).min(axis=2)
+        return ((tnear <= tfar) & (tfar >= 0), np.maximum(tnear, 0))
+
+    def _merge_batch(self, best, sel, hits, rfsource):
+        ''' keeps hits (for queries sel) that are nearer than best '''
+        ps, ns, idxs, ds, srcs = best
+        p, n, i, d = hits
+        better = d < ds[sel]
+        if not better.any(): return
+        k = sel[better]
+        ps[k], ns[k], idxs[k], ds[k] = p[better], n[better], i[better], d[better]
+        if rfsource:
+            for j in k: srcs[j] = rfsource
+        else:
+            # hits on merged BVH: map merged face indices to sources
+            for (j, mi) in zip(k, i[better]):
+                srcs[j] = self.rfsources[int(self.merged_source[mi])]
+                idxs[j] = int(self.merged_face[mi])
+
+    @profiler.profile
+    def raycasts(self, origins, dirs, max_error=0):
+        '''
+        batched raycast: casts rays given by Nx3 world origins and directions.
+        returns (points, normals, face indices, distances, RFSources) of
+        nearest hits; misses are NaN, NaN, -1, inf, None
+        '''
+        o = np.asarray(origins, dtype=np.float64).reshape((-1, 3))
+        d = _normalized(np.asarray(dirs, dtype=np.float64).reshape((-1, 3)))
+        best = _batch_results(len(o)) + ([None] * len(o),)
+        if not len(o) or not len(self.entries): return best
+        hit, tnear = self._rays_entries(o, d)
+        tnear_hit = np.where(hit, tnear, np.inf)
+        # visit entries nearest to most rays first, so more queries are skipped
+        for k in np.argsort(np.median(tnear_hit, axis=0), kind='mergesort'):
+            sel = np.flatnonzero(hit[:, k] & (tnear[:, k] <= best[3]))
+            if not len(sel): continue
+            rfsource = self.entries[k]
+            if rfsource:
+                target = self._proxy(rfsource, max_error) or rfsource
+                hits = target.raycast_batch(o[sel], d[sel], self.batch_map)
+            else:
+                hits = raycast_batch(self.merged_bvh, None, o[sel], d[sel], self.batch_map)
+            self._merge_batch(best, sel, hits, rfsource)
+        return best
+
+    @profiler.profile
+    def nearests(self, points, max_dist=float('inf')):
+        '''
+        batched nearest: finds nearest source points to Nx3 world points.
+        returns same as raycasts
+        '''
+        p = np.asarray(points, dtype=np.float64).reshape((-1, 3))
+        best = _batch_results(len(p)) + ([None] * len(p),)
+        if not len(p) or not len(self.entries): return best
+        dv = np.maximum(np.maximum(self.box_min - p[:, None, :], p[:, None, :] - self.box_max), 0)
+        dist = np.sqrt((dv * dv).sum(axis=2))
+        dist[np.isnan(dist)] = np.inf
+        for k in np.argsort(np.median(dist, axis=0), kind='mergesort'):
+            bound = np.minimum(best[3], max_dist)
+            sel = np.flatnonzero(dist[:, k] <= bound)
+            if not len(sel): continue
+            rfsource = self.entries[k]
+            if rfsource:
+                hits = rfsource.nearest_batch(p[sel], bound[sel], self.batch_map)
+            else:
+                hits = nearest_batch(self.merged_bvh, None, p[sel], bound[sel], self.batch_map)
+            self._merge_batch(best, sel, hits, rfsource)
+        return best
@@ -0,0 +1,157 @@
+'''
+Copyright (C) 2018 CG Cookie
+http://cgcookie.com
+hello@cgcookie.com
+
+Created by Jonathan Denning, Jonathan Williamson
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+import shutil
+
+import numpy as np
+
+import bpy
+import bmesh
+
+from ..common.debug import dprint
+from ..common.profiler import profiler
+
+
+'''
+RFMeshDiskCache keeps prepared (evaluated and triangulated) source meshes on
+disk, so that a source does not need to be evaluated and triangulated again
+when RetopoFlow is started on an unchanged object, even after restarting
+Blender.
+
+each entry is a folder named by content hash of object data, shape keys,
+modifier stack, and objects deforming it (see hasher.hash_object_data),
+holding numpy arrays:
+
+    co.npy:     (V,3) float32  vert coords (local space)
+    tris.npy:   (T,3) int32    vert indices of triangles
+    smooth.npy: (T,)  bool     smooth shading flag of triangles
+
+objects that depend on data which cannot be hashed (ex: curves) are not
+cached.  arrays are loaded memory-mapped.  when the cache grows larger than
+its size limit, least recently used entries are removed (use is tracked by
+folder modification time).
+
+NOTE: BVHTree cannot be serialized, so it is still built after loading
+'''
+
+
+class RFMeshDiskCache:
+    arrays = ['co', 'tris', 'smooth']
+
+    def __init__(self, path, max_size_mb):
+        self.path = path
+        self.max_size = int(max_size_mb * 1024 * 1024)
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key)
+
+    @profiler.profile
+    def get(self, key):
+        ''' returns dict of (memory-mapped) arrays cached for key, or None '''
+        path = self._entry_path(key)
+        if not os.path.isdir(path): return None
+        try:
+            data = {
+                name: np.load(os.path.join(path, '%s.npy' % name), mmap_mode='r')
+                for name in self.arrays
+            }
+            os.utime(path, None)
+        except Exception as e:
+            dprint('Could not load cached source %s: %s' % (key, str(e)))
+            self._remove(path)
+            return None
+        return data
+
+    @profiler.profile
+    def put(self, key, **data):
+        ''' stores arrays for key, then evicts least recently used entries '''
+        assert set(data.keys()) == set(self.arrays), 'must provide arrays %s' % str(self.arrays)
+        path = self._entry_path(key)
+        # write to temporary folder first, so partial entries are never read
+        path_tmp = '%s.tmp%d' % (path, os.getpid())
+        try:
+            os.makedirs(path_tmp, exist_ok=True)
+            for name in self.arrays:
+                np.save(os.path.join(path_tmp, '%s.npy' % name), data[name])
+            if os.path.isdir(path): self._remove(path)
+            os.rename(path_tmp, path)
+        except Exception as e:
+            dprint('Could not cache source %s: %s' % (key, str(e)))
+            self._remove(path_tmp)
+            return
+        self.evict()
+
+    @profiler.profile
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if not os.path.isdir(path) or '.tmp' in name: continue
+            size = sum(
+                os.path.getsize(os.path.join(path, fn))
+                for fn in os.listdir(path)
+            )
+            entries.append((os.path.getmtime(path), size, path))
+        total = sum(size for (_, size, _) in entries)
+        # always keep the most recently used entry
+        for (_, size, path) in sorted(entries)[:-1]:
+            if total <= self.max_size: break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def rfmesh_arrays_to_cache(rfmesh):
+    ''' returns arrays of (triangulated) rfmesh to store in RFMeshDiskCache '''
+    arrays = rfmesh.get_arrays()
+    smooth = np.fromiter((bmf.smooth for bmf in arrays.faces), dtype=bool, count=len(arrays.faces))
+    return {
+        'co': arrays.co.astype(np.float32),
+        'tris': arrays.tris.astype(np.int32),
+        'smooth': smooth[arrays.tri_face],
+    }
+
+
+@profiler.profile
+def bmesh_from_cache(data):
+    ''' builds BMesh from arrays loaded from RFMeshDiskCache '''
+    co, tris, smooth = data['co'], data['tris'], data['smooth']
+    nv, nt = len(co), len(tris)
+    # Mesh.foreach_set is far faster than adding elements to BMesh one at a time
+    me = bpy.data.meshes.new('RetopoFlow_cache_tmp')
+    try:
+        me.vertices.add(nv)
+        me.loops.add(nt * 3)
+        me.polygons.add(nt)
+        me.vertices.foreach_set('co', np.ascontiguousarray(co, dtype=np.float32).ravel())
+        me.loops.foreach_set('vertex_index', np.ascontiguousarray(tris, dtype=np.int32).ravel())
+        me.polygons.foreach_set('loop_start', np.arange(0, nt * 3, 3, dtype=np.int32))
+        me.polygons.foreach_set('loop_total', np.full(nt, 3, dtype=np.int32))
+        me.polygons.foreach_set('use_smooth', np.ascontiguousarray(smooth, dtype=bool))
+        me.update(calc_edges=True)
+        bme = bmesh.new()
+        bme.from_mesh(me)
+    finally:
+        bpy.data.meshes.remove(me)
+    return bme
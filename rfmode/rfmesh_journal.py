@@ -0,0 +1,418 @@
+'''
+Copyright (C) 2018 CG Cookie
+http://cgcookie.com
+hello@cgcookie.com
+
+Created by Jonathan Denning, Jonathan Williamson
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from copy import copy
+from itertools import chain
+
+import bmesh
+from bmesh.types import BMVert, BMEdge, BMFace
+from mathutils import Vector
+
+from ..common.profiler import profiler
+
+
+'''
+RFMeshJournal records just enough information to revert an RFTarget back
+to the state it was in when the journal was started.  Only the first change
+to an element is recorded (that is the value that needs to be restored).
+
+recorded:
+
+    verts:    local co and normal
+    elements: select, hide, seam, smooth, material_index, face normal
+    target:   settings (symmetry axes and threshold), always
+    faces:    winding flips (from update_face_normal)
+    topology: snapshot of the neighborhood of the verts about to change
+
+topology is restored in place on the existing BMesh.  the verts passed to
+record_topology (core verts) must be the verts whose neighborhood (link
+edges and faces) is about to change, and any created element must use at
+least one core vert (or be a vert registered with record_new_vert).  so,
+an element incident to a core vert is either in the snapshot (it existed
+when the journal started) or was created since.  restoring deletes created
+elements and recreates deleted ones from the snapshot.  elements whose
+verts changed in place (ex: edge_split, vert_splice) are recreated, too.
+
+recreated elements are new BMesh elements, so restore returns a mapping of
+replaced elements.  other journals (undo and redo stacks) must be updated
+with remap(), so their records point at the recreated elements.
+
+custom data (ex: UVs, vertex colors, deform weights) of snapshotted
+elements and of the loops of snapshotted faces is kept in a scratch BMesh
+with the same layers as the target (copied with copy_from), and copied back
+onto recreated elements.
+
+NOTE: journaled element references are BMesh elements (not wrappers)!
+'''
+
+
+class RFMeshJournal:
+    # rough estimates (in bytes) of memory used by each recorded item.
+    # used only to keep undo stack within its memory budget
+    size_base     = 512
+    size_vert     = 160     # BMVert ref + 2 Vectors + dict entry
+    size_attr     = 96
+    size_flip     = 48
+    size_new      = 48
+    size_topo_vert = 260    # snapshot: ref + 2 Vectors + attrs + scratch vert
+    size_topo_edge = 200
+    size_topo_face = 220
+    size_topo_loop = 48     # vert ref + scratch loop
+
+    vert_attrs = ('select', 'hide')
+    edge_attrs = ('select', 'hide', 'seam', 'smooth')
+    face_attrs = ('select', 'hide', 'smooth', 'material_index')
+
+    # settings of RFTarget that are not mesh data, but are undone with it
+    target_attrs = ('symmetry', 'symmetry_threshold')
+
+    # kinds of custom data layers mirrored into scratch BMesh
+    layer_kinds = (
+        'bevel_weight', 'color', 'crease', 'deform', 'face_map', 'float',
+        'freestyle', 'int', 'paint_mask', 'shape', 'skin', 'string', 'tex', 'uv',
+    )
+
+    def __init__(self, rftarget):
+        self.rftarget = rftarget
+        self.coords = {}        # BMVert -> (co, normal), both local
+        self.attrs = {}         # (BMElem, attr) -> value
+        self.flips = set()      # BMFaces that had normal flipped
+        self.core = set()       # BMVerts whose neighborhood changed
+        self.new = set()        # BMElems created since journal started
+        self.topo_verts = {}    # BMVert -> (co, normal, attrs, scratch BMVert)
+        self.topo_edges = {}    # BMEdge -> (BMVerts, attrs, scratch BMEdge)
+        self.topo_faces = {}    # BMFace -> (BMVerts, attrs, scratch BMFace)
+        self.scratch = None     # BMesh holding custom data of snapshot
+        self.inverse = None     # journal from invert(), which restore updates
+        # settings of rftarget when journal started
+        self.settings = {attr: copy(getattr(rftarget, attr)) for attr in self.target_attrs}
+        self._size = self.size_base
+
+    def has_topology(self):
+        return bool(self.core or self.new)
+
+    def get_size(self):
+        return self._size
+
+    ##########################################################
+    # recording
+
+    def record_vert(self, bmv):
+        if bmv in self.coords: return
+        self.coords[bmv] = (Vector(bmv.co), Vector(bmv.normal))
+        self._size += self.size_vert
+
+    def record_attr(self, bmelem, attr):
+        key = (bmelem, attr)
+        if key in self.attrs: return
+        val = getattr(bmelem, attr)
+        if isinstance(val, Vector): val = Vector(val)
+        self.attrs[key] = val
+        self._size += self.size_attr
+
+    def record_flip(self, bmf):
+        # flipping twice is same as not flipping
+        if bmf in self.flips:
+            self.flips.remove(bmf)
+        else:
+            self.flips.add(bmf)
+            self._size += self.size_flip
+
+    def record_new_vert(self, bmv):
+        ''' call right *after* creating a vert that is not connected to core verts '''
+        self.new.add(bmv)
+        self._size += self.size_new
+
+    @profiler.profile
+    def record_topology(self, verts=None):
+        '''
+        call right *before* changing topology around verts (None: all verts)
+        '''
+        if verts is None: verts = self.rftarget.bme.verts
+        core = [bmv for bmv in verts if bmv.is_valid and bmv not in self.core]
+        if not core: return
+        scratch = self._get_scratch()
+        # prior core verts had all of their (then existing) neighborhood
+        # recorded, so unrecorded elements touching them were created since
+        prior,new = self.core,self.new
+        def is_new_vert(bmv):
+            return bmv in new or any(bme.other_vert(bmv) in prior for bme in bmv.link_edges)
+        def is_new(bmelem):
+            return bmelem in new or any(bmv in prior for bmv in bmelem.verts)
+        def snapshot_vert(bmv):
+            if bmv in self.topo_verts or bmv in new: return
+            if is_new_vert(bmv):
+                new.add(bmv)
+                self._size += self.size_new
+                return
+            attrs = {attr: getattr(bmv, attr) for attr in self.vert_attrs}
+            sv = scratch.verts.new()
+            sv.copy_from(bmv)
+            self.topo_verts[bmv] = (Vector(bmv.co), Vector(bmv.normal), attrs, sv)
+            self._size += self.size_topo_vert
+        def scratch_vert(bmv):
+            if bmv in self.topo_verts: return self.topo_verts[bmv][3]
+            # vert is not restored, but its loops still need a scratch vert
+            sv = scratch.verts.new()
+            sv.copy_from(bmv)
+            return sv
+        for bmv in core:
+            snapshot_vert(bmv)
+            for bme in bmv.link_edges:
+                if bme in self.topo_edges or bme in new: continue
+                if is_new(bme):
+                    new.add(bme)
+                    self._size += self.size_new
+                    continue
+                attrs = {attr: getattr(bme, attr) for attr in self.edge_attrs}
+                for bmv_other in bme.verts: snapshot_vert(bmv_other)
+                svs = [scratch_vert(bmv_other) for bmv_other in bme.verts]
+                se = scratch.edges.get(svs) or scratch.edges.new(svs)
+                se.copy_from(bme)
+                self.topo_edges[bme] = (tuple(bme.verts), attrs, se)
+                self._size += self.size_topo_edge
+            for bmf in bmv.link_faces:
+                if bmf in self.topo_faces or bmf in new: continue
+                if is_new(bmf):
+                    new.add(bmf)
+                    self._size += self.size_new
+                    continue
+                attrs = {attr: getattr(bmf, attr) for attr in self.face_attrs}
+                bmvs = tuple(bmf.verts)
+                # record winding from when journal started
+                if bmf in self.flips: bmvs = tuple(reversed(bmvs))
+                for bmv_face in bmvs: snapshot_vert(bmv_face)
+                svs = [scratch_vert(bmv_face) for bmv_face in bmvs]
+                sf = scratch.faces.get(svs) or scratch.faces.new(svs)
+                sf.copy_from(bmf)
+                # scratch face has verts in order of bmvs
+                sloops = {sl.vert: sl for sl in sf.loops}
+                for bml in bmf.loops: sloops[svs[bmvs.index(bml.vert)]].copy_from(bml)
+                self.topo_faces[bmf] = (bmvs, attrs, sf)
+                self._size += self.size_topo_face + len(bmvs) * self.size_topo_loop
+        self.core.update(core)
+
+    def _get_scratch(self):
+        ''' returns scratch BMesh with same custom data layers as target '''
+        if self.scratch is None: self.scratch = bmesh.new()
+        bme = self.rftarget.bme
+        for seq in ('verts', 'edges', 'faces', 'loops'):
+            src,dst = getattr(bme, seq).layers,getattr(self.scratch, seq).layers
+            for kind in self.layer_kinds:
+                src_layers,dst_layers = getattr(src, kind, None),getattr(dst, kind, None)
+                if src_layers is None or dst_layers is None: continue
+                for layer in src_layers:
+                    if dst_layers.get(layer.name) is None: dst_layers.new(layer.name)
+        return self.scratch
+
+    ##########################################################
+    # reverting
+
+    @profiler.profile
+    def invert(self):
+        '''
+        returns a new journal that will revert the restoring of this journal
+        (must be called *before* calling restore)
+        '''
+        journal = RFMeshJournal(self.rftarget)
+        if self.has_topology():
+            journal.record_topology([
+                bmv for bmv in chain(self.core, self.new)
+                if type(bmv) is BMVert and bmv.is_valid
+            ])
+        for bmv in self.coords:
+            if bmv.is_valid: journal.record_vert(bmv)
+        for (bmelem,attr) in self.attrs:
+            if bmelem.is_valid: journal.record_attr(bmelem, attr)
+        journal.flips = {bmf for bmf in self.flips if bmf.is_valid}
+        journal._size += len(journal.flips) * self.size_flip
+        self.inverse = journal
+        return journal
+
+    @profiler.profile
+    def restore(self):
+        '''
+        reverts RFTarget to state when journal was started.  returns mapping
+        of replaced elements (see remap).
+        note: journal is consumed
+        '''
+        rftarget = self.rftarget
+        remap = {}
+        recreated = self._restore_topology(remap) if self.has_topology() else set()
+        def resolve(bmelem):
+            if bmelem.is_valid: return bmelem
+            r = remap.get(id(bmelem))
+            return r[1] if r else None
+        faces = set()
+        for bmv,(co,no) in self.coords.items():
+            bmv = resolve(bmv)
+            if not bmv: continue
+            bmv.co = co
+            bmv.normal = no
+            faces.update(bmv.link_faces)
+        for bmf in self.flips:
+            # recreated faces already have their original winding
+            bmf = resolve(bmf)
+            if bmf and bmf not in recreated: bmf.normal_flip()
+        for bmf in faces:
+            bmf.normal_update()
+        for (bmelem,attr),val in self.attrs.items():
+            bmelem = resolve(bmelem)
+            if bmelem: setattr(bmelem, attr, val)
+        for attr,val in self.settings.items(): setattr(rftarget, attr, copy(val))
+        rftarget.changes_unknown()
+        self.coords,self.attrs,self.flips = {},{},set()
+        self.core,self.new = set(),set()
+        self.topo_verts,self.topo_edges,self.topo_faces = {},{},{}
+        if self.scratch: self.scratch.free()
+        self.scratch = None
+        self.inverse = None
+        self._size = self.size_base
+        return remap
+
+    def _restore_topology(self, remap):
+        ''' returns set of recreated faces; fills remap '''
+        bme = self.rftarget.bme
+        topo_verts,topo_edges,topo_faces = self.topo_verts,self.topo_edges,self.topo_faces
+        core = [bmv for bmv in self.core if bmv.is_valid]
+        new = [bmelem for bmelem in self.new if bmelem.is_valid]
+
+        # delete created elements, and recorded elements whose verts changed
+        # (BMesh cannot reassign verts of existing edges and faces)
+        del_faces = {bmf for bmf in new if type(bmf) is BMFace}
+        del_faces |= {bmf for bmv in core for bmf in bmv.link_faces if bmf not in topo_faces}
+        del_faces |= {
+            bmf for (bmf,(bmvs,_,_)) in topo_faces.items()
+            if bmf.is_valid and set(bmf.verts) != set(bmvs)
+        }
+        del_edges = {bme_ for bme_ in new if type(bme_) is BMEdge}
+        del_edges |= {bme_ for bmv in core for bme_ in bmv.link_edges if bme_ not in topo_edges}
+        del_edges |= {
+            bme_ for (bme_,(bmvs,_,_)) in topo_edges.items()
+            if bme_.is_valid and set(bme_.verts) != set(bmvs)
+        }
+        del_verts = {bmv for bmv in new if type(bmv) is BMVert}
+        del_verts |= {
+            bmv_other
+            for bmv in core for bme_ in bmv.link_edges for bmv_other in bme_.verts
+            if bmv_other not in topo_verts
+        }
+        for bmf in del_faces:
+            if bmf.is_valid: bme.faces.remove(bmf)
+        for bme_ in del_edges:
+            if bme_.is_valid: bme.edges.remove(bme_)
+        for bmv in del_verts:
+            if bmv.is_valid: bme.verts.remove(bmv)
+
+        def resolve(bmelem):
+            if bmelem.is_valid: return bmelem
+            r = remap.get(id(bmelem))
+            return r[1] if r else None
+        def set_attrs(bmelem, attrs):
+            for attr,val in attrs.items(): setattr(bmelem, attr, val)
+
+        # recreate deleted elements
+        inverse = self.inverse
+        for bmv,(co,no,attrs,sv) in topo_verts.items():
+            if bmv.is_valid: continue
+            bmv_new = bme.verts.new(co)
+            bmv_new.copy_from(sv)
+            bmv_new.co = co
+            bmv_new.normal = no
+            set_attrs(bmv_new, attrs)
+            remap[id(bmv)] = (bmv, bmv_new)
+            if inverse: inverse.record_new_vert(bmv_new)
+        for bme_,(bmvs,attrs,se) in topo_edges.items():
+            if bme_.is_valid: continue
+            bmvs = [resolve(bmv) for bmv in bmvs]
+            if None in bmvs: continue
+            bme_new = bme.edges.get(bmvs) or bme.edges.new(bmvs)
+            bme_new.copy_from(se)
+            set_attrs(bme_new, attrs)
+            remap[id(bme_)] = (bme_, bme_new)
+        recreated = set()
+        for bmf,(bmvs,attrs,sf) in topo_faces.items():
+            if bmf.is_valid: continue
+            bmvs = [resolve(bmv) for bmv in bmvs]
+            if None in bmvs: continue
+            bmf_new = bme.faces.get(bmvs) or bme.faces.new(bmvs)
+            bmf_new.copy_from(sf)
+            # scratch face has verts in order of bmvs
+            sloops = {sl.vert: sl for sl in sf.loops}
+            svs = list(sf.verts)
+            for bml in bmf_new.loops: bml.copy_from(sloops[svs[bmvs.index(bml.vert)]])
+            set_attrs(bmf_new, attrs)
+            bmf_new.normal_update()
+            remap[id(bmf)] = (bmf, bmf_new)
+            recreated.add(bmf_new)
+        return recreated
+
+    def remap(self, mapping):
+        ''' updates records to point at elements replaced by restore (see restore) '''
+        if not mapping: return
+        def m(bmelem):
+            r = mapping.get(id(bmelem))
+            return r[1] if r else bmelem
+        self.coords = {m(bmv): v for (bmv,v) in self.coords.items()}
+        self.attrs = {(m(bmelem),attr): v for ((bmelem,attr),v) in self.attrs.items()}
+        self.flips = {m(bmf) for bmf in self.flips}
+        self.core = {m(bmv) for bmv in self.core}
+        self.new = {m(bmelem) for bmelem in self.new}
+        self.topo_verts = {m(bmv): v for (bmv,v) in self.topo_verts.items()}
+        self.topo_edges = {
+            m(bme_): (tuple(map(m, bmvs)), attrs, se)
+            for (bme_,(bmvs,attrs,se)) in self.topo_edges.items()
+        }
+        self.topo_faces = {
+            m(bmf): (tuple(map(m, bmvs)), attrs, sf)
+            for (bmf,(bmvs,attrs,sf)) in self.topo_faces.items()
+        }
+
+
+'''
+RFMeshChanges collects which parts of an RFMesh changed since it was last
+reset, so that consumers (RFMeshRender, visibility acceleration) can update
+incrementally rather than rebuild.  Each consumer gets its own RFMeshChanges
+from RFMesh.track_changes(), which is fed by the same hooks as RFMeshJournal.
+
+collected:
+
+    verts:    BMVerts that moved or whose neighborhood (link edges / faces)
+              changed.  created elements are reachable from these verts;
+              deleted elements are not (check is_valid)
+    select:   whether selection changed
+    topology: whether topology changed (or faces were flipped)
+    unknown:  some change could not be tracked.  consumer must rebuild
+'''
+
+
+class RFMeshChanges:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.verts = set()
+        self.select = False
+        self.topology = False
+        self.unknown = False
+
+    def is_empty(self):
+        return not (self.verts or self.select or self.topology or self.unknown)
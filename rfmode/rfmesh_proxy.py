@@ -0,0 +1,124 @@
+'''
+Copyright (C) 2018 CG Cookie
+http://cgcookie.com
+hello@cgcookie.com
+
+Created by Jonathan Denning, Jonathan Williamson
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from mathutils.bvhtree import BVHTree
+
+from ..common.debug import dprint
+from .rfmesh_bvh import raycast_batch
+
+
+'''
+RFMeshProxy is a decimated copy of a triangulated mesh, used to answer
+latency-sensitive queries (visibility, hovering) on dense sources.  final
+results (ex: snapping verts) should still use the full resolution mesh.
+
+proxies are made by vertex clustering: verts are binned into a grid of
+cubic cells and each cell is replaced by the mean of its verts.  triangles
+that collapse are dropped.  every vert moves at most one cell diagonal, so
+`error` (cell diagonal, local space) approximately bounds the distance
+between the proxy and original surfaces.
+
+building is numpy and BVHTree only (no BMesh), so proxies are built in a
+worker thread (see build_proxies)
+'''
+
+
+class RFMeshProxy:
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    # NOTE: built in worker thread.  DO NOT USE PROFILER HERE (its stack is shared with main thread)!
+    def __init__(self, co, tris, tri_face, cell_size, xform):
+        self.xform = xform
+        self.error = cell_size * math.sqrt(3)
+        self.world_error = xform.l2w_distance(self.error)
+
+        keys = np.floor((co - co.min(axis=0)) / cell_size).astype(np.int64)
+        _, cluster, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+        cluster = cluster.ravel()
+        self.co = np.zeros((len(counts), 3))
+        np.add.at(self.co, cluster, co)
+        self.co /= counts[:, None]
+
+        tris = cluster[tris]
+        keep = (tris[:, 0] != tris[:, 1]) & (tris[:, 1] != tris[:, 2]) & (tris[:, 2] != tris[:, 0])
+        tris, tri_face = tris[keep], tri_face[keep]
+        # drop duplicate triangles (same verts, any order)
+        _, first = np.unique(np.sort(tris, axis=1), axis=0, return_index=True)
+        first.sort()
+        self.tris, self.tri_face = tris[first], tri_face[first]
+
+        self.bvh = BVHTree.FromPolygons(self.co.tolist(), self.tris.tolist(), all_triangles=True)
+
+    def __len__(self):
+        return len(self.tris)
+
+    def raycast(self, ray):
+        ''' returns (point, normal, face index of original mesh, distance) in world space '''
+        ray_local = self.xform.w2l_ray(ray)
+        p,n,i,d = self.bvh.ray_cast(ray_local.o, ray_local.d, ray_local.max)
+        if p is None: return (None,None,None,None)
+        p_w,n_w = self.xform.l2w_point(p), self.xform.l2w_normal(n)
+        return (p_w, n_w, int(self.tri_face[i]), (ray.o - p_w).length)
+
+    def raycast_batch(self, origins, dirs, batch_map):
+        ''' batched raycast; face indices are of original mesh '''
+        ps,ns,idxs,ds = raycast_batch(self.bvh, self.xform, origins, dirs, batch_map)
+        hit = idxs >= 0
+        idxs[hit] = self.tri_face[idxs[hit]]
+        return (ps,ns,idxs,ds)
+
+    def raycast_hit(self, ray):
+        ray_local = self.xform.w2l_ray(ray)
+        return self.bvh.ray_cast(ray_local.o, ray_local.d, ray_local.max)[0] is not None
+
+
+def proxy_cell_sizes(co, tris, ratio, levels):
+    '''
+    returns cell sizes so each level has about ratio times as many
+    triangles as previous level.  clustering a surface of area A with cells
+    of size c leaves about A/c^2 verts, or twice as many triangles
+    '''
+    v0, v1, v2 = co[tris[:, 0]], co[tris[:, 1]], co[tris[:, 2]]
+    area = 0.5 * np.sqrt((np.cross(v1 - v0, v2 - v0) ** 2).sum(axis=1)).sum()
+    sizes = []
+    for level in range(1, levels + 1):
+        count = len(tris) * (ratio ** level)
+        if count < 1: break
+        sizes.append(math.sqrt(2 * area / count))
+    return sizes
+
+
+def build_proxies(co, tris, tri_face, xform, ratio, levels, proxies):
+    '''
+    builds proxies and appends them to proxies list as they finish.
+    coarsest proxy is built first, so something is available quickly
+    '''
+    try:
+        for cell_size in reversed(proxy_cell_sizes(co, tris, ratio, levels)):
+            proxy = RFMeshProxy(co, tris, tri_face, cell_size, xform)
+            dprint('Built source proxy: %d tris, error %f' % (len(proxy), proxy.world_error))
+            proxies.append(proxy)
+    except Exception as e:
+        dprint('Could not build source proxy: %s' % str(e))
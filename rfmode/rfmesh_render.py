@@ -45,7 +45,7 @@ from ..common.maths import Point2D, Vec2D, Direction2D
 from ..common.maths import Ray, XForm, BBox, Plane
 from ..common.ui import Drawing
 from ..common.utils import min_index
-from ..common.hasher import hash_object, hash_bmesh
+from ..common.hasher import hash_object
 from ..common.decorators import stats_wrapper
 from ..common import bmesh_render as bmegl
 from ..common.bmesh_render import BGLBufferedRender, triangulateFace
@@ -105,7 +105,7 @@ class RFMeshRender():
     @profiler.profile
     def new(rfmesh, opts, always_dirty=False):
         ho = hash_object(rfmesh.obj)
-        hb = hash_bmesh(rfmesh.bme)
+        hb = rfmesh.get_hash()
         h = (ho, hb)
         if h not in RFMeshRender.cache:
             RFMeshRender.creating = True
@@ -135,6 +135,9 @@ class RFMeshRender():
         self.buf_matrix_inverse = rfmesh.xform.to_bglMatrix_Inverse()
         self.buf_matrix_normal = rfmesh.xform.to_bglMatrix_Normal()
         self.buffered_renders = []
+        self.buffered_elems = []        # elems (one per primitive) for each buffered render
+        self.buffered_verts = []        # BMVerts (one per buffered vertex) for each buffered render
+        self.vert_offsets = None        # BMVert -> [(render index, offset)], built lazily
         self.drawing = Drawing.get_instance()
 
         self.replace_rfmesh(rfmesh)
@@ -149,28 +152,103 @@ class RFMeshRender():
             del self.buf_matrix_normal
         if hasattr(self, 'buffered_renders'):
             del self.buffered_renders
+        if hasattr(self, 'buffered_elems'):
+            del self.buffered_elems
+        if hasattr(self, 'buffered_verts'):
+            del self.buffered_verts
+        if hasattr(self, 'vert_offsets'):
+            del self.vert_offsets
 
     @profiler.profile
     def replace_opts(self, opts):
         self.opts = opts
         self.opts['dpi mult'] = self.drawing.get_dpi_mult()
         self.rfmesh_version = None
+        self.rfmesh_version_selection = None
 
     @profiler.profile
     def replace_rfmesh(self, rfmesh):
+        if getattr(self, 'rfmesh_changes', None):
+            self.rfmesh.untrack_changes(self.rfmesh_changes)
         self.rfmesh = rfmesh
         self.bmesh = rfmesh.bme
+        self.rfmesh_changes = rfmesh.track_changes()
         self.rfmesh_version = None
+        self.rfmesh_version_selection = None
 
     @profiler.profile
     def add_buffered_render(self, bgl_type, data):
         buffered_render = BGLBufferedRender(bgl_type)
         buffered_render.buffer(data['vco'], data['vno'], data['sel'], data['idx'])
         self.buffered_renders.append(buffered_render)
+        self.buffered_elems.append(data['elems'])
+        self.buffered_verts.append(data['verts'])
+        self.vert_offsets = None
+
+    @profiler.profile
+    def _gather_selection(self):
+        '''
+        only selection has changed, so re-upload only selection VBOs.
+        order of elements matches what _gather_data buffered
+        '''
+        def sel(g):
+            return 1.0 if g.select else 0.0
+        for buffered_render,elems in zip(self.buffered_renders, self.buffered_elems):
+            n = buffered_render.gl_count
+            buffered_render.buffer_selection([
+                sel(elem)
+                for elem in elems
+                for _ in range(n)
+            ])
+
+    @staticmethod
+    def _offset_ranges(offsets, gap=32):
+        '''
+        merges offsets into (start, end) ranges.  offsets that are within
+        gap of each other are merged, as one larger upload is cheaper than
+        many tiny ones
+        '''
+        ranges = []
+        for offset in sorted(offsets):
+            if ranges and offset <= ranges[-1][1] + gap:
+                ranges[-1][1] = offset + 1
+            else:
+                ranges.append([offset, offset + 1])
+        return ranges
+
+    @profiler.profile
+    def _patch_verts(self, bmverts):
+        '''
+        only verts have moved (topology is unchanged), so patch just the
+        affected ranges of position and normal VBOs
+        '''
+        if not bmverts: return
+        if self.vert_offsets is None:
+            pr = profiler.start('building vert offsets')
+            self.vert_offsets = {}
+            for ri,verts in enumerate(self.buffered_verts):
+                for offset,bmv in enumerate(verts):
+                    self.vert_offsets.setdefault(bmv, []).append((ri, offset))
+            pr.done()
+        patch = {}
+        for bmv in bmverts:
+            for ri,offset in self.vert_offsets.get(bmv, []):
+                patch.setdefault(ri, []).append(offset)
+        for ri,offsets in patch.items():
+            buffered_render,verts = self.buffered_renders[ri],self.buffered_verts[ri]
+            for i0,i1 in self._offset_ranges(offsets):
+                buffered_render.buffer_subdata(
+                    i0,
+                    [tuple(bmv.co) for bmv in verts[i0:i1]],
+                    [tuple(bmv.normal) for bmv in verts[i0:i1]],
+                )
 
     @profiler.profile
     def _gather_data(self):
         self.buffered_renders = []
+        self.buffered_elems = []
+        self.buffered_verts = []
+        self.vert_offsets = None
 
         def gather():
             vert_count = 100000
@@ -220,6 +298,12 @@ class RFMeshRender():
                                 for bmv in verts
                             ],
                             'idx': None,  # list(range(len(tri_faces)*3)),
+                            'elems': [bmf for bmf, verts in tri_faces[i0:i1]],
+                            'verts': [
+                                bmv
+                                for bmf, verts in tri_faces[i0:i1]
+                                for bmv in verts
+                            ],
                         }
                         if self.async_load:
                             self.buf_data_queue.put((bgl.GL_TRIANGLES, face_data))
@@ -248,6 +332,12 @@ class RFMeshRender():
                                 for bmv in bme.verts
                             ],
                             'idx': None,  # list(range(len(self.bmesh.edges)*2)),
+                            'elems': self.bmesh.edges[i0:i1],
+                            'verts': [
+                                bmv
+                                for bme in self.bmesh.edges[i0:i1]
+                                for bmv in bme.verts
+                            ],
                         }
                         if self.async_load:
                             self.buf_data_queue.put((bgl.GL_LINES, edge_data))
@@ -264,6 +354,8 @@ class RFMeshRender():
                             'vno': [tuple(bmv.normal) for bmv in verts[i0:i1]],
                             'sel': [sel(bmv) for bmv in verts[i0:i1]],
                             'idx': None,  # list(range(len(self.bmesh.verts))),
+                            'elems': verts[i0:i1],
+                            'verts': verts[i0:i1],
                         }
                         if self.async_load:
                             self.buf_data_queue.put((bgl.GL_POINTS, vert_data))
@@ -352,10 +444,31 @@ class RFMeshRender():
         try:
             # return if rfmesh hasn't changed
             self.rfmesh.clean()
-            ver = self.rfmesh.get_version()
+            ver = self.rfmesh.get_version(selection=False)
+            ver_sel = self.rfmesh.get_selection_version()
             if self.rfmesh_version == ver and not self.always_dirty:
-                profiler.start('--> is clean').done()
-                return
+                if self.rfmesh_version_selection == ver_sel:
+                    profiler.start('--> is clean').done()
+                    return
+                if not self._is_loading:
+                    # only selection changed; geometry buffers are still good
+                    self.rfmesh_version_selection = ver_sel
+                    self.rfmesh_changes.select = False
+                    self._gather_selection()
+                    profiler.start('--> selection only').done()
+                    return
+            elif not self._is_loading and not self.always_dirty:
+                changes = self.rfmesh_changes
+                if self.rfmesh_version is not None and not (changes.unknown or changes.topology):
+                    # only verts moved (and maybe selection changed)
+                    moved,selected = changes.verts,changes.select
+                    self.rfmesh_version = ver
+                    self.rfmesh_version_selection = ver_sel
+                    changes.reset()
+                    self._patch_verts(moved)
+                    if selected: self._gather_selection()
+                    profiler.start('--> patched').done()
+                    return
             # profiler.start(
             #     '--> versions: "%s",
             #     "%s"' % (str(self.rfmesh_version),
@@ -363,6 +476,8 @@ class RFMeshRender():
             # ).done()
             # make not dirty first in case bad things happen while drawing
             self.rfmesh_version = ver
+            self.rfmesh_version_selection = ver_sel
+            self.rfmesh_changes.reset()
             self._gather_data()
         except:
             Debugger.print_exception()
@@ -20,6 +20,7 @@ Created by Jonathan Denning, Jonathan Williamson
 '''
 
 import math
+import weakref
 
 import bmesh
 from bmesh.types import BMesh, BMVert, BMEdge, BMFace
@@ -57,12 +58,24 @@ user-writable properties:
     common: hide, index. select, tag
 
 NOTE: RFVert, RFEdge, RFFace do NOT mark RFMesh as dirty!
+NOTE: changes made through wrappers are journaled for undo.
+
+wrappers are interned: while a wrapper is alive, wrapping the same BMesh
+element again returns that wrapper rather than allocating a new one.  the
+identity map holds wrappers weakly and is reset by wrap() (RFTarget.rewrap,
+which is also called after undo restores a BMesh).  wrappers use __slots__,
+so attributes cannot be added to them.
 '''
 
 
 class BMElemWrapper:
+    __slots__ = ('bmelem', '_hash', '__weakref__')
+
+    _interned = weakref.WeakValueDictionary()
+
     @staticmethod
     def wrap(rftarget):
+        BMElemWrapper._interned = weakref.WeakValueDictionary()
         BMElemWrapper.rftarget = rftarget
         BMElemWrapper.xform = rftarget.xform
         BMElemWrapper.l2w_point = rftarget.xform.l2w_point
@@ -79,14 +92,24 @@ class BMElemWrapper:
             return bmelem.bmelem
         return bmelem
 
-    def __init__(self, bmelem):
-        self.bmelem = bmelem
+    def __new__(cls, bmelem):
+        if isinstance(bmelem, BMElemWrapper): bmelem = bmelem.bmelem
+        interned = BMElemWrapper._interned
+        wrapper = interned.get(bmelem)
+        # element memory can be reused, so check wrapper still matches
+        if wrapper is not None and type(wrapper) is cls and wrapper.bmelem.is_valid:
+            return wrapper
+        wrapper = object.__new__(cls)
+        wrapper.bmelem = bmelem
+        wrapper._hash = hash(bmelem)
+        interned[bmelem] = wrapper
+        return wrapper
 
     def __repr__(self):
         return '<BMElemWrapper: %s>' % repr(self.bmelem)
 
     def __hash__(self):
-        return hash(self.bmelem)
+        return self._hash
 
     def __eq__(self, other):
         if other is None:
@@ -104,6 +127,7 @@ class BMElemWrapper:
 
     @hide.setter
     def hide(self, v):
+        self.rftarget.journal_attr(self.bmelem, 'hide')
         self.bmelem.hide = v
 
     @property
@@ -120,6 +144,7 @@ class BMElemWrapper:
 
     @select.setter
     def select(self, v):
+        self.rftarget.journal_attr(self.bmelem, 'select')
         self.bmelem.select = v
 
     @property
@@ -130,13 +155,21 @@ class BMElemWrapper:
     def tag(self, v):
         self.bmelem.tag = v
 
+    @property
+    def is_valid(self):
+        return self.bmelem.is_valid
+
     def __getattr__(self, k):
-        if k in self.__dict__:
-            return getattr(self, k)
+        # only called when normal lookup fails, so slots that are not yet set
+        # (ex: bmelem during construction) must not recurse
+        if k in BMElemWrapper.__slots__:
+            raise AttributeError(k)
         return getattr(self.bmelem, k)
 
 
 class RFVert(BMElemWrapper):
+    __slots__ = ()
+
     def __repr__(self):
         return '<RFVert: %s>' % repr(self.bmelem)
 
@@ -147,6 +180,7 @@ class RFVert(BMElemWrapper):
     @co.setter
     def co(self, co):
         assert not any(math.isnan(v) for v in co), 'Setting RFVert.co to ' + str(co)
+        self.rftarget.journal_vert(self.bmelem)
         self.bmelem.co = self.symmetry_real(co, to_world=False)
 
     @property
@@ -155,6 +189,7 @@ class RFVert(BMElemWrapper):
 
     @normal.setter
     def normal(self, norm):
+        self.rftarget.journal_vert(self.bmelem)
         self.bmelem.normal = self.w2l_normal(norm)
 
     @property
@@ -191,14 +226,18 @@ class RFVert(BMElemWrapper):
     def merge(self, other):
         bmv0 = BMElemWrapper._unwrap(self)
         bmv1 = BMElemWrapper._unwrap(other)
+        self.rftarget.journal_topology(verts=[bmv0, bmv1])
         vert_splice(bmv1, bmv0)
 
     def dissolve(self):
         bmv = BMElemWrapper._unwrap(self)
+        self.rftarget.journal_topology(verts=self.rftarget._neighborhood([bmv]))
         vert_dissolve(bmv)
 
 
 class RFEdge(BMElemWrapper):
+    __slots__ = ()
+
     def __repr__(self):
         return '<RFEdge: %s>' % repr(self.bmelem)
 
@@ -208,6 +247,7 @@ class RFEdge(BMElemWrapper):
 
     @seam.setter
     def seam(self, v):
+        self.rftarget.journal_attr(self.bmelem, 'seam')
         self.bmelem.seam = v
 
     @property
@@ -216,6 +256,7 @@ class RFEdge(BMElemWrapper):
 
     @smooth.setter
     def smooth(self, v):
+        self.rftarget.journal_attr(self.bmelem, 'smooth')
         self.bmelem.smooth = v
 
     def first_vert(self):
@@ -402,12 +443,15 @@ class RFEdge(BMElemWrapper):
     def split(self, vert=None, fac=0.5):
         bme = BMElemWrapper._unwrap(self)
         bmv = BMElemWrapper._unwrap(vert) or bme.verts[0]
+        self.rftarget.journal_topology(verts=bme.verts)
         bme_new, bmv_new = edge_split(bme, bmv, fac)
+        self.rftarget.journal_vert(bmv_new)
         return RFEdge(bme_new), RFVert(bmv_new)
 
     def collapse(self):
         bme = BMElemWrapper._unwrap(self)
         bmv0, bmv1 = bme.verts
+        self.rftarget.journal_topology(verts=self.rftarget._neighborhood([bmv0, bmv1]))
         del_faces = [f for f in bme.link_faces if len(f.verts) == 3]
         for bmf in del_faces:
             self.rftarget.bme.faces.remove(bmf)
@@ -416,6 +460,8 @@ class RFEdge(BMElemWrapper):
 
 
 class RFFace(BMElemWrapper):
+    __slots__ = ()
+
     def __repr__(self):
         return '<RFFace: %s>' % repr(self.bmelem)
 
@@ -425,6 +471,7 @@ class RFFace(BMElemWrapper):
 
     @material_index.setter
     def material_index(self, v):
+        self.rftarget.journal_attr(self.bmelem, 'material_index')
         self.bmelem.material_index = v
 
     @property
@@ -433,6 +480,7 @@ class RFFace(BMElemWrapper):
 
     @normal.setter
     def normal(self, v):
+        self.rftarget.journal_attr(self.bmelem, 'normal')
         self.bmelem.normal = self.w2l_normal(v)
 
     @property
@@ -441,6 +489,7 @@ class RFFace(BMElemWrapper):
 
     @smooth.setter
     def smooth(self, v):
+        self.rftarget.journal_attr(self.bmelem, 'smooth')
         self.bmelem.smooth = v
 
     @property
@@ -566,6 +615,7 @@ class RFFace(BMElemWrapper):
     def merge(self, other):
         # find vert of other that is closest to self's v0
         verts0, verts1 = list(self.bmelem.verts), list(other.bmelem.verts)
+        self.rftarget.journal_topology(verts=verts0 + verts1)
         l = len(verts0)
         assert l == len(verts1), 'RFFaces must have same vert count'
         self.rftarget.bme.faces.remove(self._unwrap(other))
@@ -593,6 +643,7 @@ class RFFace(BMElemWrapper):
 
     def split(self, vert_a, vert_b):
         bmf = BMElemWrapper._unwrap(self)
+        self.rftarget.journal_topology(verts=bmf.verts)
         bmva = BMElemWrapper._unwrap(vert_a)
         bmvb = BMElemWrapper._unwrap(vert_b)
         bmf_new, bml_new = face_split(bmf, bmva, bmvb)
@@ -364,6 +364,7 @@ class RFMode(Operator):
 
     def save_backup(self):
         filepath = options.temp_filepath('blend')
+        if hasattr(self, 'rfctx'): self.rfctx.commit()
         dprint('saving backup to %s' % filepath)
         if os.path.exists(filepath): os.remove(filepath)
         self.restore_window_state(ignore_panels=True)
@@ -371,6 +372,7 @@ class RFMode(Operator):
         self.overwrite_window_state()
 
     def save_normal(self):
+        if hasattr(self, 'rfctx'): self.rfctx.commit()
         self.restore_window_state(ignore_panels=True)
         bpy.ops.wm.save_mainfile()
         self.overwrite_window_state()
@@ -350,12 +350,14 @@ class RFTool_Loops(RFTool):
         mouse_delta = self.rfcontext.actions.mouse - self.mouse_down
         a,b = self.vector, self.tangent.dot(mouse_delta) * self.tangent
         percent = clamp(self.percent_start + a.dot(b) / a.dot(a), -1, 1)
+        bmvs,cos = [],[]
         for bmv in self.slide_data.keys():
             vecs = self.slide_data[bmv]['left' if percent > 0 else 'right']
             co = self.slide_data[bmv]['orig']
             delta = sum((v*percent for v in vecs), Vec((0,0,0))) / len(vecs)
-            bmv.co = co + delta
-            self.rfcontext.snap_vert(bmv)
+            bmvs.append(bmv)
+            cos.append(co + delta)
+        self.rfcontext.snap_verts(bmvs, cos)
 
     @profiler.profile
     def draw_postview(self):
@@ -352,7 +352,8 @@ class RFTool_PolyPen(RFTool):
             return 'main'
 
         if self.next_state == 'tri-quad':
-            hit_pos = self.rfcontext.actions.hit_pos
+            # actions.hit_pos may be on a proxy, so cast again at full resolution
+            hit_pos,_,_,_ = self.rfcontext.raycast_sources_mouse()
             if not hit_pos:
                 self.rfcontext.undo_cancel()
                 return 'main'
@@ -354,7 +354,7 @@ class RFTool_PolyStrips(RFTool, RFTool_PolyStrips_Ops):
             if xyz: cbpt.xyz = xyz
 
         for strip in self.mod_strips:
-            strip.update(self.rfcontext.nearest_sources_Point, self.rfcontext.raycast_sources_Point, self.rfcontext.update_face_normal)
+            strip.update(self.rfcontext.nearest_sources_Points, self.rfcontext.raycast_sources_Points, self.rfcontext.update_face_normals, self.rfcontext.set_coords)
 
         self.update_strip_viz()
 
@@ -414,7 +414,7 @@ class RFTool_PolyStrips(RFTool, RFTool_PolyStrips_Ops):
                 cbpt.xyz = nr.eval(od / ov.dot(nr.d))
 
         for strip in self.hovering_strips:
-            strip.update(self.rfcontext.nearest_sources_Point, self.rfcontext.raycast_sources_Point, self.rfcontext.update_face_normal)
+            strip.update(self.rfcontext.nearest_sources_Points, self.rfcontext.raycast_sources_Points, self.rfcontext.update_face_normals, self.rfcontext.set_coords)
 
         self.update_strip_viz()
 
@@ -446,10 +446,8 @@ class RFTool_PolyStrips(RFTool, RFTool_PolyStrips_Ops):
             return 'main'
 
         delta = Vec2D(self.rfcontext.actions.mouse - self.mousedown)
-        set2D_vert = self.rfcontext.set2D_vert
-        for bmv,xy in self.bmverts:
-            if not bmv.is_valid: continue
-            set2D_vert(bmv, xy + delta)
+        moves = [(bmv, xy + delta) for bmv,xy in self.bmverts if bmv.is_valid]
+        if moves: self.rfcontext.set2D_verts(*zip(*moves))
         self.rfcontext.update_verts_faces(v for v,_ in self.bmverts)
         self.update()
 
@@ -524,15 +522,15 @@ class RFTool_PolyStrips(RFTool, RFTool_PolyStrips_Ops):
         vec1 = self.rfcontext.actions.mouse - self.scale_from
         scale = vec1.length / vec0.length
 
-        snap2D_vert = self.rfcontext.snap2D_vert
-        snap_vert = self.rfcontext.snap_vert
+        bmvs,cos = [],[]
         for bmv in self.scale_bmv.keys():
             l = self.scale_bmv[bmv]
             n = Vector()
             for c,v,sc in l:
                 n += c + v * max(0, 1 + (scale-1) * sc)
-            bmv.co = n / len(l)
-            snap_vert(bmv)
+            bmvs.append(bmv)
+            cos.append(n / len(l))
+        self.rfcontext.snap_verts(bmvs, cos)
 
 
     def draw_postview(self):
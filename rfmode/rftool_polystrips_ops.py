@@ -419,7 +419,7 @@ class RFTool_PolyStrips_Ops:
                     assert False, 'Unexpected state'
             self.strokes = strokes
 
-            map(self.rfcontext.update_face_normal, all_bmfaces)
+            self.rfcontext.update_face_normals(all_bmfaces)
             self.rfcontext.select(all_bmfaces)
 
         def merge_faces():
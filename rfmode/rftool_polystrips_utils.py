@@ -22,6 +22,7 @@ Created by Jonathan Denning, Jonathan Williamson
 import bgl
 import bpy
 import math
+import numpy as np
 from mathutils import Vector, Matrix
 from mathutils.geometry import intersect_line_line_2d
 from .rftool import RFTool
@@ -301,24 +302,28 @@ class RFTool_PolyStrips_Strip:
             if diffdir.dot(der) < 0: rot = -rot
             self.bmes += [(bme, t, rad, rot, off_cross, off_der, off_norm)]
     
-    def update(self, nearest_sources_Point, raycast_sources_Point, update_face_normal):
+    def update(self, nearest_sources_Points, raycast_sources_Points, update_face_normals, set_coords):
         self.curve.tessellate_uniform(lambda p,q:(p-q).length, split=10)
         length = self.curve.approximate_totlength_tessellation()
-        for bme,t,rad,rot,off_cross,off_der,off_norm in self.bmes:
-            pos,norm,_,_ = raycast_sources_Point(self.curve.eval(t))
-            if not norm: continue
+        if not self.bmes: return
+        poss,norms,idxs,_ = raycast_sources_Points([self.curve.eval(t) for _,t,_,_,_,_,_ in self.bmes])
+        bmvs,cos = [],[]
+        for (k,(bme,t,rad,rot,off_cross,off_der,off_norm)) in enumerate(self.bmes):
+            if idxs[k] < 0: continue
+            pos,norm = Vector(poss[k]),Vector(norms[k])
             der = self.curve.eval_derivative(t).normalized()
             cross = der.cross(norm).normalized()
             center = pos + der * off_der + cross * off_cross + norm * off_norm
             rotcross = (Matrix.Rotation(rot, 3, norm) * cross).normalized()
             p0 = center - rotcross * rad
             p1 = center + rotcross * rad
-            bmv0,bmv1 = bme.verts
-            v0,_,_,_ = raycast_sources_Point(p0)
-            v1,_,_,_ = raycast_sources_Point(p1)
-            if not v0: v0,_,_,_ = nearest_sources_Point(p0)
-            if not v1: v1,_,_,_ = nearest_sources_Point(p1)
-            bmv0.co = v0
-            bmv1.co = v1
-        for bmf in self.bmf_strip:
-            update_face_normal(bmf)
+            bmvs += bme.verts
+            cos += [p0, p1]
+        if bmvs:
+            # snap to sources under points, or to nearest if nothing is under
+            vs,_,idxs,_ = raycast_sources_Points(cos)
+            miss = np.flatnonzero(idxs < 0)
+            if len(miss): vs[miss] = nearest_sources_Points(np.array(cos)[miss])[0]
+            ok = np.flatnonzero(~np.isnan(vs).any(axis=1))
+            set_coords([bmvs[i] for i in ok], vs[ok])
+        update_face_normals(self.bmf_strip)
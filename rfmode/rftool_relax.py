@@ -191,7 +191,10 @@ class RFTool_Relax(RFTool):
         opt_face_angles = options['relax face angles']
         opt_mult = options['relax force multiplier']
 
-        is_visible = lambda bmv: self.rfcontext.is_visible(bmv.co, bmv.normal)
+        def are_visible(bmvs):
+            bmvs = list(bmvs)
+            vis = self.rfcontext.is_visible_Points([tuple(bmv.co) for bmv in bmvs], [tuple(bmv.normal) for bmv in bmvs])
+            return { bmv for (bmv,v) in zip(bmvs, vis) if v }
 
         time_delta = self.rfcontext.actions.time_delta
         strength = (5.0 / opt_steps) * self.rfwidget.strength * time_delta
@@ -266,13 +269,15 @@ class RFTool_Relax(RFTool):
                         displace[bmv1] -= fvec1 * f_mag
 
             # update
+            if vistest and opt_mask_hidden: visible = are_visible(displace)
+            moves = []
             for bmv in displace:
                 if bmv not in verts: continue
                 if bmv not in vert_strength: continue
                 if self.sel_only and not bmv.select: continue
                 if opt_mask_boundary and bmv.is_boundary: continue
-                if vistest and opt_mask_hidden and not is_visible(bmv): continue
+                if vistest and opt_mask_hidden and bmv not in visible: continue
                 if opt_mask_selected and bmv.select: continue
                 f = displace[bmv] * (opt_mult * vert_strength[bmv])
-                bmv.co += f
-                self.rfcontext.snap_vert(bmv)
+                moves.append((bmv, bmv.co + f))
+            if moves: self.rfcontext.snap_verts(*zip(*moves))
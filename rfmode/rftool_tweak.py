@@ -141,11 +141,15 @@ class RFTool_Tweak(RFTool):
         self.rfcontext.undo_push('tweak move')
         Point_to_Point2D = self.rfcontext.Point_to_Point2D
         get_strength_dist = self.rfwidget.get_strength_dist
-        def is_visible(bmv): return self.rfcontext.is_visible(bmv.co, bmv.normal)
+        def are_visible(bmvs):
+            vis = self.rfcontext.is_visible_Points([tuple(bmv.co) for bmv in bmvs], [tuple(bmv.normal) for bmv in bmvs])
+            return { bmv for (bmv,v) in zip(bmvs, vis) if v }
         self.bmverts = [(bmv, Point_to_Point2D(bmv.co), get_strength_dist(d3d)) for bmv,d3d in nearest]
         if self.sel_only: self.bmverts = [(bmv,p2d,s) for bmv,p2d,s in self.bmverts if bmv.select]
         if opt_mask_boundary: self.bmverts = [(bmv,p2d,s) for bmv,p2d,s in self.bmverts if not bmv.is_boundary]
-        if opt_mask_hidden:   self.bmverts = [(bmv,p2d,s) for bmv,p2d,s in self.bmverts if is_visible(bmv)]
+        if opt_mask_hidden:
+            visible = are_visible([bmv for bmv,_,_ in self.bmverts])
+            self.bmverts = [(bmv,p2d,s) for bmv,p2d,s in self.bmverts if bmv in visible]
         if opt_mask_selected: self.bmverts = [(bmv,p2d,s) for bmv,p2d,s in self.bmverts if not bmv.select]
         self.bmfaces = set([f for bmv,_ in nearest for f in bmv.link_faces])
         self.mousedown = self.rfcontext.actions.mousedown
@@ -160,13 +164,11 @@ class RFTool_Tweak(RFTool):
             return 'main'
 
         delta = Vec2D(self.rfcontext.actions.mouse - self.mousedown)
-        set2D_vert = self.rfcontext.set2D_vert
-        update_face_normal = self.rfcontext.update_face_normal
-
-        for bmv,xy,strength in self.bmverts:
-            set2D_vert(bmv, xy + delta*strength)
-        for bmf in self.bmfaces:
-            update_face_normal(bmf)
+        self.rfcontext.set2D_verts(
+            [bmv for bmv,_,_ in self.bmverts],
+            [xy + delta*strength for _,xy,strength in self.bmverts],
+        )
+        self.rfcontext.update_face_normals(self.bmfaces)
 
     def draw_postview(self): pass
     def draw_postpixel(self): pass